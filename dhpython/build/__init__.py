@@ -18,11 +18,17 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 # THE SOFTWARE.
 
+import json
 import logging
+from hashlib import sha256
+from fnmatch import fnmatch
 from glob import glob1
-from os.path import dirname
+from os import getcwd, listdir, makedirs, stat
+from os.path import abspath, dirname, join
+from dhpython.tools import write_atomic
 
 log = logging.getLogger('dhpython')
+DETECTION_CACHE = '.pybuild/detected.json'
 
 plugins = {}
 for i in sorted(i[7:-3] for i in glob1(dirname(__file__), 'plugin_*.py')):
@@ -36,3 +42,96 @@ for i in sorted(i[7:-3] for i in glob1(dirname(__file__), 'plugin_*.py')):
             log.debug("cannot initialize '%s' plugin", i, exc_info=True)
         else:
             log.debug("cannot initialize '%s' plugin: %s", i, err)
+
+
+def detection_cache(dpath):
+    """Return path to the file with detection result for given directory
+
+    Each subproject (see pybuild --subproject) gets its own file.
+    """
+    dpath = abspath(dpath)
+    if dpath == getcwd():
+        return DETECTION_CACHE
+    return '.pybuild/detected-{}.json'.format(sha256(dpath.encode()).hexdigest()[:16])
+
+
+def _detection_files(dpath):
+    """Return names of files that match any plugin's file templates"""
+    tpls = set()
+    for plugin in plugins.values():
+        for tpl in list(plugin.REQUIRED_FILES) + list(plugin.OPTIONAL_FILES):
+            tpls.update(tpl.split('|'))
+    try:
+        names = listdir(dpath)
+    except OSError:
+        return []
+    return sorted(i for i in names if any(fnmatch(i, tpl) for tpl in tpls))
+
+
+def _detection_mtimes(dpath, files):
+    """Return mtimes of files detection depends on (None if missing)"""
+    # some plugins check debian/control and pyproject.toml in CWD
+    paths = {join(dpath, 'debian/control'), abspath('debian/control'),
+             abspath('pyproject.toml')}
+    paths.update(join(dpath, fn) for fn in files)
+    result = {}
+    for path in paths:
+        try:
+            result[path] = stat(path).st_mtime_ns
+        except OSError:
+            result[path] = None
+    return result
+
+
+def save_detection(plugin, certainty, context):
+    """Store autodetection result for next pybuild invocations"""
+    files = set()
+    for i in (plugin.DETECTED_REQUIRED_FILES, plugin.DETECTED_OPTIONAL_FILES):
+        for names in i.values():
+            files.update(names)
+    dpath = abspath(context['dir'])
+    data = {'dir': dpath,
+            'plugins': sorted(plugins),
+            'plugin': plugin.NAME,
+            'certainty': certainty,
+            'args': context['args'],
+            'required_files': plugin.DETECTED_REQUIRED_FILES,
+            'optional_files': plugin.DETECTED_OPTIONAL_FILES,
+            'matching_files': _detection_files(dpath),
+            'mtimes': _detection_mtimes(dpath, files)}
+    try:
+        fpath = detection_cache(dpath)
+        makedirs(dirname(fpath), exist_ok=True)
+        write_atomic(fpath, json.dumps(data))
+    except (IOError, TypeError) as err:
+        log.debug('cannot save detection result: %s', err)
+
+
+def load_detection(cfg, env):
+    """Return (plugin, certainty, context) detected in previous invocation
+
+    None is returned if there's no saved result or if one of the files
+    the detection was based on changed.
+    """
+    try:
+        with open(detection_cache(cfg.dir), encoding='utf-8') as fp:
+            data = json.load(fp)
+    except (IOError, ValueError):
+        return None
+    dpath = abspath(cfg.dir)
+    if data['dir'] != dpath or data['plugins'] != sorted(plugins):
+        return None
+    if data['matching_files'] != _detection_files(dpath):
+        log.debug('files added or removed since last build system detection')
+        return None
+    if data['mtimes'] != _detection_mtimes(dpath, (
+            fn for i in (data['required_files'], data['optional_files'])
+            for names in i.values() for fn in names)):
+        log.debug('files changed since last build system detection')
+        return None
+
+    plugin = plugins[data['plugin']](cfg)
+    plugin.DETECTED_REQUIRED_FILES = data['required_files']
+    plugin.DETECTED_OPTIONAL_FILES = data['optional_files']
+    context = {'ENV': env, 'args': data['args'], 'dir': cfg.dir}
+    return plugin, data['certainty'], context
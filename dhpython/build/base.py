@@ -19,13 +19,18 @@
 # THE SOFTWARE.
 
 import logging
+import re
 from functools import wraps
+from hashlib import sha256
 from glob import glob1
-from os import remove, walk
-from os.path import exists, isdir, join
+from fnmatch import fnmatch
+from os import makedirs, remove, scandir, sep
+from os.path import abspath, exists, isdir, join, relpath
 from subprocess import Popen, PIPE
-from shutil import rmtree, copyfile, copytree
-from dhpython.tools import execute
+from shlex import split
+from shutil import copyfile, copytree, rmtree
+from dhpython.build import engine, timings
+from dhpython.tools import clean_bytecode, execute, locked, memoize, trash
 try:
     from shlex import quote
 except ImportError:
@@ -36,6 +41,12 @@ except ImportError:
         return "'" + s.replace("'", "'\"'\"'") + "'"
 
 log = logging.getLogger('dhpython')
+# user supplied arguments with these characters are passed via shell
+SHELL_CHARS_RE = re.compile(r'[$`|;&<>*?()\[\]~!#\n]')
+# removed directories are moved here first (see dhpython.tools.trash)
+TRASH_DIR = '.pybuild'
+XDIST_ARGS_RE = re.compile(r'(^|\s)(-n|--numprocesses|-p\s*no:xdist)\b')
+UNITTEST_RAN_RE = re.compile(r'^Ran (\d+) tests? in', re.MULTILINE)
 
 
 def copy_test_files(dest='{build_dir}',
@@ -46,7 +57,7 @@ def copy_test_files(dest='{build_dir}',
 
         @wraps(func)
         def __copy_test_files(self, context, args, *oargs, **kwargs):
-            files_to_copy = {'test', 'tests'}
+            files_to_copy = ['test', 'tests']
             # check debian/pybuild_pythonX.Y.testfiles
             for tpl in ('_{i}{v}', '_{i}{m}', ''):
                 tpl = tpl.format(i=args['interpreter'].name,
@@ -60,30 +71,116 @@ def copy_test_files(dest='{build_dir}',
                                          if not line.startswith('#')]
                         break
 
-            files_to_remove = set()
+            side_effect(context, 'copy_files', src_dir=args['dir'], names=files_to_copy,
+                        dst_dir=dest.format(**args),
+                        filelist=filelist and filelist.format(**args))
             for name in files_to_copy:
-                src_dpath = join(args['dir'], name)
-                dst_dpath = join(dest.format(**args), name.rsplit('/', 1)[-1])
-                if exists(src_dpath):
-                    if not exists(dst_dpath):
-                        if isdir(src_dpath):
-                            copytree(src_dpath, dst_dpath)
-                        else:
-                            copyfile(src_dpath, dst_dpath)
-                        files_to_remove.add(dst_dpath + '\n')
-                    if not args['args'] and 'PYBUILD_TEST_ARGS' not in context['ENV']\
-                       and (self.cfg.test_pytest or self.cfg.test_nose) \
-                       and name in add_to_args:
-                        args['args'] = name
-            if files_to_remove and filelist:
-                with open(filelist.format(**args), 'a') as fp:
-                    fp.writelines(files_to_remove)
+                if exists(join(args['dir'], name)) and not args['args'] \
+                   and 'PYBUILD_TEST_ARGS' not in context['ENV'] \
+                   and (self.cfg.test_pytest or self.cfg.test_nose) \
+                   and name in add_to_args:
+                    args['args'] = name
 
             return func(self, context, args, *oargs, **kwargs)
         return __copy_test_files
     return _copy_test_files
 
 
+def copy_files(src_dir, names, dst_dir, filelist=None):
+    """Copy files (or directories) missing in dst_dir, list them in filelist"""
+    files_to_remove = set()
+    # destination can be shared by concurrent pybuild invocations
+    with locked(join('.pybuild', 'testfiles.lock')):
+        for name in names:
+            src_dpath = join(src_dir, name)
+            dst_dpath = join(dst_dir, name.rsplit('/', 1)[-1])
+            if exists(src_dpath) and not exists(dst_dpath):
+                if isdir(src_dpath):
+                    copytree(src_dpath, dst_dpath)
+                else:
+                    copyfile(src_dpath, dst_dpath)
+                files_to_remove.add(dst_dpath + '\n')
+        if files_to_remove and filelist:
+            with open(filelist, 'a') as fp:
+                fp.write(''.join(sorted(files_to_remove)))
+
+
+def clean_dir(dpath, names):
+    """Remove version independent files (CLEAN_FILES, byte-code)
+
+    Concurrent pybuild invocations wait for the first one to finish it.
+    """
+    lock = join('.pybuild', 'clean_{}.lock'.format(
+        sha256(dpath.encode('utf-8')).hexdigest()[:16]))
+    with locked(lock, blocking=False) as acquired:
+        if not acquired:
+            # another pybuild instance is cleaning the same tree
+            log.debug('waiting for concurrent clean of %s', dpath)
+            with locked(lock):
+                return
+        for fn in names:
+            path = join(dpath, fn)
+            if isdir(path):
+                try:
+                    trash(path, TRASH_DIR)
+                except Exception:
+                    log.debug('cannot remove %s', path)
+            elif exists(path):
+                try:
+                    remove(path)
+                except Exception:
+                    log.debug('cannot remove %s', path)
+
+        freed = clean_bytecode(dpath)
+        if freed:
+            log.info('removed byte-compiled files from %s (%d bytes freed)',
+                     dpath, freed)
+
+
+def remove_matching(dpath, pattern):
+    """Remove files and directories matching glob pattern"""
+    for fname in glob1(dpath, pattern):
+        fpath = join(dpath, fname)
+        rmtree(fpath) if isdir(fpath) else remove(fpath)
+
+
+# side effects of steps, described in pybuild --plan's entries (see
+# :func:`dhpython.build.plan.execute_entry`)
+ACTIONS = {'copy_files': copy_files,
+           'clean_dir': clean_dir,
+           'remove_matching': remove_matching}
+
+
+def side_effect(context, action, **kwargs):
+    """Invoke one of ACTIONS or, if only a plan is built, add it to the plan
+
+    Actions are invoked in the same order as commands in plan entries.
+    """
+    plan = context.get('plan')
+    if plan is not None:
+        item = dict(kwargs, action=action)
+        if not plan or plan[-1] != item:  # f.e. decorated method and its super()
+            plan.append(item)
+    else:
+        ACTIONS[action](**kwargs)
+
+
+def remove_test_files(home_dir):
+    """Remove files copied by :func:copy_test_files (before install step)"""
+    fpath = join(home_dir, 'testfiles_to_rm_before_install')
+    if not exists(fpath):
+        return
+    with open(fpath) as fp:
+        for line in fp:
+            path = line.strip('\n')
+            if exists(path):
+                if isdir(path):
+                    trash(path, TRASH_DIR)
+                else:
+                    remove(path)
+    remove(fpath)
+
+
 class Base:
     """Base class for build system plugins
 
@@ -109,6 +206,8 @@ class Base:
 
     def __init__(self, cfg):
         self.cfg = cfg
+        # source directories already cleaned by :meth:clean_tree
+        self.cleaned_dirs = set()
 
     def __repr__(self):
         return "BuildSystem(%s)" % self.NAME
@@ -160,45 +259,15 @@ class Base:
 
     def clean(self, context, args):
         if self.cfg.test_tox:
-            tox_dir = join(args['dir'], '.tox')
-            if isdir(tox_dir):
-                try:
-                    rmtree(tox_dir)
-                except Exception:
-                    log.debug('cannot remove %s', tox_dir)
-
-        for fn in self.CLEAN_FILES:
-            path = join(context['dir'], fn)
-            if isdir(path):
-                try:
-                    rmtree(path)
-                except Exception:
-                    log.debug('cannot remove %s', path)
-            elif exists(path):
-                try:
-                    remove(path)
-                except Exception:
-                    log.debug('cannot remove %s', path)
-
-        for root, dirs, file_names in walk(context['dir']):
-            for name in dirs:
-                if name == '__pycache__':
-                    dpath = join(root, name)
-                    log.debug('removing dir: %s', dpath)
-                    try:
-                        rmtree(dpath)
-                    except Exception:
-                        log.debug('cannot remove %s', dpath)
-                    else:
-                        dirs.remove(name)
-            for fn in file_names:
-                if fn.endswith(('.pyc', '.pyo')):
-                    fpath = join(root, fn)
-                    log.debug('removing: %s', fpath)
-                    try:
-                        remove(fpath)
-                    except Exception:
-                        log.debug('cannot remove %s', fpath)
+            # tox environments depend on Python version
+            side_effect(context, 'remove_matching', dpath=args['dir'], pattern='.tox')
+        # files that do not depend on Python version are removed
+        # only once per pybuild invocation (or in each entry of the plan,
+        # they can be invoked in different source trees)
+        dpath = abspath(context['dir'])
+        if dpath not in self.cleaned_dirs or context.get('plan') is not None:
+            self.cleaned_dirs.add(dpath)
+            side_effect(context, 'clean_dir', dpath=dpath, names=sorted(self.CLEAN_FILES))
 
     def configure(self, context, args):
         raise NotImplementedError("configure method not implemented in %s" % self.NAME)
@@ -211,11 +280,23 @@ class Base:
 
     @copy_test_files()
     def test(self, context, args):
+        # limited to modules affected by recent changes (--watch)
+        selected = context.get('test_modules')
+        if selected is not None and not self.cfg.test_tox:
+            if self.cfg.test_pytest:
+                return 'cd {build_dir}; {interpreter} -m pytest %s' % ' '.join(
+                    quote(i.replace('.', '/') + '.py') for i in selected)
+            runner = 'nose2' if self.cfg.test_nose2 else 'nose' if self.cfg.test_nose else 'unittest'
+            return 'cd {build_dir}; {interpreter} -m %s -v %s' % (runner, ' '.join(selected))
         if self.cfg.test_nose2:
             return 'cd {build_dir}; {interpreter} -m nose2 -v {args}'
         elif self.cfg.test_nose:
             return 'cd {build_dir}; {interpreter} -m nose -v {args}'
         elif self.cfg.test_pytest:
+            jobs = self.cfg.test_jobs
+            if jobs > 1 and not XDIST_ARGS_RE.search(args['args'] or '') and\
+                    has_module('{interpreter}'.format(**args), 'xdist', context['ENV']):
+                return 'cd {build_dir}; {interpreter} -m pytest -n %d {args}' % jobs
             return 'cd {build_dir}; {interpreter} -m pytest {args}'
         elif self.cfg.test_tox:
             # tox will call pip to install the module. Let it install the
@@ -225,17 +306,96 @@ class Base:
                 remove(pydistutils_cfg)
             return 'cd {build_dir}; tox -c {dir}/tox.ini --sitepackages -e py{version.major}{version.minor}'
         elif args['version'] == '2.7' or args['version'] >> '3.1' or args['interpreter'] == 'pypy':
+            if self.cfg.test_jobs > 1 and not args['args'] and context.get('plan') is None:
+                db = timings.load(self.cfg, args['dir'])
+                estimates = db.data.get('unittest/{}'.format(args['interpreter']))
+                shards = unittest_shards(args['build_dir'], self.cfg.test_jobs, estimates)
+                if len(shards) > 1:
+                    return self.test_shards(context, args, shards)
             return 'cd {build_dir}; {interpreter} -m unittest discover -v {args}'
 
+    def test_shards(self, context, args, shards):
+        """Run unittest modules in parallel, one process per shard."""
+        jobs = []
+        for i, modules in enumerate(shards, start=1):
+            home_dir = join(args['home_dir'], 'shard{}'.format(i))
+            makedirs(home_dir, exist_ok=True)
+            env = dict(args.get('ENV', {}), HOME=home_dir)
+            pythonpath = env.get('PYTHONPATH', context['ENV'].get('PYTHONPATH'))
+            env['PYTHONPATH'] = args['build_dir'] + (':' + pythonpath if pythonpath else '')
+            shard_args = dict(args, ENV=env)
+            if self.cfg.quiet:
+                log_file = join(args['home_dir'], 'test_shard{}_cmd.log'.format(i))
+                prefix = None
+            else:
+                log_file = False
+                prefix = 'shard{}'.format(i)
+            command = 'cd {} && {{interpreter}} -m unittest -v {}'.format(
+                quote(args['build_dir']), ' '.join(modules))
+            jobs.append(self.aexecute(context, shard_args, command, log_file, prefix=prefix))
+        results = engine.run_jobs(jobs, estimates=[i.duration for i in shards])
+
+        # spread shard's duration over its modules, proportionally to estimates
+        durations = {}
+        for shard, output in zip(shards, results):
+            for name in shard:
+                durations[name] = output['duration'] * shard.estimates[name] / (shard.duration or 1)
+        timings.load(self.cfg, args['dir']).record(
+            'unittest/{}'.format(args['interpreter']), durations)
+
+        total = 0
+        failed = []
+        tails = []
+        for i, output in enumerate(results, start=1):
+            match = UNITTEST_RAN_RE.search(output['tail'] or '')
+            total += int(match.group(1)) if match else 0
+            # 5: no tests were run in this shard (Python >= 3.12)
+            if output['returncode'] not in (0, 5):
+                failed.append('shard{} (exit code={})'.format(i, output['returncode']))
+                if output['tail']:
+                    tails.append('shard{}:\n{}'.format(i, output['tail'].rstrip('\n')))
+        log.info('ran %d tests in %d shards (%s)', total, len(shards),
+                 ', '.join(failed) + ' failed' if failed else 'OK')
+        if failed or not total:
+            msg = 'tests failed: {}'.format(', '.join(failed) or 'no tests ran')
+            if self.cfg.quiet:
+                if tails:
+                    msg += '\nlast lines of output:\n{}'.format('\n'.join(tails))
+                msg += '\nfull command logs are available in {}'.format(
+                    join(args['home_dir'], 'test_shard*_cmd.log'))
+            raise Exception(msg)
+        return True
+
     def execute(self, context, args, command, log_file=None):
+        command, env, log_file = self._prepare_command(context, args, command, log_file)
+        return engine.execute(command, context['dir'], env, log_file,
+                              shell=not isinstance(command, list))
+
+    async def aexecute(self, context, args, command, log_file=None, **kwargs):
+        """Coroutine version of :meth:`execute`.
+
+        Additional keyword arguments (prefix, timeout, ...) are passed to
+        :func:`dhpython.build.engine.run`.
+        """
+        command, env, log_file = self._prepare_command(context, args, command, log_file)
+        return await engine.run(command, context['dir'], env, log_file,
+                                shell=not isinstance(command, list), **kwargs)
+
+    def _prepare_command(self, context, args, command, log_file):
         if log_file is False and self.cfg.really_quiet:
             log_file = None
-        command = command.format(**args)
+        if isinstance(command, list):
+            command = [i.format(**args) for i in command]
+            log.info(join_argv(command))
+        elif isinstance(command, Formatted):
+            log.info(command)
+        else:
+            command = command.format(**args)
+            log.info(command)
         env = dict(context['ENV'])
         if 'ENV' in args:
             env.update(args['ENV'])
-        log.info(command)
-        return execute(command, context['dir'], env, log_file)
+        return command, env, log_file
 
     def print_args(self, context, args):
         cfg = self.cfg
@@ -253,7 +413,101 @@ class Base:
                     print('{} {}: {}'.format(args['interpreter'], i, args.get(i, '')))
 
 
+@memoize
+def has_module(interpreter, name, env=None):
+    """Check if given interpreter can import given module."""
+    output = execute([interpreter, '-c', 'import ' + name], env=env, shell=False)
+    return output['returncode'] == 0
+
+
+class Shard(list):
+    """List of test modules with their estimated durations"""
+
+    def __init__(self):
+        super().__init__()
+        self.duration = 0
+        self.estimates = {}
+
+    def add(self, name, estimate):
+        self.append(name)
+        self.estimates[name] = estimate
+        self.duration += estimate
+
+
+def unittest_shards(path, jobs, estimates=None, pattern='test*.py'):
+    """Split test modules found by unittest's discover into shards.
+
+    Modules that took the longest time in previous runs (or the biggest
+    ones) are assigned first, always to the shard with the lowest total.
+    Returns empty list if modules cannot be safely run separately.
+
+    :param estimates: durations of modules in previous runs ({name: seconds})
+    """
+    modules = {}
+    stack = [path]
+    while stack:
+        dpath = stack.pop()
+        if dpath != path:
+            with open(join(dpath, '__init__.py'), 'rb') as fp:
+                if b'load_tests' in fp.read():
+                    # package controls its own tests, do not split it
+                    return []
+        for entry in scandir(dpath):
+            if entry.is_dir():
+                # only packages are searched by unittest's discover
+                if exists(join(entry.path, '__init__.py')):
+                    stack.append(entry.path)
+            elif fnmatch(entry.name, pattern) and entry.name.endswith('.py'):
+                name = relpath(entry.path, path)[:-3].replace(sep, '.')
+                modules[name] = entry.stat().st_size
+
+    estimate = timings.estimator(estimates or {}, modules)
+    shards = [Shard() for _ in range(min(jobs, len(modules)))]
+    for name in sorted(modules, key=lambda i: (estimate(i), i), reverse=True):
+        min(shards, key=lambda i: i.duration).add(name, estimate(name))
+    for shard in shards:
+        shard.sort()
+    return shards
+
+
+def join_argv(argv):
+    return ' '.join(quote(i) for i in argv)
+
+
+class Formatted(str):
+    """Shell command with all placeholders already replaced"""
+
+
+def argv_command(argv, args):
+    """Expand "{args}" item of argv list into separate arguments.
+
+    Returns a (:class:`Formatted`) shell command if user supplied arguments
+    need shell features (variables, globs, redirections, etc.).
+    """
+    user_args = args.get('args') or ''
+    if '{args}' not in argv:
+        return argv
+    if SHELL_CHARS_RE.search(user_args):
+        # placeholders in user supplied arguments are not quoted
+        return Formatted(' '.join(
+            user_args.format(**args) if i == '{args}' else quote(i.format(**args))
+            for i in argv))
+    result = []
+    for item in argv:
+        if item == '{args}':
+            result.extend(split(user_args))
+        else:
+            result.append(item)
+    return result
+
+
 def shell_command(func):
+    """Execute command returned by decorated method.
+
+    Command can be a string (executed via shell, *_dir arguments are quoted)
+    or a list of arguments (executed directly, "{args}" item is replaced
+    with arguments passed by the user).
+    """
 
     @wraps(func)
     def wrapped_func(self, context, args, *oargs, **kwargs):
@@ -274,17 +528,37 @@ def shell_command(func):
         else:
             log_file = False
 
-        quoted_args = dict((k, quote(v)) if k in ('dir', 'destdir')
-                           or k.endswith('_dir') else (k, v)
-                           for k, v in args.items())
-        command = command.format(**quoted_args)
+        if isinstance(command, list):
+            command = argv_command(command, args)
+        if isinstance(command, (list, Formatted)):
+            pass  # formatted in Base.execute (or already), no quoting needed
+        else:
+            quoted_args = dict((k, quote(v)) if k in ('dir', 'destdir')
+                               or k.endswith('_dir') else (k, v)
+                               for k, v in args.items())
+            command = command.format(**quoted_args)
+
+        plan = context.get('plan')
+        if plan is not None:
+            if isinstance(command, list):
+                command = join_argv(i.format(**args) for i in command)
+            plan.append(command)
+            return True
 
         output = self.execute(context, args, command, log_file)
         if output['returncode'] != 0:
+            if isinstance(command, list):
+                command = join_argv(i.format(**args) for i in command)
             msg = 'exit code={}: {}'.format(output['returncode'], command)
             if log_file:
+                if output.get('tail'):
+                    msg += '\nlast lines of output:\n{}'.format(
+                        output['tail'].rstrip('\n'))
                 msg += '\nfull command log is available in {}'.format(log_file)
             raise Exception(msg)
+        # last lines of output (see pybuild's test cache)
+        args['output_tail'] = output.get('tail')
         return True
 
+    wrapped_func.shell_command = True
     return wrapped_func
@@ -0,0 +1,268 @@
+# Copyright © 2022 Piotr Ożarowski <piotr@debian.org>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""Asynchronous execution of external commands.
+
+All commands invoked by pybuild (plugin steps, before_*/after_* hooks and
+plan entries) are run here. :func:`run` is a coroutine that can be awaited
+by plugins which want to run several commands at once, :func:`gather`
+schedules many of them (with optional concurrency limit) on a single event
+loop and :func:`execute` is their blocking wrapper. Unlike
+:func:`dhpython.tools.execute`, output is never collected in memory (only
+its last characters are returned, see `tail`).
+"""
+
+import asyncio
+import logging
+import os
+import sys
+from codecs import getincrementaldecoder
+from collections import deque
+from datetime import datetime
+from shlex import quote
+from signal import SIGKILL, SIGTERM
+from subprocess import PIPE
+from time import monotonic
+from dhpython import jobserver
+
+log = logging.getLogger('dhpython')
+# number of characters of command's output kept in memory
+OUTPUT_TAIL = 16 * 1024
+# seconds given to a command to exit after SIGTERM (before SIGKILL is sent)
+KILL_DELAY = 5
+CHUNK_SIZE = 65536
+
+
+class Output:
+    """Write command's output line by line, keep its last characters."""
+
+    def __init__(self, output, size=OUTPUT_TAIL, prefix=None, tail_of=None):
+        self.output = output
+        # Output that keeps last characters of this one as well
+        self.tail_of = tail_of
+        self.size = size
+        self.prefix = '{}| '.format(prefix) if prefix else ''
+        self.decoder = getincrementaldecoder('utf-8')(errors='replace')
+        self.pending = ''
+        self.lines = deque()
+        self.total = 0
+
+    def feed(self, data, final=False):
+        *lines, self.pending = (self.pending + self.decoder.decode(data, final)).split('\n')
+        for line in lines:
+            self.write(line + '\n')
+        if self.pending and (final or len(self.pending) > CHUNK_SIZE):
+            # do not keep never ending lines in memory
+            self.write(self.pending if final else self.pending + '\n')
+            self.pending = ''
+        if lines and self.output:
+            self.output.flush()
+
+    def write(self, line):
+        if self.output:
+            self.output.write(self.prefix + line)
+        if self.tail_of is not None:
+            self.tail_of.keep(line)
+        else:
+            self.keep(line)
+
+    def keep(self, line):
+        if not self.size:
+            return
+        self.lines.append(line)
+        self.total += len(line)
+        while self.total > self.size and len(self.lines) > 1:
+            self.total -= len(self.lines.popleft())
+
+    @property
+    def tail(self):
+        return ''.join(self.lines)[-self.size:] if self.size else None
+
+
+async def run(command, cwd=None, env=None, log_output=None, shell=True,
+              tail=OUTPUT_TAIL, prefix=None, timeout=None, pass_fds=()):
+    """Execute external command and stream its output.
+
+    :param log_output:
+        * opened log file or path to this file, or
+        * None if output should be discarded (see `tail`), or
+        * False if output should be redirected to stdout/stderr
+    :param tail: number of output's (both stdout and stderr) last
+        characters returned in "tail" key
+    :param prefix: string prepended to each line of output
+    :param timeout: number of seconds after which command (and all its
+        children, it's started in a new session) will be killed
+    :param pass_fds: file descriptors to keep open in the child process
+    """
+    close = False
+    errors = None
+    if log_output is False:
+        log_output, errors = sys.stdout, sys.stderr
+    elif log_output:
+        if isinstance(log_output, str):
+            close = True
+            log_output = open(log_output, 'a', encoding='utf-8')
+        log_output.write('\n# command executed on {}'.format(datetime.now().isoformat()))
+        log_output.write('\n$ {}\n'.format(
+            command if shell else ' '.join(quote(i) for i in command)))
+        log_output.flush()
+    output = Output(log_output, tail, prefix)
+    errors = Output(errors or log_output, tail, prefix, tail_of=output)
+
+    log.debug('invoking: %s', command)
+    server = jobserver.client()
+    if server:
+        pass_fds = tuple(pass_fds) + server.pass_fds
+    # new session = the whole process group can be killed on timeout,
+    # otherwise it stays in ours and gets terminal's/make's signals
+    group = timeout is not None
+    kwargs = dict(cwd=cwd, env=env, stdout=PIPE, stderr=PIPE,
+                  start_new_session=group, pass_fds=pass_fds)
+    timed_out = False
+    start = monotonic()
+    try:
+        if shell:
+            process = await asyncio.create_subprocess_shell(command, **kwargs)
+        else:
+            process = await asyncio.create_subprocess_exec(*command, **kwargs)
+        try:
+            await asyncio.wait_for(_communicate(process, output, errors), timeout)
+        except asyncio.TimeoutError:
+            log.error('timeout (%ss) exceeded: %s', timeout, command)
+            timed_out = True
+            await _kill(process, group)
+        except asyncio.CancelledError:
+            await _kill(process, group)
+            raise
+    finally:
+        close and log_output.close()
+    return dict(returncode=process.returncode, stdout=None, stderr=None,
+                tail=output.tail, timeout=timed_out, duration=monotonic() - start)
+
+
+async def _communicate(process, output, errors):
+    await asyncio.gather(_read(process.stdout, output), _read(process.stderr, errors))
+    await process.wait()
+
+
+async def _read(stream, output):
+    while True:
+        data = await stream.read(CHUNK_SIZE)
+        if not data:
+            break
+        output.feed(data)
+    output.feed(b'', final=True)
+
+
+async def _kill(process, group=False):
+    """Terminate process and its children
+
+    Commands invoked without a timeout share pybuild's process group
+    (see :func:`run`), their children are found in /proc.
+    """
+    pids = [process.pid] if group else [process.pid] + _descendants(process.pid)
+    for sig in (SIGTERM, SIGKILL):
+        for pid in pids:
+            try:
+                if group:
+                    os.killpg(pid, sig)
+                else:
+                    os.kill(pid, sig)
+            except ProcessLookupError:
+                pass
+        try:
+            await asyncio.wait_for(process.wait(), KILL_DELAY)
+            break
+        except asyncio.TimeoutError:
+            continue
+
+
+def _descendants(pid):
+    """Return PIDs of all children of given process (Linux only)"""
+    result = []
+    try:
+        tasks = os.listdir('/proc/{}/task'.format(pid))
+    except OSError:
+        return result
+    for tid in tasks:
+        try:
+            with open('/proc/{}/task/{}/children'.format(pid, tid)) as fp:
+                children = [int(i) for i in fp.read().split()]
+        except (OSError, ValueError):
+            continue
+        for child in children:
+            result.append(child)
+            result.extend(_descendants(child))
+    return result
+
+
+async def gather(jobs, limit=None, estimates=None):
+    """Run coroutines concurrently, at most `limit` of them at a time.
+
+    Results are returned in jobs' order. If one of the jobs raises an
+    exception, all others are cancelled (and their processes killed).
+    Each job takes a make jobserver's token first, if there is one.
+
+    :param estimates: expected durations of jobs, the longest ones are
+        started first (see :mod:`dhpython.build.timings`)
+    """
+    semaphore = asyncio.Semaphore(limit) if limit else None
+    server = jobserver.client()
+
+    async def with_token(job):
+        if server is None:
+            return await job
+        token = await server.acquire()
+        try:
+            return await job
+        finally:
+            server.release(token)
+
+    async def guarded(job):
+        if semaphore is None:
+            return await with_token(job)
+        async with semaphore:
+            return await with_token(job)
+
+    jobs = list(jobs)
+    order = list(range(len(jobs)))
+    if estimates:
+        order.sort(key=lambda i: estimates[i], reverse=True)
+    # semaphore and jobserver's queue are FIFO: tasks start in this order
+    tasks = [None] * len(jobs)
+    for i in order:
+        tasks[i] = asyncio.ensure_future(guarded(jobs[i]))
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+
+def execute(command, cwd=None, env=None, log_output=None, shell=True, **kwargs):
+    """Blocking version of :func:`run` (cannot be used in a running loop)."""
+    return asyncio.run(run(command, cwd, env, log_output, shell, **kwargs))
+
+
+def run_jobs(jobs, limit=None, estimates=None):
+    """Blocking version of :func:`gather`."""
+    return asyncio.run(gather(jobs, limit, estimates))
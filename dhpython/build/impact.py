@@ -0,0 +1,232 @@
+# Copyright © 2022 Piotr Ożarowski <piotr@debian.org>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""Selection of tests affected by changes (pybuild --test-changed).
+
+Imports of all modules in build directory are read with ast (results are
+cached by file's hash), test modules that import changed modules directly
+or indirectly are the only ones invoked. Meant for quick checks during
+development, not for final builds: dynamic imports are not detected.
+"""
+
+import ast
+import json
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from fnmatch import fnmatch
+from os.path import join, relpath
+from dhpython.build.base import copy_test_files
+from dhpython.tools import (SCAN_SKIP_DIRS, file_digest, parallel_jobs,
+                            scantree, write_atomic)
+
+log = logging.getLogger('dhpython')
+IMPORTS_CACHE = '.pybuild/imports.json'
+SKIP_DIRS = SCAN_SKIP_DIRS | {'__pycache__', '.pytest_cache', '.mypy_cache',
+                              '.hypothesis', '.tox'}
+TEST_PATTERNS = ('test*', '*_test')
+EXTENSION_SUFFIXES = ('.so', '.pyd')
+# parsing fewer files is faster without starting a process pool
+POOL_THRESHOLD = 64
+
+
+def module_name(path):
+    """Return dotted module name of given relative path
+
+    >>> module_name('foo/bar/__init__.py')
+    'foo.bar'
+    >>> module_name('foo/_speedups.cpython-311-x86_64-linux-gnu.so')
+    'foo._speedups'
+    """
+    dname, _, fname = path.rpartition('/')
+    name = fname.split('.', 1)[0]
+    if name == '__init__':
+        return dname.replace('/', '.')
+    return '{}.{}'.format(dname.replace('/', '.'), name) if dname else name
+
+
+def is_module(path):
+    return path.endswith('.py') or path.endswith(EXTENSION_SUFFIXES) or \
+        '.so.' in path.rpartition('/')[-1]
+
+
+def parse_imports(fpath):
+    """Return list of (module, level, names) imported by given file"""
+    with open(fpath, 'rb') as fp:
+        tree = ast.parse(fp.read(), fpath)
+    result = []
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            result.extend((alias.name, 0, None) for alias in node.names)
+        elif isinstance(node, ast.ImportFrom):
+            result.append((node.module or '', node.level,
+                           [alias.name for alias in node.names]))
+    return result
+
+
+def _parse(fpath):
+    try:
+        return parse_imports(fpath)
+    except (SyntaxError, ValueError, OSError):
+        return []
+
+
+def resolve(imports, name, is_package=False):
+    """Return absolute names imported by `name` module
+
+    >>> sorted(resolve([('', 2, ['bar']), ('os', 0, None)], 'foo.tests.test_x'))
+    ['foo', 'foo.bar', 'os']
+    """
+    package = name.split('.') if is_package else name.split('.')[:-1]
+    result = set()
+    for module, level, names in imports:
+        if level:
+            parent = package[:len(package) - level + 1]
+            module = '.'.join(parent + ([module] if module else []))
+        if module:
+            result.add(module)
+        # from foo import bar: bar might be a module as well
+        result.update('{}.{}'.format(module, i) if module else i
+                      for i in names or ())
+    return result
+
+
+def digests(path):
+    """Return {relative path: sha256 digest} of all files in given dir"""
+    return {relpath(entry.path, path): file_digest(entry.path)
+            for entry in scantree(path, skip=SKIP_DIRS)
+            if entry.is_file(follow_symlinks=False)}
+
+
+def _load_cache(fpath):
+    try:
+        with open(fpath, encoding='utf-8') as fp:
+            return json.load(fp)
+    except (IOError, ValueError):
+        return {}
+
+
+def import_graph(path, files, jobs=None, cache=IMPORTS_CACHE):
+    """Return {module name: imported names} for modules in given dir
+
+    :param files: result of :func:`digests`
+    :param jobs: number of processes used to parse files
+    """
+    cached = _load_cache(cache)
+    todo = sorted({digest: rpath for rpath, digest in files.items()
+                   if rpath.endswith('.py') and digest not in cached}.items())
+    if todo:
+        fpaths = [join(path, rpath) for _, rpath in todo]
+        jobs = jobs or parallel_jobs()
+        if jobs > 1 and len(todo) >= POOL_THRESHOLD:
+            with ProcessPoolExecutor(jobs) as executor:
+                results = list(executor.map(_parse, fpaths, chunksize=16))
+        else:
+            results = [_parse(i) for i in fpaths]
+        cached.update((digest, result) for (digest, _), result in zip(todo, results))
+        try:
+            used = set(files.values())
+            write_atomic(cache, json.dumps({k: v for k, v in cached.items() if k in used}))
+        except IOError as err:
+            log.debug('cannot save imports cache: %s', err)
+
+    graph = {}
+    for rpath, digest in files.items():
+        if rpath.endswith('.py'):
+            name = module_name(rpath)
+            graph[name] = resolve(cached[digest], name, rpath.endswith('__init__.py'))
+        elif is_module(rpath):
+            graph.setdefault(module_name(rpath), set())
+    return graph
+
+
+def dependents(graph, modules):
+    """Return modules that import given ones, directly or indirectly"""
+    reverse = {}
+    for name, imported in graph.items():
+        for i in imported:
+            # importing foo.bar imports foo as well
+            parts = i.split('.')
+            for n in range(1, len(parts) + 1):
+                target = '.'.join(parts[:n])
+                if target in graph and target != name:
+                    reverse.setdefault(target, set()).add(name)
+    result = set()
+    stack = list(modules)
+    while stack:
+        for name in reverse.get(stack.pop(), ()):
+            if name not in result:
+                result.add(name)
+                stack.append(name)
+    return result
+
+
+def affected_tests(graph, modules):
+    """Return names of test modules affected by changes in given modules"""
+    affected = dependents(graph, modules) | set(modules)
+    return sorted(name for name in affected if name in graph and
+                  any(fnmatch(name.rsplit('.', 1)[-1], i) for i in TEST_PATTERNS))
+
+
+def changed_modules(previous, current):
+    """Return names of modules changed since previous run
+
+    None is returned if it's unknown or changes can affect all tests
+    (removed files, changed data files or conftest.py)
+    """
+    if not previous or previous.keys() - current.keys():
+        return None
+    result = set()
+    for rpath, digest in current.items():
+        if previous.get(rpath) == digest:
+            continue
+        if not is_module(rpath) or rpath.rpartition('/')[-1] == 'conftest.py':
+            return None
+        result.add(module_name(rpath))
+    return result
+
+
+def test(plugin, func, context, args):
+    """Invoke tests affected by changes since the last successful run"""
+    if context.get('test_modules') is not None:
+        return func(context, args)
+    state = join(args['home_dir'], 'test-changed.json')
+    files, graph = _analyse(plugin, context, args)
+    interpreter = str(args['interpreter'])
+    changed = changed_modules(_load_cache(state), files)
+    if changed is None:
+        log.info('%s: no usable record of the previous run, running all tests',
+                 interpreter)
+        result = func(context, args)
+    else:
+        selected = affected_tests(graph, changed)
+        if not selected:
+            log.info('%s: no test modules affected by changes', interpreter)
+            return True
+        log.info('%s: running %d test module(s) affected by changes in: %s',
+                 interpreter, len(selected), ', '.join(sorted(changed)))
+        result = func(dict(context, test_modules=selected), args)
+    write_atomic(state, json.dumps(files))
+    return result
+
+
+@copy_test_files()
+def _analyse(plugin, context, args):
+    files = digests(args['build_dir'])
+    return files, import_graph(args['build_dir'], files, plugin.cfg.test_jobs)
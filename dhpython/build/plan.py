@@ -0,0 +1,138 @@
+# Copyright © 2022 Piotr Ożarowski <piotr@debian.org>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+import logging
+from os import environ
+from shlex import quote
+from dhpython.build.base import ACTIONS, remove_test_files
+from dhpython.build.engine import execute
+from dhpython.tools import move_matching_files
+
+log = logging.getLogger('dhpython')
+
+# directories read (inputs) and written (outputs) by each step
+STEP_DIRS = {
+    'clean': (('dir',), ('build_dir',)),
+    'configure': (('dir',), ('build_dir',)),
+    'build': (('dir',), ('build_dir',)),
+    'install': (('build_dir',), ('destdir',)),
+    'test': (('build_dir', 'destdir'), ()),
+}
+
+
+def env_delta(env, base=None):
+    """Return variables that differ from base (None means: unset)"""
+    base = environ if base is None else base
+    result = {k: v for k, v in env.items() if base.get(k) != v}
+    result.update((k, None) for k in base if k not in env)
+    return result
+
+
+def apply_env_delta(delta, base=None):
+    env = dict(environ if base is None else base)
+    for key, value in delta.items():
+        if value is None:
+            env.pop(key, None)
+        else:
+            env[key] = value
+    return env
+
+
+def plan_entry(step, interpreter, version, args, env, commands, hooks, fallback):
+    """Describe one (interpreter, version, step) job
+
+    :param commands: commands (and side effects, see
+        :func:`dhpython.build.base.side_effect`) collected from plugin's step or None if step
+        is not a plain shell command (`fallback` pybuild invocation will be
+        used to invoke it; it will take care of before/after commands)
+    :param hooks: tuple with formatted before and after commands (or None)
+    """
+    delta = env_delta(env)
+    if commands is None:
+        hooks = (None, None)
+        fallback_env = {k: v for k, v in env.items() if k.startswith('PYBUILD_')}
+        delta.update(fallback_env)
+    inputs, outputs = STEP_DIRS[step]
+    return {
+        'step': step,
+        'interpreter': interpreter,
+        'version': str(version),
+        'cwd': args['dir'],
+        'env': delta,
+        'before': hooks[0],
+        'commands': commands,
+        'pybuild': None if commands is not None else fallback,
+        'after': hooks[1],
+        'dirs': {k: args[k] for k in ('dir', 'destdir', 'build_dir',
+                                      'install_dir', 'home_dir')},
+        'inputs': [args[k] for k in inputs],
+        'outputs': [args[k] for k in outputs],
+    }
+
+
+def _execute(command, cwd, env, log_file, executor, shell=True):
+    if executor:
+        if not shell:
+            command = ' '.join(quote(i) for i in command)
+        if '{command}' in executor:
+            command = executor.format(command=quote(command), cwd=quote(cwd))
+        else:
+            command = '{} {}'.format(executor, quote(command))
+        shell = True
+    log.info(command)
+    output = execute(command, cwd, env, log_file, shell=shell)
+    if output['returncode'] != 0:
+        msg = 'exit code={}: {}'.format(output['returncode'], command)
+        raise Exception(msg)
+
+
+def execute_entry(entry, executor=None, log_file=False):
+    """Invoke all commands listed in plan's entry
+
+    :param executor: command used to invoke each command (quoted command is
+        appended to it or used in place of `{command}`)
+    :param log_file: see :func:`dhpython.tools.execute`'s `log_output`
+    """
+    env = apply_env_delta(entry['env'])
+    cwd = entry['cwd']
+    if entry['before']:
+        _execute(entry['before'], cwd, env, log_file, executor)
+    if entry['step'] == 'install':
+        remove_test_files(entry['dirs']['home_dir'])
+    if entry['pybuild']:
+        _execute(entry['pybuild'], cwd, env, log_file, executor, shell=False)
+    for command in entry['commands'] or []:
+        if isinstance(command, dict):  # step's side effect
+            action = dict(command)
+            ACTIONS[action.pop('action')](**action)
+        else:
+            _execute(command, cwd, env, log_file, executor)
+    if entry['after']:
+        _execute(entry['after'], cwd, env, log_file, executor)
+    ext = entry.get('ext_destdir')
+    if ext and entry['step'] == 'install':
+        move_matching_files(entry['dirs']['destdir'], ext['destdir'],
+                            ext['pattern'], ext['sub_pattern'], ext['sub_repl'])
+
+
+def execute_plan(plan, executor=None, log_file=False):
+    """Invoke all entries of a plan generated by `pybuild --plan`"""
+    for entry in plan:
+        execute_entry(entry, executor, log_file)
@@ -19,14 +19,31 @@
 # THE SOFTWARE.
 
 import logging
-from glob import glob1
-from os import remove
-from os.path import exists, isdir, join
-from shutil import rmtree
-from dhpython.build.base import Base, shell_command, copy_test_files
+from os import makedirs
+from os.path import exists, join
+from dhpython.build.base import Base, shell_command, copy_test_files, side_effect
+from dhpython.tools import execute, memoize, parallel_jobs, write_atomic
 
 log = logging.getLogger('dhpython')
 _setup_tpl = 'setup.py|setup-3.py'
+BUILD_EXT_PARALLEL_CHECK = '''
+try:
+    from setuptools.command.build_ext import build_ext
+except ImportError:
+    from distutils.command.build_ext import build_ext
+print(any(i[0].rstrip("=") == "parallel" for i in build_ext.user_options))
+'''
+
+
+@memoize
+def build_ext_parallel(interpreter, env=None):
+    """Check if build_ext command supports "parallel" option."""
+    command = [interpreter, '-c', BUILD_EXT_PARALLEL_CHECK]
+    output = execute(command, env=env, shell=False)
+    if output['returncode'] != 0 or output['stdout'].strip() != 'True':
+        log.debug('%s: build_ext does not support parallel option', interpreter)
+        return False
+    return True
 
 
 def create_pydistutils_cfg(func):
@@ -40,20 +57,26 @@ def create_pydistutils_cfg(func):
     def wrapped_func(self, context, args, *oargs, **kwargs):
         fpath = join(args['home_dir'], '.pydistutils.cfg')
         if not exists(fpath):
-            with open(fpath, 'w', encoding='utf-8') as fp:
-                lines = ['[clean]\n',
-                         'all=1\n',
-                         '[build]\n',
-                         'build_lib={}\n'.format(args['build_dir']),
-                         '[install]\n',
-                         'force=1\n',
-                         'install_layout=deb\n',
-                         'install_scripts=$base/bin\n',
-                         'install_lib={}\n'.format(args['install_dir']),
-                         'prefix=/usr\n']
-                log.debug('pydistutils config file:\n%s', ''.join(lines))
-                fp.writelines(lines)
-        context['ENV']['HOME'] = args['home_dir']
+            lines = ['[clean]\n',
+                     'all=1\n',
+                     '[build]\n',
+                     'build_lib={}\n'.format(args['build_dir']),
+                     '[install]\n',
+                     'force=1\n',
+                     'install_layout=deb\n',
+                     'install_scripts=$base/bin\n',
+                     'install_lib={}\n'.format(args['install_dir']),
+                     'prefix=/usr\n']
+            jobs = parallel_jobs(context['ENV'])
+            if jobs > 1 and build_ext_parallel('{}'.format(args['interpreter']),
+                                               context['ENV']):
+                lines.extend(['[build_ext]\n',
+                              'parallel={}\n'.format(jobs)])
+            log.debug('pydistutils config file:\n%s', ''.join(lines))
+            makedirs(args['home_dir'], exist_ok=True)
+            write_atomic(fpath, ''.join(lines))
+        # context is shared with other interpreters/versions, args are not
+        args['ENV'] = dict(args.get('ENV', {}), HOME=args['home_dir'])
         return func(self, context, args, *oargs, **kwargs)
 
     wrapped_func.__name__ = func.__name__
@@ -85,28 +108,28 @@ class BuildSystem(Base):
     def clean(self, context, args):
         super(BuildSystem, self).clean(context, args)
         if exists(args['interpreter'].binary()):
-            return '{interpreter} {setup_py} clean {args}'
+            return ['{interpreter}', '{setup_py}', 'clean', '{args}']
         return 0  # no need to invoke anything
 
     @shell_command
     @create_pydistutils_cfg
     def configure(self, context, args):
-        return '{interpreter} {setup_py} config {args}'
+        return ['{interpreter}', '{setup_py}', 'config', '{args}']
 
     @shell_command
     @create_pydistutils_cfg
     def build(self, context, args):
-        return '{interpreter.binary_dv} {setup_py} build {args}'
+        return ['{interpreter.binary_dv}', '{setup_py}', 'build', '{args}']
 
     @shell_command
     @create_pydistutils_cfg
     def install(self, context, args):
         # remove egg-info dirs from build_dir
-        for fname in glob1(args['build_dir'], '*.egg-info'):
-            fpath = join(args['build_dir'], fname)
-            rmtree(fpath) if isdir(fpath) else remove(fpath)
+        side_effect(context, 'remove_matching', dpath=args['build_dir'],
+                    pattern='*.egg-info')
 
-        return '{interpreter.binary_dv} {setup_py} install --root {destdir} {args}'
+        return ['{interpreter.binary_dv}', '{setup_py}', 'install',
+                '--root', '{destdir}', '{args}']
 
     @shell_command
     @create_pydistutils_cfg
@@ -117,5 +140,5 @@ class BuildSystem(Base):
             with open(fpath, 'rb') as fp:
                 if fp.read().find(b'test_suite') > 0:
                     # TODO: is that enough to detect if test target is available?
-                    return '{interpreter} {setup_py} test {args}'
+                    return ['{interpreter}', '{setup_py}', 'test', '{args}']
         return super(BuildSystem, self).test(context, args)
@@ -36,7 +36,8 @@ try:
 except ImportError:
     Installer = object
 
-from dhpython.build.base import Base, shell_command
+from dhpython.build.base import TRASH_DIR, Base, shell_command
+from dhpython.tools import sync_file, sync_tree, trash
 
 log = logging.getLogger('dhpython')
 
@@ -55,20 +56,19 @@ class DebianInstaller(Installer):
         os.makedirs(dirs['scripts'], exist_ok=True)
 
         dst = osp.join(dirs['purelib'], osp.basename(self.module.path))
-        if osp.lexists(dst):
-            if osp.isdir(dst) and not osp.islink(dst):
-                shutil.rmtree(dst)
-            else:
-                os.unlink(dst)
-
         src = str(self.module.path)
         if self.module.is_package:
+            if osp.lexists(dst) and not osp.isdir(dst) or osp.islink(dst):
+                os.unlink(dst)
             log.info("Installing package %s -> %s", src, dst)
-            shutil.copytree(src, dst)
+            # unchanged files are not copied again
+            sync_tree(src, dst, delete=True)
             self._record_installed_directory(dst)
         else:
+            if osp.isdir(dst) and not osp.islink(dst):
+                shutil.rmtree(dst)
             log.info("Installing file %s -> %s", src, dst)
-            shutil.copy2(src, dst)
+            sync_file(src, dst)
             self.installed_files.append(dst)
 
         scripts = self.ini_info.entrypoints.get('console_scripts', {})
@@ -143,7 +143,7 @@ class BuildSystem(Base):
         if osp.exists(args['interpreter'].binary()):
             log.debug("removing '%s' (and everything under it)",
                       args['build_dir'])
-            osp.isdir(args['build_dir']) and shutil.rmtree(args['build_dir'])
+            osp.isdir(args['build_dir']) and trash(args['build_dir'], TRASH_DIR)
         return 0  # no need to invoke anything
 
     def configure(self, context, args):
@@ -23,7 +23,7 @@
 from pathlib import Path
 import logging
 import os.path as osp
-import shutil
+import re
 import sysconfig
 try:
     import tomli
@@ -37,10 +37,12 @@ try:
 except ModuleNotFoundError:
     SchemeDictionaryDestination = WheelFile = install = None
 
-from dhpython.build.base import Base, shell_command
+from dhpython.build.base import TRASH_DIR, Base, shell_command
 from dhpython.debhelper import DebHelper, build_options
+from dhpython.tools import sync_tree, trash
 
 log = logging.getLogger('dhpython')
+SCRIPTS_RE = re.compile(r'(^|/)scripts-[^/]*$')
 
 
 class BuildSystem(Base):
@@ -93,7 +95,7 @@ class BuildSystem(Base):
         if osp.exists(args['interpreter'].binary()):
             log.debug("removing '%s' (and everything under it)",
                       args['build_dir'])
-            osp.isdir(args['build_dir']) and shutil.rmtree(args['build_dir'])
+            osp.isdir(args['build_dir']) and trash(args['build_dir'], TRASH_DIR)
         return 0  # no need to invoke anything
 
     def configure(self, context, args):
@@ -112,11 +114,9 @@ class BuildSystem(Base):
         """ build a wheel using the PEP517 builder defined by upstream """
         log.info('Building wheel for %s with "build" module',
                  args['interpreter'])
-        return ('{interpreter} -m build '
-                '--skip-dependency-check --no-isolation --wheel '
-                '--outdir ' + args['home_dir'] +
-                ' {args}'
-               )
+        return ['{interpreter}', '-m', 'build',
+                '--skip-dependency-check', '--no-isolation', '--wheel',
+                '--outdir', '{home_dir}', '{args}']
 
     def build_step2(self, context, args):
         """ unpack the wheel into pybuild's normal  """
@@ -164,28 +164,33 @@ class BuildSystem(Base):
                  args['interpreter'])
         paths = sysconfig.get_paths()
 
+        # only changed files are copied, the ones that are not built anymore
+        # are removed (see installed_* manifests in home_dir)
+
         # start by copying the scripts
         for script_dir in Path(args['build_dir']).glob('scripts-*'):
             target_dir = args['destdir'] + paths['scripts']
             log.debug('Copying scripts directory contents from %s -> %s',
                       script_dir, target_dir)
-            shutil.copytree(
-                script_dir,
+            stats = sync_tree(
+                str(script_dir),
                 target_dir,
-                dirs_exist_ok=True,
+                manifest=osp.join(args['home_dir'], 'installed_' + script_dir.name),
             )
+            log.debug('%d files copied, %d unchanged, %d removed', *stats)
 
         # then copy the modules
         module_dir = args['build_dir']
         target_dir = args['destdir'] + args['install_dir']
         log.debug('Copying module contents from %s -> %s',
                   module_dir, target_dir)
-        shutil.copytree(
+        stats = sync_tree(
             module_dir,
             target_dir,
-            ignore=shutil.ignore_patterns('scripts-*'),
-            dirs_exist_ok=True,
+            ignore=SCRIPTS_RE,
+            manifest=osp.join(args['home_dir'], 'installed_modules'),
         )
+        log.debug('%d files copied, %d unchanged, %d removed', *stats)
 
     @shell_command
     def test(self, context, args):
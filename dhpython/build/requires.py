@@ -0,0 +1,193 @@
+# Copyright © 2022 Piotr Ożarowski <piotr@debian.org>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""Dependencies of a source tree without building it (pybuild --print-requires).
+
+Requirements are read from static metadata if it's reliable: pyproject.toml's
+[project] table (unless dependencies are dynamic), PKG-INFO (Metadata-Version
+2.2 or newer, unless Requires-Dist is dynamic), setup.cfg (if setup.py does
+not set install_requires) or egg-info's requires.txt. PEP 517's
+prepare_metadata_for_build_wheel hook is invoked otherwise.
+"""
+
+import email
+import json
+import logging
+from configparser import ConfigParser, Error as ConfigParserError
+from glob import glob1
+from os.path import exists, join
+from tempfile import TemporaryDirectory
+from dhpython.pydist import EXTRA_RE, guess_dependency
+from dhpython.tools import execute
+try:
+    import tomllib
+except ModuleNotFoundError:
+    try:
+        import tomli as tomllib
+    except ModuleNotFoundError:
+        tomllib = None
+
+log = logging.getLogger('dhpython')
+DEFAULT_BACKEND = 'setuptools.build_meta:__legacy__'
+# invoked in source directory: backend, its path and output file in argv
+HOOK_SCRIPT = '''
+import importlib, json, os, sys, tempfile, zipfile
+backend, paths, output = json.loads(sys.argv[1])
+sys.path[:0] = paths
+module, _, attrs = backend.partition(':')
+hooks = importlib.import_module(module)
+for attr in filter(None, attrs.split('.')):
+    hooks = getattr(hooks, attr)
+tmp = tempfile.mkdtemp(dir=os.path.dirname(output))
+if hasattr(hooks, 'prepare_metadata_for_build_wheel'):
+    with open(os.path.join(tmp, hooks.prepare_metadata_for_build_wheel(tmp), 'METADATA'), 'rb') as fp:
+        metadata = fp.read()
+else:
+    with zipfile.ZipFile(os.path.join(tmp, hooks.build_wheel(tmp))) as wheel:
+        name = [i for i in wheel.namelist() if i.endswith('.dist-info/METADATA')][0]
+        metadata = wheel.read(name)
+with open(output, 'wb') as fp:
+    fp.write(metadata)
+'''
+
+
+def _pyproject(dpath):
+    fpath = join(dpath, 'pyproject.toml')
+    if tomllib is None or not exists(fpath):
+        return {}
+    with open(fpath, 'rb') as fp:
+        return tomllib.load(fp)
+
+
+def from_pyproject(dpath):
+    project = _pyproject(dpath).get('project')
+    if not project or 'dependencies' in project.get('dynamic', []):
+        return None
+    return list(project.get('dependencies', []))
+
+
+def from_pkg_info(dpath):
+    fpath = join(dpath, 'PKG-INFO')
+    if not exists(fpath):
+        return None
+    with open(fpath, encoding='utf-8') as fp:
+        metadata = email.message_from_string(fp.read())
+    # older versions do not guarantee that missing fields are really missing
+    version = tuple(int(i) for i in metadata.get('Metadata-Version', '1.0').split('.')[:2])
+    dynamic = {i.lower() for i in metadata.get_all('Dynamic', [])}
+    if version < (2, 2) or 'requires-dist' in dynamic:
+        return None
+    return metadata.get_all('Requires-Dist', [])
+
+
+def from_setup_cfg(dpath):
+    fpath = join(dpath, 'setup.cfg')
+    if not exists(fpath):
+        return None
+    if exists(join(dpath, 'setup.py')):
+        with open(join(dpath, 'setup.py'), encoding='utf-8', errors='replace') as fp:
+            if 'install_requires' in fp.read():
+                return None
+    parser = ConfigParser(interpolation=None)
+    try:
+        parser.read(fpath, encoding='utf-8')
+    except ConfigParserError as err:
+        log.debug('cannot parse setup.cfg: %s', err)
+        return None
+    value = parser.get('options', 'install_requires', fallback=None)
+    if value is None or value.strip().startswith('file:'):
+        return None
+    return [i.strip() for i in value.replace(';\n', '\n').splitlines()
+            if i.strip() and not i.strip().startswith('#')]
+
+
+def from_requires_txt(dpath):
+    """Parse (base) requirements from egg-info shipped in sdist
+
+    Sections with environment markers only ("[:python_version < '3.8']")
+    are included, extras are not.
+    """
+    for dname in sorted(glob1(dpath, '*.egg-info')):
+        fpath = join(dpath, dname, 'requires.txt')
+        if exists(fpath):
+            break
+    else:
+        return None
+    result = []
+    marker = None
+    with open(fpath, encoding='utf-8') as fp:
+        for line in fp:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            if line.startswith('['):
+                section = line[1:-1]
+                marker = section[1:] if section.startswith(':') else False
+                continue
+            if marker is False:
+                continue  # extra
+            result.append('{}; {}'.format(line, marker) if marker else line)
+    return result
+
+
+def from_hook(dpath, interpreter, env=None):
+    """Return requirements from PEP 517 prepare_metadata_for_build_wheel"""
+    build_system = _pyproject(dpath).get('build-system', {})
+    backend = build_system.get('build-backend', DEFAULT_BACKEND)
+    paths = [join(dpath, i) for i in build_system.get('backend-path', [])]
+    with TemporaryDirectory() as tmp_dpath:
+        output = join(tmp_dpath, 'METADATA')
+        result = execute([interpreter, '-c', HOOK_SCRIPT,
+                          json.dumps([backend, paths, output])],
+                         cwd=dpath, env=env, shell=False)
+        if result['returncode'] != 0:
+            raise Exception('{} failed to prepare metadata:\n{}'.format(
+                backend, result['stderr'] or result['stdout']))
+        with open(output, encoding='utf-8') as fp:
+            metadata = email.message_from_string(fp.read())
+    return metadata.get_all('Requires-Dist', [])
+
+
+def requirements(dpath, interpreter='python3', env=None):
+    """Return source of requirements and the list of them"""
+    for name, func in (('pyproject.toml', from_pyproject),
+                       ('PKG-INFO', from_pkg_info),
+                       ('setup.cfg', from_setup_cfg),
+                       ('requires.txt', from_requires_txt)):
+        result = func(dpath)
+        if result is not None:
+            return name, result
+    return 'prepare_metadata_for_build_wheel', from_hook(dpath, interpreter, env)
+
+
+def debian_requires(impl, requires):
+    """Translate requirements (extras are skipped) into Debian dependencies"""
+    result = []
+    for req in requires:
+        if EXTRA_RE.search(req):
+            continue
+        try:
+            dependency = guess_dependency(impl, req)
+        except Exception as err:
+            log.warning('cannot guess dependency for %s: %s', req, err)
+            continue
+        if dependency and dependency not in result:
+            result.append(dependency)
+    return result
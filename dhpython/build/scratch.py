@@ -0,0 +1,136 @@
+# Copyright © 2022 Piotr Ożarowski <piotr@debian.org>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""Build and home directories in RAM backed file systems (PYBUILD_SCRATCH=tmpfs).
+
+.pybuild/<interpreter>_<version> becomes a symlink to a new temporary
+directory in $XDG_RUNTIME_DIR or /dev/shm, subsequent pybuild invocations
+(one per step) follow the symlink. Files installed into destdir are not
+affected.
+"""
+
+import logging
+from os import (access, makedirs, readlink, remove, rmdir, scandir, statvfs,
+                symlink, W_OK)
+from os.path import abspath, exists, isdir, islink, join
+from shutil import move, rmtree
+from tempfile import mkdtemp
+from dhpython.tools import scantree
+
+log = logging.getLogger('dhpython')
+# space needed for each version = source tree size * SIZE_FACTOR
+SIZE_FACTOR = 3
+# space that has to be left for other processes (in bytes)
+RESERVED = 256 * 1024 * 1024
+
+
+def scratch_root(env):
+    """Return RAM backed directory that can be used or None"""
+    for dpath in (env.get('XDG_RUNTIME_DIR'), '/dev/shm'):
+        if dpath and isdir(dpath) and access(dpath, W_OK):
+            return dpath
+
+
+def available_space(dpath):
+    """Return number of bytes that can be stored in given tmpfs directory"""
+    stat = statvfs(dpath)
+    result = stat.f_bavail * stat.f_frsize
+    # tmpfs size limit is often bigger than the amount of free memory
+    try:
+        with open('/proc/meminfo', encoding='utf-8') as fp:
+            for line in fp:
+                if line.startswith('MemAvailable:'):
+                    result = min(result, int(line.split()[1]) * 1024)
+                    break
+    except (IOError, ValueError):
+        pass
+    return result
+
+
+def tree_size(dpath):
+    return sum(entry.stat(follow_symlinks=False).st_size
+               for entry in scantree(dpath)
+               if entry.is_file(follow_symlinks=False))
+
+
+def _stamps_only(dpath):
+    """Check if directory contains nothing but step stamps (see release)"""
+    with scandir(dpath) as it:
+        return all(entry.name.endswith('.stamp') for entry in it)
+
+
+def prepare(home_dir, source_dir, env):
+    """Make home_dir a symlink to a directory in RAM if there's enough space.
+
+    Returns True if scratch directory is used.
+    """
+    if islink(home_dir):
+        if exists(readlink(home_dir)):
+            return True
+        # removed by a reboot or tmpfs cleaner
+        log.warning('scratch directory %s is gone, creating a new one',
+                    readlink(home_dir))
+        remove(home_dir)
+    elif exists(home_dir) and not _stamps_only(home_dir):
+        return False  # created without PYBUILD_SCRATCH=tmpfs, keep using it
+
+    root = scratch_root(env)
+    if not root:
+        log.info('PYBUILD_SCRATCH=tmpfs: no RAM backed directory available,'
+                 ' using %s', home_dir)
+        return False
+    needed = tree_size(source_dir) * SIZE_FACTOR + RESERVED
+    available = available_space(root)
+    if needed > available:
+        log.info('PYBUILD_SCRATCH=tmpfs: not enough space in %s (%d MB needed,'
+                 ' %d MB available), using %s', root, needed // 1048576,
+                 available // 1048576, home_dir)
+        return False
+
+    target = mkdtemp(prefix='pybuild-', dir=root)
+    if isdir(home_dir):
+        # stamps left by release()
+        with scandir(home_dir) as it:
+            for entry in it:
+                move(entry.path, target)
+        rmdir(home_dir)
+    makedirs(abspath(join(home_dir, '..')), exist_ok=True)
+    symlink(target, home_dir)
+    log.debug('PYBUILD_SCRATCH=tmpfs: %s -> %s', home_dir, target)
+    return True
+
+
+def release(home_dir):
+    """Remove scratch directory home_dir points to
+
+    Step stamps are moved to home_dir (a regular directory from now on,
+    prepare() will move them back into a new scratch directory).
+    """
+    if not islink(home_dir):
+        return
+    target = readlink(home_dir)
+    remove(home_dir)
+    makedirs(home_dir)
+    if isdir(target):
+        with scandir(target) as it:
+            for entry in it:
+                if entry.name.endswith('.stamp') and entry.is_file():
+                    move(entry.path, home_dir)
+        rmtree(target)
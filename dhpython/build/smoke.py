@@ -0,0 +1,170 @@
+# Copyright © 2022 Piotr Ożarowski <piotr@debian.org>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""Smoke tests for pure-Python packages.
+
+If files tested with one Python version are identical (except for shebang
+lines) to the ones already tested with another version, only a quick
+import check and a short list of tests (see --smoke-tests) are run.
+"""
+
+import json
+import logging
+import re
+from hashlib import sha256
+from os import remove, scandir
+from os.path import isdir, join, relpath
+from shlex import quote
+from dhpython.build.base import copy_test_files, shell_command
+from dhpython.tools import SCAN_SKIP_DIRS, locked, scantree, write_atomic
+
+log = logging.getLogger('dhpython')
+SMOKE_STATE = '.pybuild/smoke-tests.json'
+SKIP_DIRS = SCAN_SKIP_DIRS | {'__pycache__', '.pytest_cache', '.mypy_cache',
+                              '.hypothesis', '.tox'}
+EXTENSION_RE = re.compile(r'\.(so(\.[^/]*)?|pyd)$')
+IDENTIFIER_RE = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+
+
+def pure_digest(paths, extra=()):
+    """Return digest of pure-Python files in given directories.
+
+    None is returned if one of the directories contains an extension.
+    """
+    result = sha256()
+    for i in extra:
+        result.update(str(i).encode('utf-8') + b'\0')
+    for path in paths:
+        if not isdir(path):
+            continue
+        files = sorted(relpath(entry.path, path)
+                       for entry in scantree(path, skip=SKIP_DIRS)
+                       if entry.is_file(follow_symlinks=False)
+                       and not entry.name.endswith(('.pyc', '.pyo')))
+        for name in files:
+            if EXTENSION_RE.search(name):
+                return None
+            with open(join(path, name), 'rb') as fp:
+                content = fp.read()
+            if content.startswith(b'#!'):
+                # interpreter specific shebang
+                content = content.partition(b'\n')[2]
+            result.update(name.encode('utf-8', 'surrogateescape') + b'\0')
+            result.update(sha256(content).digest())
+    return result.hexdigest()
+
+
+def top_level_modules(path):
+    """Return names of modules and packages installed in given directory"""
+    result = []
+    if not isdir(path):
+        return result
+    for entry in scandir(path):
+        name = entry.name
+        if entry.is_dir():
+            if IDENTIFIER_RE.match(name) and name != '__pycache__':
+                result.append(name)
+        elif name.endswith('.py') and IDENTIFIER_RE.match(name[:-3]):
+            result.append(name[:-3])
+    return sorted(result)
+
+
+def test(plugin, func, context, args):
+    """Run smoke tests if the same files passed full test suite already.
+
+    Full test suite (`func`) is invoked if there's no record of a
+    successful run for these files or if smoke tests failed.
+    """
+    if context.get('test_modules') is not None or plugin.cfg.test_changed:
+        return func(context, args)  # not the whole test suite
+    cfg = plugin.cfg
+    digest = None if cfg.test_tox else _digest(plugin, context, args)
+    interpreter = str(args['interpreter'])
+    tested_with = _load_state().get(digest) if digest else None
+    if tested_with:
+        log.info('%s: files identical to the ones tested with %s,'
+                 ' running smoke tests only', interpreter, tested_with)
+        try:
+            return smoke_test(plugin, context, args)
+        except Exception as err:
+            log.warning('smoke tests failed, running full test suite: %s', err)
+    elif not digest:
+        log.debug('%s: smoke tests not possible (extensions found)', interpreter)
+    result = func(context, args)
+    if digest:
+        _save_state(digest, interpreter)
+    return result
+
+
+@copy_test_files()
+def _digest(plugin, context, args):
+    cfg = plugin.cfg
+    return pure_digest((args['test_dir'], args['build_dir']),
+                       extra=(plugin.NAME, cfg.test_nose, cfg.test_nose2,
+                              cfg.test_pytest, cfg.custom_tests, args['args']))
+
+
+@shell_command
+def smoke_test(plugin, context, args):
+    cfg = plugin.cfg
+    commands = []
+    modules = top_level_modules(args['test_dir'])
+    if modules:
+        commands.append('{interpreter} -c ' + quote('import ' + ', '.join(modules)))
+    if cfg.smoke_tests:
+        if cfg.test_pytest:
+            runner = '{interpreter} -m pytest '
+        elif cfg.test_nose2:
+            runner = '{interpreter} -m nose2 -v '
+        elif cfg.test_nose:
+            runner = '{interpreter} -m nose -v '
+        else:
+            runner = '{interpreter} -m unittest -v '
+        commands.append(runner + cfg.smoke_tests)
+    if not commands:
+        log.info('nothing to import and no smoke tests defined')
+        return 0
+    return 'cd {build_dir}; ' + ' && '.join(commands)
+
+
+def _load_state():
+    try:
+        with open(SMOKE_STATE, encoding='utf-8') as fp:
+            return json.load(fp)
+    except (IOError, ValueError):
+        return {}
+
+
+def remove_state():
+    """Forget files that passed the test suite (in clean step)"""
+    try:
+        remove(SMOKE_STATE)
+    except FileNotFoundError:
+        pass
+
+
+def _save_state(digest, interpreter):
+    try:
+        with locked(SMOKE_STATE + '.lock'):
+            state = _load_state()
+            state[digest] = interpreter
+            write_atomic(SMOKE_STATE, json.dumps(state))
+    except IOError as err:
+        log.debug('cannot save smoke tests state: %s', err)
@@ -0,0 +1,186 @@
+# Copyright © 2022 Piotr Ożarowski <piotr@debian.org>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+import json
+import logging
+import re
+from hashlib import sha256
+from os import environ, makedirs, remove, scandir
+from os.path import exists, isdir, join, relpath
+from uuid import uuid4
+from dhpython.tools import (SCAN_SKIP_DIRS, file_digest, tree_fingerprint,
+                            write_atomic)
+
+log = logging.getLogger('dhpython')
+
+STEPS = ('clean', 'configure', 'build', 'install', 'test')
+# build artifacts that do not invalidate stamps
+SOURCE_IGNORE = re.compile(r'(^build/|\.egg-info(/|$)|\.py[co]$|^\.coverage$)')
+SOURCE_SKIP_DIRS = SCAN_SKIP_DIRS | {'__pycache__', '.tox', '.pytest_cache', 'debian'}
+# files that do not invalidate step's output (see output_fingerprint)
+OUTPUT_IGNORE = re.compile(r'\.py[co]$')
+OUTPUT_SKIP_DIRS = SCAN_SKIP_DIRS | {'__pycache__', '.pytest_cache', '.mypy_cache',
+                                    '.hypothesis'}
+# files in debian directory that can change the way package is built
+DEBIAN_FILES = re.compile(r'^(rules|control|pybuild[^/]*)$')
+# options that do not change the result of a step
+VOLATILE_OPTIONS = {'resume', 'verbose', 'quiet', 'really_quiet',
+                    'detect_only', 'clean_only', 'configure_only', 'build_only',
+                    'install_only', 'test_only', 'list_systems', 'print_args',
+                    'plan', 'execute_plan', 'plan_executor',
+                    'daemon', 'daemon_timeout', 'test_jobs',
+                    'test_smoke', 'smoke_tests', 'test_cache',
+                    'test_cache_dir', 'test_cache_size', 'scratch',
+                    'timings_dir', 'worker', 'workers', 'watch',
+                    'print_requires'}
+
+
+def source_fingerprint(dpath, content=False):
+    """Return fingerprint of the source tree (without build artifacts)
+
+    :param content: hash files' content instead of their mtime
+    """
+    result = sha256()
+    result.update(tree_fingerprint(dpath, SOURCE_SKIP_DIRS, SOURCE_IGNORE,
+                                   content).encode())
+    debian_dir = join(dpath, 'debian')
+    if exists(debian_dir):
+        result.update(tree_fingerprint(join(debian_dir, 'patches'),
+                                       content=content).encode())
+        with scandir(debian_dir) as it:
+            fnames = sorted(i.name for i in it
+                            if i.is_file() and DEBIAN_FILES.match(i.name))
+        for fn in fnames:
+            digest = file_digest(join(debian_dir, fn))
+            result.update('{}\0{}\n'.format(fn, digest).encode())
+    return result.hexdigest()
+
+
+def _test_files(home_dir, dpath):
+    """Return test files copied to dpath (see base.copy_test_files)"""
+    try:
+        with open(join(home_dir, 'testfiles_to_rm_before_install'), encoding='utf-8') as fp:
+            paths = [relpath(line.rstrip('\n'), dpath) for line in fp]
+    except IOError:
+        return []
+    return [i for i in paths if not i.startswith('..')]
+
+
+def output_fingerprint(step, args):
+    """Return fingerprint of files generated by given step
+
+    Only build (build_dir) and install (version specific installation
+    directory in destdir) steps are checked, None is returned otherwise.
+    """
+    if step == 'build':
+        dpath = args['build_dir']
+    elif step == 'install':
+        dpath = join(args['destdir'], args['install_dir'].lstrip('/'))
+    else:
+        return None
+    if not isdir(dpath):
+        return 'missing'
+    ignore = OUTPUT_IGNORE
+    test_files = _test_files(args['home_dir'], dpath)
+    if test_files:
+        # copied by test step, removed before install one
+        ignore = re.compile(r'{}|^({})(/|$)'.format(
+            ignore.pattern, '|'.join(re.escape(i) for i in test_files)))
+    return tree_fingerprint(dpath, OUTPUT_SKIP_DIRS, ignore)
+
+
+def args_digest(plugin, cfg, args):
+    """Return digest of all parameters that can change step's result"""
+    options = {k: v for k, v in vars(cfg).items() if k not in VOLATILE_OPTIONS}
+    env = {k: v for k, v in environ.items() if k.startswith('PYBUILD_')}
+    data = json.dumps([plugin.NAME, options, env, args],
+                      sort_keys=True, default=str)
+    return sha256(data.encode('utf-8')).hexdigest()
+
+
+def read_stamp(home_dir, step):
+    fpath = join(home_dir, '{}.stamp'.format(step))
+    try:
+        with open(fpath, encoding='utf-8') as fp:
+            return json.load(fp)
+    except (IOError, ValueError):
+        return None
+
+
+def _previous_id(home_dir, step):
+    pos = STEPS.index(step)
+    if pos:
+        stamp = read_stamp(home_dir, STEPS[pos - 1])
+        if stamp:
+            return stamp['id']
+
+
+def write_stamp(home_dir, step, args_hash, source, returncode, output=None):
+    """Record step result in home_dir
+
+    :param output: see :func:`output_fingerprint`
+    """
+    stamp = {'id': uuid4().hex,
+             'previous': _previous_id(home_dir, step),
+             'args': args_hash,
+             'source': source,
+             'output': output,
+             'returncode': returncode}
+    makedirs(home_dir, exist_ok=True)
+    fpath = join(home_dir, '{}.stamp'.format(step))
+    write_atomic(fpath, json.dumps(stamp))
+
+
+def remove_stamps(home_dir):
+    """Invalidate all steps (f.e. after clean step)"""
+    for step in STEPS:
+        try:
+            remove(join(home_dir, '{}.stamp'.format(step)))
+        except FileNotFoundError:
+            pass
+
+
+def is_done(home_dir, step, args_hash, source, output=None):
+    """Check if step was completed with the same input
+
+    Stamp is valid only if arguments, source files and step's output
+    (f.e. removed by dh_prep) didn't change since it was written and if
+    the previous step's stamp is still the one that was there when this
+    step was invoked (i.e. previous step wasn't re-run).
+    """
+    stamp = read_stamp(home_dir, step)
+    if not stamp:
+        return False
+    if stamp['returncode'] != 0:
+        log.debug('%s step failed in previous run', step)
+        return False
+    if stamp['args'] != args_hash:
+        log.debug('%s step arguments changed', step)
+        return False
+    if stamp['source'] != source:
+        log.debug('source files changed since last %s step', step)
+        return False
+    if stamp.get('output') != output:
+        log.debug('files generated by %s step changed', step)
+        return False
+    if stamp['previous'] != _previous_id(home_dir, step):
+        log.debug('step preceding %s step was invoked again', step)
+        return False
+    return True
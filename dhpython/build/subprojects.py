@@ -0,0 +1,145 @@
+# Copyright © 2022 Piotr Ożarowski <piotr@debian.org>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""Concurrent builds of several subprojects (pybuild --subproject).
+
+Each subproject (source directory with its own name and destination
+directory) is handled by a separate pybuild invocation: build system is
+detected once per directory and all requested Python versions are built
+there. Subprojects that do not depend on each other are built concurrently.
+"""
+
+import asyncio
+import logging
+from graphlib import CycleError, TopologicalSorter
+from os.path import abspath, basename, normpath
+from dhpython.build.engine import run
+
+log = logging.getLogger('dhpython')
+OPTIONS = {'name': 'name', 'dest-dir': 'destdir', 'after': 'after'}
+
+
+def parse(value):
+    """Parse DIR[,name=NAME][,dest-dir=DIR][,after=NAME...] description
+
+    >>> sorted(parse('src/foo').items())
+    [('after', []), ('destdir', None), ('dir', 'src/foo'), ('name', 'foo')]
+    >>> parse('src/bar/,name=python-bar,after=foo,after=baz')['after']
+    ['foo', 'baz']
+    """
+    dpath, *options = value.split(',')
+    if not dpath:
+        raise ValueError('missing directory: {}'.format(value))
+    result = {'dir': dpath, 'name': basename(normpath(dpath)),
+              'destdir': None, 'after': []}
+    for option in options:
+        key, _, val = option.partition('=')
+        if key not in OPTIONS or not val:
+            raise ValueError('invalid subproject option: {}'.format(option))
+        if key == 'after':
+            result['after'].append(val)
+        else:
+            result[OPTIONS[key]] = val
+    return result
+
+
+def order(subprojects):
+    """Return subprojects' names in build order, check dependencies"""
+    graph = {}
+    for item in subprojects:
+        if item['name'] in graph:
+            raise Exception('duplicated subproject name: {}'.format(item['name']))
+        graph[item['name']] = set(item['after'])
+    for name, deps in graph.items():
+        unknown = deps - graph.keys()
+        if unknown:
+            raise Exception('{} depends on unknown subproject(s): {}'.format(
+                name, ', '.join(sorted(unknown))))
+    try:
+        return list(TopologicalSorter(graph).static_order())
+    except CycleError as err:
+        raise Exception('circular subproject dependency: {}'.format(
+            ' -> '.join(err.args[1])))
+
+
+def strip_argv(argv):
+    """Remove --subproject options from pybuild's command line"""
+    result = []
+    skip = False
+    for arg in argv:
+        if skip:
+            skip = False
+        elif arg == '--subproject':
+            skip = True
+        elif not arg.startswith('--subproject='):
+            result.append(arg)
+    return result
+
+
+def subproject_argv(argv, item):
+    """Return pybuild invocation for given subproject"""
+    result = list(argv) + ['--dir', abspath(item['dir']), '--name', item['name']]
+    if item['destdir']:
+        result.extend(('--dest-dir', abspath(item['destdir'])))
+    return result
+
+
+async def build_all(subprojects, argv, limit=None, env=None, log_output=False):
+    """Invoke pybuild for each subproject, respect their dependencies
+
+    Subproject starts when all subprojects it depends on finished, at most
+    `limit` of them are built at a time. If one of them fails, all others
+    are cancelled and an exception is raised.
+    """
+    order(subprojects)
+    semaphore = asyncio.Semaphore(limit) if limit else None
+    tasks = {}
+
+    async def build(item):
+        await asyncio.gather(*(tasks[i] for i in item['after']))
+        if semaphore is not None:
+            await semaphore.acquire()
+        try:
+            log.info('building %s subproject (%s)', item['name'], item['dir'])
+            result = await run(subproject_argv(argv, item), env=env,
+                               log_output=log_output, shell=False,
+                               prefix=item['name'])
+        finally:
+            semaphore is not None and semaphore.release()
+        if result['returncode'] != 0:
+            raise Exception('{} subproject failed with exit code {}'.format(
+                item['name'], result['returncode']))
+        log.debug('%s subproject built in %.1fs', item['name'], result['duration'])
+
+    # tasks are created before any of them is started (see build's gather)
+    for item in subprojects:
+        tasks[item['name']] = asyncio.ensure_future(build(item))
+    try:
+        await asyncio.gather(*tasks.values())
+    except BaseException:
+        for task in tasks.values():
+            task.cancel()
+        await asyncio.gather(*tasks.values(), return_exceptions=True)
+        raise
+
+
+def build(subprojects, argv, limit=None, env=None, log_output=False):
+    """Blocking version of :func:`build_all`."""
+    asyncio.run(build_all(subprojects, argv, limit, env, log_output))
@@ -0,0 +1,122 @@
+# Copyright © 2022 Piotr Ożarowski <piotr@debian.org>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""Durations of previous runs, used to start the longest jobs first.
+
+Estimates are exponential moving averages stored in a JSON file, per
+source package, per kind of job (step name, test module, etc.) and per
+interpreter. The file can be shared by many packages (see --timings-dir).
+"""
+
+import json
+import logging
+from os import makedirs
+from os.path import abspath, basename, dirname, join
+from dhpython.tools import locked, write_atomic
+
+log = logging.getLogger('dhpython')
+TIMINGS_FNAME = 'timings.json'
+# weight of the most recent measurement
+ALPHA = 0.5
+_databases = {}
+
+
+def package_name(dpath):
+    """Return source package name (from debian/changelog) or dir name"""
+    try:
+        with open(join(dpath, 'debian', 'changelog'), encoding='utf-8') as fp:
+            return fp.readline().split(' ', 1)[0] or basename(abspath(dpath))
+    except IOError:
+        return basename(abspath(dpath))
+
+
+class Timings:
+
+    def __init__(self, dpath, package):
+        self.fpath = join(dpath, TIMINGS_FNAME)
+        self.package = package
+        self.data = self._load().get(package, {})
+
+    def _load(self):
+        try:
+            with open(self.fpath, encoding='utf-8') as fp:
+                return json.load(fp)
+        except (IOError, ValueError):
+            return {}
+
+    def get(self, kind, name, default=None):
+        """Return estimated duration (in seconds) of a job"""
+        return self.data.get(kind, {}).get(name, default)
+
+    def record(self, kind, durations):
+        """Update estimates with measured durations ({name: seconds})"""
+        _update(self.data.setdefault(kind, {}), durations)
+        try:
+            makedirs(dirname(self.fpath) or '.', exist_ok=True)
+            with locked(self.fpath + '.lock'):
+                # other packages and concurrent pybuild instances could update it
+                data = self._load()
+                package = data.setdefault(self.package, {})
+                _update(package.setdefault(kind, {}), durations)
+                write_atomic(self.fpath, json.dumps(data))
+            self.data = package
+        except IOError as err:
+            log.debug('cannot save timings: %s', err)
+
+
+def _update(estimates, durations):
+    for name, seconds in durations.items():
+        previous = estimates.get(name)
+        if previous is None:
+            estimates[name] = seconds
+        else:
+            estimates[name] = ALPHA * seconds + (1 - ALPHA) * previous
+
+
+def load(cfg, dpath='.'):
+    """Return timings database for source package in given directory"""
+    key = (cfg.timings_dir, abspath(dpath))
+    if key not in _databases:
+        _databases[key] = Timings(cfg.timings_dir, package_name(dpath))
+    return _databases[key]
+
+
+def estimator(estimates, sizes=None):
+    """Return function that estimates job's duration.
+
+    Jobs without recorded durations are estimated by their size (if given),
+    converted to seconds using the average speed of jobs with known
+    durations (or by average duration).
+    """
+    sizes = sizes or {}
+    known = [(seconds, sizes[name]) for name, seconds in estimates.items()
+             if sizes.get(name)]
+    ratio = sum(i[0] for i in known) / sum(i[1] for i in known) if known else None
+    mean = sum(estimates.values()) / len(estimates) if estimates else None
+
+    def estimate(name):
+        if estimates.get(name) is not None:
+            return estimates[name]
+        if ratio is not None:
+            return sizes.get(name, 0) * ratio
+        if mean is not None:
+            return mean
+        return sizes.get(name, 0)  # no history, size is the only hint
+    return estimate
@@ -0,0 +1,160 @@
+# Copyright © 2022 Piotr Ożarowski <piotr@debian.org>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""Incremental rebuilds after source changes (pybuild --watch).
+
+Source tree is checked every POLL_INTERVAL seconds (or as soon as inotify
+reports an event, if inotify_simple module is available). Modified pure
+Python files are copied over the built/installed ones, anything else
+(extension sources, build configuration, new or removed files) triggers
+build and install steps. Only tests that import changed modules (see
+:mod:`dhpython.build.impact`) are invoked afterwards.
+"""
+
+import logging
+from os.path import exists, join, relpath
+from shutil import copy2
+from time import sleep
+from dhpython.build.impact import module_name
+from dhpython.tools import SCAN_SKIP_DIRS, scantree
+try:
+    from inotify_simple import INotify, flags
+except ImportError:
+    INotify = None
+
+log = logging.getLogger('dhpython')
+POLL_INTERVAL = 1
+# time given to editors and VCS to finish writing files
+SETTLE_DELAY = 0.2
+SKIP_DIRS = SCAN_SKIP_DIRS | {'__pycache__', '.pytest_cache', '.mypy_cache',
+                              '.hypothesis', '.tox', '.eggs', 'build', 'dist',
+                              'debian'}
+# changes in these files do not affect build results
+IGNORED_SUFFIXES = ('.rst', '.md', '.pyc', '.swp', '~')
+# Python files that are not copied anywhere
+BUILD_FILES = {'setup.py'}
+
+
+def snapshot(dpath):
+    """Return {relative path: (mtime, size)} of all source files"""
+    result = {}
+    for entry in scantree(dpath, skip=SKIP_DIRS):
+        if entry.is_dir(follow_symlinks=False) or '.egg-info' in entry.path:
+            continue
+        try:
+            stat = entry.stat(follow_symlinks=False)
+        except OSError:
+            continue  # removed in the meantime
+        result[relpath(entry.path, dpath)] = (stat.st_mtime_ns, stat.st_size)
+    return result
+
+
+def _watches(dpath):
+    if INotify is None:
+        return None
+    mask = flags.MODIFY | flags.CLOSE_WRITE | flags.CREATE | flags.DELETE |\
+        flags.MOVED_FROM | flags.MOVED_TO
+    try:
+        inotify = INotify()
+        inotify.add_watch(dpath, mask)
+        for entry in scantree(dpath, skip=SKIP_DIRS):
+            if entry.is_dir(follow_symlinks=False):
+                inotify.add_watch(entry.path, mask)
+    except OSError as err:
+        log.debug('inotify not available, polling: %s', err)
+        return None
+    return inotify
+
+
+def wait(dpath, previous, interval=POLL_INTERVAL):
+    """Block until source files change
+
+    :param previous: result of :func:`snapshot`
+    :returns: new snapshot and set of changed paths
+    """
+    inotify = _watches(dpath)
+    try:
+        while True:
+            if inotify:
+                inotify.read(timeout=interval * 1000)
+            else:
+                sleep(interval)
+            current = snapshot(dpath)
+            if current == previous:
+                continue
+            while True:  # wait until all files are written
+                sleep(SETTLE_DELAY)
+                settled = snapshot(dpath)
+                if settled == current:
+                    break
+                current = settled
+            changed = {path for path in current.keys() | previous.keys()
+                       if current.get(path) != previous.get(path)
+                       and not path.endswith(IGNORED_SUFFIXES)}
+            if changed:
+                return current, changed
+            previous = current
+    finally:
+        if inotify:
+            inotify.close()
+
+
+def classify(changed, previous, current):
+    """Split changes into modified pure Python files and other ones
+
+    >>> classify({'foo/a.py', 'foo/new.py', 'x.c'}, {'foo/a.py': 1, 'x.c': 1},
+    ...          {'foo/a.py': 2, 'foo/new.py': 1, 'x.c': 2})
+    (['foo/a.py'], ['foo/new.py', 'x.c'])
+    """
+    python = sorted(path for path in changed if path.endswith('.py') and
+                    path in previous and path in current and
+                    path.rsplit('/', 1)[-1] not in BUILD_FILES)
+    return python, sorted(changed.difference(python))
+
+
+def sync_modules(paths, source_dir, targets):
+    """Copy modified Python files over their built/installed copies
+
+    File's path is looked up in each target directory as is and relative
+    to its top-level package (i.e. "src/foo/bar.py" replaces "foo/bar.py").
+
+    :returns: names of updated modules and list of files that were not
+        found in any of target directories
+    """
+    modules = set()
+    missing = []
+    for path in paths:
+        parts = path.split('/')
+        top = len(parts) - 1
+        while top and exists(join(source_dir, *parts[:top], '__init__.py')):
+            top -= 1
+        found = False
+        for target in targets:
+            for i in sorted({0, top}):
+                dst = join(target, *parts[i:])
+                if exists(dst):
+                    log.info('updating %s', dst)
+                    copy2(join(source_dir, path), dst)
+                    modules.add(module_name('/'.join(parts[i:])))
+                    found = True
+                    break
+        if not found:
+            missing.append(path)
+    return modules, missing
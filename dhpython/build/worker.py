@@ -0,0 +1,391 @@
+# Copyright © 2022 Piotr Ożarowski <piotr@debian.org>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""Plan execution on remote workers (pybuild --worker / --workers).
+
+A worker serves requests on a TCP or unix socket, in its own checkout of
+the source tree. Coordinator sends all plan entries of one (interpreter,
+version) pair at once, with paths rebased to worker's checkout (and
+files that plugins created in home directories while generating the plan,
+like distutils' config), worker streams back their output and, once they all succeed, a tarball of
+installed files that is unpacked into local destdir.
+
+Workers invoke everything they receive. Requests have to contain the
+worker's PYBUILD_WORKER_TOKEN (required for TCP sockets, unix sockets are
+accessible to their owner only) and workers listen on trusted networks only.
+"""
+
+import asyncio
+import hmac
+import json
+import logging
+import os
+import re
+import signal
+import socket
+import struct
+import sys
+import tarfile
+from os.path import (abspath, commonpath, dirname, exists, isabs, join, realpath,
+                     relpath)
+from tempfile import TemporaryFile
+from dhpython.build.engine import Output
+from dhpython.build.plan import execute_entry
+
+log = logging.getLogger('dhpython')
+
+HEADER = struct.Struct('!cI')
+# message types
+REQUEST = b'R'
+LOG = b'L'
+DATA = b'D'
+RESULT = b'E'
+# bigger files from home directories are not sent to workers
+MAX_FILE_SIZE = 64 * 1024
+# shared secret of workers and coordinators
+TOKEN_ENV = 'PYBUILD_WORKER_TOKEN'
+
+
+def parse_address(address):
+    """Return socket family and address for "unix:PATH" or "HOST:PORT"
+
+    >>> parse_address('unix:/tmp/worker.sock')
+    (<AddressFamily.AF_UNIX: 1>, '/tmp/worker.sock')
+    >>> parse_address('[::1]:8000')
+    (<AddressFamily.AF_INET6: 10>, ('::1', 8000))
+    """
+    if address.startswith('unix:'):
+        return socket.AF_UNIX, address[5:]
+    host, _, port = address.rpartition(':')
+    if not host or not port.isdigit():
+        raise ValueError('invalid worker address: {}'.format(address))
+    if host.startswith('['):
+        return socket.AF_INET6, (host[1:-1], int(port))
+    return socket.AF_INET, (host, int(port))
+
+
+def rebase(value, old, new):
+    """Replace `old` path with `new` one in all strings of given structure
+
+    Only whole path components are replaced:
+
+    >>> rebase(['cd /src/foo && ls /src/foo-2 /x/src/foo', '/src/foo'], '/src/foo', '/w')
+    ['cd /w && ls /src/foo-2 /x/src/foo', '/w']
+    """
+    if old == new:
+        return value
+    if isinstance(value, str):
+        return re.sub(r'(?<![\w./-]){}(?![\w.-])'.format(re.escape(old)),
+                      lambda _: new, value)
+    if isinstance(value, list):
+        return [rebase(i, old, new) for i in value]
+    if isinstance(value, dict):
+        return {k: rebase(v, old, new) for k, v in value.items()}
+    return value
+
+
+def _send(conn, kind, payload):
+    conn.sendall(HEADER.pack(kind, len(payload)) + payload)
+
+
+def _recv(conn):
+    header = conn.recv(HEADER.size, socket.MSG_WAITALL)
+    if len(header) != HEADER.size:
+        raise Exception('connection closed')
+    kind, size = HEADER.unpack(header)
+    payload = conn.recv(size, socket.MSG_WAITALL) if size else b''
+    if len(payload) != size:
+        raise Exception('connection closed')
+    return kind, payload
+
+
+class _Frames:
+    """File-like object that sends everything written as `kind` messages"""
+
+    def __init__(self, conn, kind):
+        self.conn = conn
+        self.kind = kind
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        if data:
+            _send(self.conn, self.kind, data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+
+def _home_files(entries, root):
+    """Return files that plugins wrote in home dirs ({path: content})"""
+    result = {}
+    for dpath in {entry['dirs']['home_dir'] for entry in entries}:
+        if not exists(dpath) or relpath(dpath, root).startswith('..'):
+            continue
+        for entry in os.scandir(dpath):
+            if entry.is_file(follow_symlinks=False) and entry.stat().st_size <= MAX_FILE_SIZE:
+                with open(entry.path, encoding='utf-8', errors='surrogateescape') as fp:
+                    result[relpath(entry.path, root)] = fp.read()
+    return result
+
+
+def _outputs(entries, root):
+    """Return directories with installed files (relative to worker's root)"""
+    result = []
+    for entry in entries:
+        if entry['step'] != 'install':
+            continue
+        for dpath in (entry['dirs']['destdir'],
+                      (entry.get('ext_destdir') or {}).get('destdir')):
+            if not dpath or not exists(dpath):
+                continue
+            dpath = relpath(abspath(dpath), root)
+            if dpath.startswith('..'):
+                log.warning('skipping %s: outside of source tree', dpath)
+            elif dpath not in result:
+                result.append(dpath)
+    return result
+
+
+def _write_files(files, root):
+    """Write files sent by coordinator (in worker's source tree only)"""
+    root = realpath(root)
+    for fpath, content in files.items():
+        fpath = realpath(join(root, fpath))
+        if commonpath((root, fpath)) != root:
+            raise Exception('invalid file path: {}'.format(fpath))
+        os.makedirs(dirname(fpath), exist_ok=True)
+        with open(fpath, 'w', encoding='utf-8', errors='surrogateescape') as fp:
+            fp.write(content)
+
+
+def _handle(conn, root, token=None):
+    kind, payload = _recv(conn)
+    if kind != REQUEST:
+        raise Exception('invalid request')
+    request = json.loads(payload.decode('utf-8'))
+    try:
+        if token and not hmac.compare_digest(
+                str(request.get('token')).encode('utf-8'), token.encode('utf-8')):
+            log.warning('rejecting request with invalid token')
+            raise Exception('invalid token')
+        entries = rebase(request['entries'], request['root'], root)
+        _write_files(rebase(request['files'], request['root'], root), root)
+        for entry in entries:
+            execute_entry(entry, log_file=_Frames(conn, LOG))
+    except Exception as err:
+        _send(conn, RESULT, json.dumps({'error': str(err)}).encode('utf-8'))
+        return
+    dirs = _outputs(entries, root)
+    if dirs:
+        with tarfile.open(fileobj=_Frames(conn, DATA), mode='w|gz') as tar:
+            for dpath in dirs:
+                tar.add(dpath)
+    _send(conn, RESULT, json.dumps({'error': None}).encode('utf-8'))
+
+
+def serve(address, root=None, token=None):
+    """Invoke plan entries sent by coordinators, in `root` source tree
+
+    Every request is handled in a forked process, i.e. many requests can
+    be handled at the same time.
+
+    :param token: secret that requests have to contain
+        [default: PYBUILD_WORKER_TOKEN env. variable, required for TCP]
+    """
+    root = abspath(root or os.getcwd())
+    token = token or os.environ.get(TOKEN_ENV)
+    family, addr = parse_address(address)
+    if family != socket.AF_UNIX and not token:
+        raise Exception('{} is required to listen on {}'.format(TOKEN_ENV, address))
+    os.chdir(root)
+    if family == socket.AF_UNIX:
+        if exists(addr):
+            os.remove(addr)
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        umask = os.umask(0o177)  # owner only
+        try:
+            sock.bind(addr)
+        finally:
+            os.umask(umask)
+        sock.listen(16)
+    else:
+        sock = socket.create_server(addr, family=family, backlog=16)
+    log.info('pybuild worker listening on %s (source tree: %s)', address, root)
+    # let the kernel reap finished request handlers
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+    try:
+        while True:
+            conn, _ = sock.accept()
+            if os.fork():
+                conn.close()
+                continue
+            # child process
+            signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+            sock.close()
+            returncode = 0
+            try:
+                with conn:
+                    _handle(conn, root, token)
+            except Exception as err:
+                log.error('cannot handle request: %s', err)
+                returncode = 1
+            finally:
+                os._exit(returncode)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        sock.close()
+        if family == socket.AF_UNIX and exists(addr):
+            os.remove(addr)
+
+
+async def _read(reader):
+    try:
+        kind, size = HEADER.unpack(await reader.readexactly(HEADER.size))
+        return kind, await reader.readexactly(size)
+    except asyncio.IncompleteReadError:
+        raise Exception('connection closed')
+
+
+async def run_entries(address, entries, root, log_output=False):
+    """Invoke plan entries on given worker
+
+    Requests contain PYBUILD_WORKER_TOKEN env. variable's value.
+
+    :returns: temporary file with installed files (tar.gz) or None
+    """
+    family, addr = parse_address(address)
+    try:
+        if family == socket.AF_UNIX:
+            reader, writer = await asyncio.open_unix_connection(addr)
+        else:
+            reader, writer = await asyncio.open_connection(*addr)
+    except OSError as err:
+        raise Exception('cannot connect to worker {}: {}'.format(address, err))
+    entry = entries[0]
+    output = Output(sys.stdout if log_output is False else log_output,
+                    prefix=entry['interpreter'].format(version=entry['version']))
+    request = json.dumps({'root': root, 'entries': entries,
+                          'files': _home_files(entries, root),
+                          'token': os.environ.get(TOKEN_ENV)}).encode('utf-8')
+    data = None
+    try:
+        writer.write(HEADER.pack(REQUEST, len(request)) + request)
+        await writer.drain()
+        while True:
+            kind, payload = await _read(reader)
+            if kind == LOG:
+                output.feed(payload)
+            elif kind == DATA:
+                if data is None:
+                    data = TemporaryFile()
+                data.write(payload)
+            elif kind == RESULT:
+                break
+        output.feed(b'', final=True)
+        error = json.loads(payload.decode('utf-8'))['error']
+        if error:
+            raise Exception('worker {}: {}'.format(address, error))
+    except BaseException:
+        if data is not None:
+            data.close()
+        raise
+    finally:
+        writer.close()
+    if data is not None:
+        data.seek(0)
+    return data
+
+
+async def _dispatch(chains, workers, root, log_output):
+    queue = list(enumerate(chains))
+    results = [None] * len(chains)
+
+    async def consume(address):
+        while queue:
+            i, entries = queue.pop(0)
+            results[i] = await run_entries(address, entries, root, log_output)
+
+    tasks = [asyncio.ensure_future(consume(i)) for i in workers]
+    try:
+        await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for data in results:
+            data and data.close()
+        raise
+    return results
+
+
+def _inside(path, root):
+    return commonpath((root, realpath(path))) == root
+
+
+def _checked_members(tar, root):
+    """Return archive members, raise exception if one of them would be
+    extracted outside of root (for Python without tarfile's filters)"""
+    root = realpath(root)
+    members = tar.getmembers()
+    for member in members:
+        path = join(root, member.name)
+        if isabs(member.name) or not _inside(path, root):
+            raise Exception('invalid path in archive: {}'.format(member.name))
+        if member.issym():
+            target = join(dirname(path), member.linkname)
+        elif member.islnk():
+            target = join(root, member.linkname)
+        elif member.isdev():
+            raise Exception('device file in archive: {}'.format(member.name))
+        else:
+            continue
+        if isabs(member.linkname) or not _inside(target, root):
+            raise Exception('invalid link in archive: {} -> {}'.format(
+                member.name, member.linkname))
+    return members
+
+
+def execute_plan(plan, workers, log_output=False, root=None):
+    """Invoke plan generated by `pybuild --plan` on given workers
+
+    Entries are grouped by interpreter and version, each group is sent to
+    the first free worker (list the same worker twice to let it handle two
+    groups at a time). Installed files are unpacked in plan's order, so
+    default version's ones (its entries are the last ones) take precedence.
+
+    :param workers: list of worker addresses (see :func:`parse_address`)
+    :param log_output: see :func:`dhpython.build.engine.run`'s `log_output`
+    """
+    root = abspath(root or os.getcwd())
+    chains = {}
+    for entry in plan:
+        chains.setdefault((entry['interpreter'], entry['version']), []).append(entry)
+    results = asyncio.run(_dispatch(list(chains.values()), workers, root, log_output))
+    for data in results:
+        if data is None:
+            continue
+        with data, tarfile.open(fileobj=data, mode='r:gz') as tar:
+            if hasattr(tarfile, 'data_filter'):
+                tar.extractall(root, filter='tar')
+            else:
+                tar.extractall(root, members=_checked_members(tar, root))
@@ -0,0 +1,223 @@
+# Copyright © 2022 Piotr Ożarowski <piotr@debian.org>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+import json
+import logging
+import os
+import signal
+import socket
+import struct
+import sys
+import traceback
+from os.path import dirname, exists
+from dhpython.jobserver import pipe_fds, replace_fds
+
+log = logging.getLogger('dhpython')
+
+# relative path: unix socket paths are limited to ~100 characters
+SOCKET_PATH = '.pybuild/pybuild.sock'
+IDLE_TIMEOUT = 600
+MAX_MESSAGE = 1024 * 1024
+# struct ucred: pid, uid, gid
+PEERCRED = struct.Struct('3i')
+
+
+def forward(argv, path=SOCKET_PATH):
+    """Forward pybuild invocation to a running daemon
+
+    Standard input, output and error file descriptors are passed to the
+    daemon, environment and current working directory are sent as well.
+
+    :returns: exit code or None if daemon is not running
+    """
+    if not exists(path):
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except OSError:
+        sock.close()
+        return None
+    # make's jobserver pipe (if any) is passed along with stdin/out/err
+    fds = [0, 1, 2] + list(pipe_fds() or ())
+    with sock:
+        request = json.dumps({'argv': argv, 'cwd': os.getcwd(),
+                              'env': dict(os.environ)}).encode('utf-8')
+        try:
+            socket.send_fds(sock, [struct.pack('!I', len(request)), request], fds)
+            response = sock.recv(4, socket.MSG_WAITALL)
+        except OSError:
+            return None
+    if len(response) != 4:
+        log.error('pybuild daemon did not return exit code')
+        return 1
+    return struct.unpack('!i', response)[0]
+
+
+def _warm_up():
+    """Load data that doesn't change between pybuild invocations"""
+    from dhpython import build
+    from dhpython.interpreter import Interpreter
+    from dhpython.pydist import load
+    from dhpython.version import get_requested_versions
+    log.debug('plugins available in daemon: %s', ', '.join(build.plugins))
+    for version in get_requested_versions('cpython3', available=True):
+        try:
+            # sysconfig details are cached by Interpreter class
+            Interpreter('python{}'.format(version)).include_dir
+        except Exception as err:
+            log.debug('cannot preload python%s details: %s', version, err)
+    load('cpython3')
+
+
+def _pydist_overrides_mtime():
+    from dhpython import PYDIST_OVERRIDES_FNAMES
+    try:
+        return os.stat(PYDIST_OVERRIDES_FNAMES['cpython3']).st_mtime_ns
+    except OSError:
+        return None
+
+
+def _handle(conn, handler, overrides_mtime):
+    """Invoke handler in forked process, with client's fds and environment"""
+    # request can set environment variables (PYBUILD_BEFORE_*, etc.)
+    creds = conn.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, PEERCRED.size)
+    _, uid, _ = PEERCRED.unpack(creds)
+    if uid != os.getuid():
+        raise Exception('request from other user (uid={}) rejected'.format(uid))
+    # file descriptors are attached to the first part of the message
+    msg, fds, _, _ = socket.recv_fds(conn, 4, 5, socket.MSG_WAITALL)
+    if len(msg) != 4 or len(fds) not in (3, 5):
+        for fd in fds:
+            os.close(fd)
+        raise Exception('invalid request')
+    size = struct.unpack('!I', msg)[0]
+    if size > MAX_MESSAGE:
+        raise Exception('request too big')
+    request = json.loads(conn.recv(size, socket.MSG_WAITALL).decode('utf-8'))
+
+    if os.fork():
+        for fd in fds:
+            os.close(fd)
+        return
+
+    # child process
+    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+    returncode = 1
+    try:
+        for target, fd in enumerate(fds[:3]):
+            os.dup2(fd, target)
+            os.close(fd)
+        os.chdir(request['cwd'])
+        os.environ.clear()
+        os.environ.update(request['env'])
+        if len(fds) == 5:
+            # jobserver's pipe has different numbers in this process
+            os.environ['MAKEFLAGS'] = replace_fds(os.environ['MAKEFLAGS'], *fds[3:])
+        sys.argv = request['argv']
+        if _pydist_overrides_mtime() != overrides_mtime:
+            from dhpython.pydist import load
+            load.cache.clear()
+        try:
+            handler()
+            returncode = 0
+        except SystemExit as err:
+            if err.code is None:
+                returncode = 0
+            elif isinstance(err.code, int):
+                returncode = err.code
+            else:
+                print(err.code, file=sys.stderr)
+    except Exception:
+        traceback.print_exc()
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        try:
+            conn.sendall(struct.pack('!i', returncode))
+        finally:
+            os._exit(returncode)
+
+
+def serve(handler, timeout=IDLE_TIMEOUT, path=SOCKET_PATH):
+    """Start pybuild daemon in the background
+
+    Every request is handled in a forked process (i.e. with all modules and
+    data loaded in this one). The daemon exits if there were no requests in
+    `timeout` seconds.
+
+    :param handler: function that parses sys.argv and invokes pybuild
+    """
+    os.makedirs(dirname(path), exist_ok=True)
+    if exists(path):
+        if forward_possible(path):
+            raise Exception('pybuild daemon is already running')
+        os.remove(path)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    # only the owner can connect
+    umask = os.umask(0o177)
+    try:
+        sock.bind(path)
+    finally:
+        os.umask(umask)
+    os.chmod(path, 0o600)
+    sock.listen(16)
+    sock.settimeout(timeout)
+    if os.fork():
+        sock.close()
+        return  # parent returns once socket is ready
+    os.setsid()
+    devnull = os.open(os.devnull, os.O_RDWR)
+    for fd in (0, 1, 2):
+        os.dup2(devnull, fd)
+
+    _warm_up()
+    overrides_mtime = _pydist_overrides_mtime()
+    # let the kernel reap finished request handlers
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+    try:
+        while True:
+            try:
+                conn, _ = sock.accept()
+            except socket.timeout:
+                break
+            with conn:
+                conn.settimeout(None)
+                try:
+                    _handle(conn, handler, overrides_mtime)
+                except Exception as err:
+                    log.debug('cannot handle pybuild request: %s', err)
+    finally:
+        sock.close()
+        if exists(path):
+            os.remove(path)
+        os._exit(0)
+
+
+def forward_possible(path=SOCKET_PATH):
+    """Check if daemon is listening on given socket"""
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except OSError:
+        return False
+    finally:
+        sock.close()
+    return True
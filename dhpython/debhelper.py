@@ -18,12 +18,15 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 # THE SOFTWARE.
 
+import json
 import logging
 import re
-from os import makedirs, chmod, environ
+from hashlib import sha256
+from os import makedirs, chmod, environ, stat
 from os.path import basename, exists, join, dirname
 from sys import argv
 from dhpython import DEPENDS_SUBSTVARS, PKG_NAME_TPLS, RT_LOCATIONS, RT_TPLS
+from dhpython.tools import execute, write_atomic
 
 log = logging.getLogger('dhpython')
 parse_dep = re.compile('''[,\s]*
@@ -33,6 +36,15 @@ parse_dep = re.compile('''[,\s]*
     \s*
     (?:\[(?P<arch>[^\]]+)\])?
     ''', re.VERBOSE).match
+ARCH_VAR_RE = re.compile(r'^DEB_(?:HOST|BUILD|TARGET)_(?:ARCH|GNU|MULTIARCH)')
+# variables used by pybuild, if all of them are exported by dpkg-buildpackage
+# there's no need to invoke dpkg-architecture
+REQUIRED_ARCH_VARS = ('DEB_HOST_ARCH', 'DEB_HOST_ARCH_OS',
+                      'DEB_HOST_MULTIARCH', 'DEB_BUILD_ARCH')
+# files that define dpkg-architecture's output (in addition to env. variables)
+DPKG_ARCH_FILES = ('/usr/bin/dpkg-architecture', '/usr/bin/dpkg',
+                   '/usr/share/dpkg/cputable', '/usr/share/dpkg/ostable',
+                   '/usr/share/dpkg/tupletable')
 
 
 def build_options(**options):
@@ -47,6 +59,54 @@ def build_options(**options):
     return type('Options', (object,), built_options)
 
 
+def dpkg_architecture(cache_dir='.pybuild'):
+    """Return dpkg-architecture's variables (empty dict if not available)
+
+    Values exported by dpkg-buildpackage are used if available. If they're
+    not, dpkg-architecture is invoked only if there's no result cached (in
+    cache_dir) for current toolchain.
+    """
+    result = {k: v for k, v in environ.items() if ARCH_VAR_RE.match(k)}
+    if all(i in result for i in REQUIRED_ARCH_VARS):
+        return result
+
+    if not exists('/usr/bin/dpkg-architecture'):
+        return {}
+
+    key = [sorted(result.items()), environ.get('CC')]
+    for fpath in DPKG_ARCH_FILES:
+        try:
+            fstat = stat(fpath)
+        except OSError:
+            key.append(None)
+        else:
+            key.append((fstat.st_size, fstat.st_mtime_ns))
+    key = sha256(json.dumps(key).encode('utf-8')).hexdigest()
+
+    fpath = join(cache_dir, 'dpkg-architecture.json')
+    try:
+        with open(fpath, encoding='utf-8') as fp:
+            cache = json.load(fp)
+    except (IOError, ValueError):
+        cache = {}
+    if key in cache:
+        return cache[key]
+
+    result = {}
+    res = execute(['/usr/bin/dpkg-architecture'], shell=False)
+    for line in res['stdout'].splitlines():
+        name, value = line.strip().split('=', 1)
+        result[name] = value
+
+    try:
+        makedirs(cache_dir, exist_ok=True)
+        cache[key] = result
+        write_atomic(fpath, json.dumps(cache))
+    except IOError as err:
+        log.debug('cannot cache dpkg-architecture output: %s', err)
+    return result
+
+
 class DebHelper:
     """Reinvents the wheel / some dh functionality (Perl is ugly ;-P)"""
 
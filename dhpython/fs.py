@@ -24,21 +24,28 @@ import logging
 import os
 import re
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from filecmp import cmp as cmpfile
 from os.path import lexists, exists, getsize, isdir, islink, join, realpath, split, splitext
 from shutil import rmtree
 from stat import ST_MODE, S_IXUSR, S_IXGRP, S_IXOTH
 from dhpython import MULTIARCH_DIR_TPL
-from dhpython.tools import fix_shebang, clean_egg_name
+from dhpython.tools import fix_shebang, clean_egg_name, parallel_jobs, trash
 from dhpython.interpreter import Interpreter
 
 log = logging.getLogger('dhpython')
 
 
-def fix_locations(package, interpreter, versions, options):
-    """Move files to the right location."""
+def fix_locations(package, interpreter, versions, options, dry_run=False):
+    """Move files to the right location.
+
+    All directories are scanned first (see :class:`Relocation`), files are
+    moved, merged and removed afterwards. With `dry_run`, planned operations
+    are only logged. Returns the plan.
+    """
     # make a copy since we change version later
     interpreter = Interpreter(interpreter)
+    relocation = Relocation(interpreter, options)
 
     for version in versions:
         interpreter.version = version
@@ -48,22 +55,14 @@ def fix_locations(package, interpreter, versions, options):
             if isdir(srcdir):
                 # TODO: what about relative symlinks?
                 log.debug('moving files from %s to %s', srcdir, dstdir)
-                share_files(srcdir, dstdir, interpreter, options)
-                try:
-                    os.removedirs(srcdir)
-                except OSError:
-                    pass
+                relocation.add(srcdir, dstdir)
 
         # do the same with debug locations
         dstdir = interpreter.sitedir(package, gdb=True)
         for srcdir in interpreter.old_sitedirs(package, gdb=True):
             if isdir(srcdir):
                 log.debug('moving files from %s to %s', srcdir, dstdir)
-                share_files(srcdir, dstdir, interpreter, options)
-                try:
-                    os.removedirs(srcdir)
-                except OSError:
-                    pass
+                relocation.add(srcdir, dstdir)
 
         # move files from /usr/include/pythonX.Y/ to …/pythonX.Ym/
         if interpreter.symlinked_include_dir:
@@ -71,81 +70,218 @@ def fix_locations(package, interpreter, versions, options):
             if srcdir and isdir(srcdir):
                 dstdir = "debian/%s%s" % (package, interpreter.include_dir)
                 log.debug('moving files from %s to %s', srcdir, dstdir)
-                share_files(srcdir, dstdir, interpreter, options)
-                try:
-                    os.removedirs(srcdir)
-                except OSError:
-                    pass
+                relocation.add(srcdir, dstdir)
+
+    if dry_run:
+        for line in relocation.report():
+            log.info(line)
+    else:
+        relocation.execute(parallel_jobs())
+    return relocation
 
 
 def share_files(srcdir, dstdir, interpreter, options):
     """Try to move as many files from srcdir to dstdir as possible."""
-    cleanup_actions = []
-    for i in os.listdir(srcdir):
-        fpath1 = join(srcdir, i)
-        if not lexists(fpath1):  # removed in rename_ext
-            continue
-        if i.endswith('.pyc'):  # f.e. when tests were invoked on installed files
-            os.remove(fpath1)
-            continue
-        if not options.no_ext_rename and splitext(i)[-1] == '.so':
-            # try to rename extension here as well (in :meth:`scan` info about
-            # Python version is gone)
-            version = interpreter.parse_public_dir(srcdir)
-            if version and version is not True:
-                fpath1 = Scan.rename_ext(fpath1, interpreter, version)
-                i = split(fpath1)[-1]
-        if srcdir.endswith(".dist-info") and (
-                i == 'LICENSE' or i.startswith('LICENSE.')):
-            os.remove(fpath1)
-            cleanup_actions.append((remove_from_RECORD, (i,)))
-            continue
-        fpath2 = join(dstdir, i)
-        if not isdir(fpath1) and not exists(fpath2):
-            # do not rename directories here - all .so files have to be renamed first
-            os.renames(fpath1, fpath2)
-            continue
-        if islink(fpath1):
-            # move symlinks without changing them if they point to the same place
-            if not exists(fpath2):
-                os.renames(fpath1, fpath2)
-            elif realpath(fpath1) == realpath(fpath2):
-                os.remove(fpath1)
-        elif isdir(fpath1):
-            share_files(fpath1, fpath2, interpreter, options)
-        elif cmpfile(fpath1, fpath2, shallow=False):
-            os.remove(fpath1)
-        elif i.endswith(('.abi3.so', '.abi4.so')) and interpreter.parse_public_dir(srcdir):
-            log.warning('%s differs from previous one, removing anyway (%s)', i, srcdir)
-            os.remove(fpath1)
-        elif srcdir.endswith(".dist-info"):
-            # dist-info file that differs... try merging
-            if i == "WHEEL":
-                if merge_WHEEL(fpath1, fpath2):
-                    cleanup_actions.append((fix_merged_RECORD, ()))
-                os.remove(fpath1)
-            elif i == "RECORD":
-                merge_RECORD(fpath1, fpath2)
-                os.remove(fpath1)
+    relocation = Relocation(interpreter, options)
+    relocation.add(srcdir, dstdir)
+    relocation.execute()
+
+
+class Relocation:
+    """Plan of moving files from old locations to the new ones.
+
+    :meth:`add` only reads the file system: it records extensions to rename,
+    files to move, merge and remove (and files already moved by previous
+    calls are taken into account). :meth:`execute` applies all of them in
+    batches and removes empty source directories at the end.
+    """
+
+    def __init__(self, interpreter, options):
+        self.interpreter = interpreter
+        self.options = options
+        self.ext_renames = []  # (path, version)
+        self.moves = []  # (source, destination)
+        self.merges = []  # (merge function, source, destination)
+        self.removals = []
+        self.record_removals = []  # (.dist-info dir, file name)
+        self.srcdirs = []
+        self._planned = {}  # destination: source, as it's now
+        self._seen = set()
+
+    def add(self, srcdir, dstdir):
+        """Plan moving as many files from srcdir to dstdir as possible."""
+        if (srcdir, dstdir) in self._seen:
+            return
+        self._seen.add((srcdir, dstdir))
+        self.srcdirs.append(srcdir)
+        for i in sorted(os.listdir(srcdir)):
+            fpath1 = join(srcdir, i)
+            if fpath1 in self._seen:  # removed or renamed with an extension
+                continue
+            self._seen.add(fpath1)
+            if i.endswith('.pyc'):  # f.e. when tests were invoked on installed files
+                self.removals.append(fpath1)
+                continue
+            # file's current path, fpath1 is its path after renaming
+            origin = fpath1
+            if not self.options.no_ext_rename and splitext(i)[-1] == '.so':
+                # try to rename extension here as well (in :meth:`scan` info about
+                # Python version is gone)
+                version = self.interpreter.parse_public_dir(srcdir)
+                if version and version is not True:
+                    origin, fpath1 = self._rename_ext(fpath1, version)
+                    i = split(fpath1)[-1]
+            if srcdir.endswith(".dist-info") and (
+                    i == 'LICENSE' or i.startswith('LICENSE.')):
+                self.removals.append(fpath1)
+                self.record_removals.append((dstdir, i))
+                continue
+            fpath2 = join(dstdir, i)
+            planned = self._planned.get(fpath2)
+            dst_exists = planned is not None or exists(fpath2)
+            if not isdir(origin) and not dst_exists:
+                # do not rename directories here - all .so files have to be renamed first
+                self._move(origin, fpath1, fpath2)
+                continue
+            if islink(origin):
+                # move symlinks without changing them if they point to the same place
+                if not dst_exists:
+                    self._move(origin, fpath1, fpath2)
+                elif realpath(origin) == self._realpath(fpath2):
+                    self.removals.append(fpath1)
+            elif isdir(origin):
+                self.add(fpath1, fpath2)
+            elif cmpfile(origin, planned or fpath2, shallow=False):
+                self.removals.append(fpath1)
+            elif i.endswith(('.abi3.so', '.abi4.so')) and self.interpreter.parse_public_dir(srcdir):
+                log.warning('%s differs from previous one, removing anyway (%s)', i, srcdir)
+                self.removals.append(fpath1)
+            elif srcdir.endswith(".dist-info"):
+                # dist-info file that differs... try merging
+                if i == "WHEEL":
+                    self.merges.append((merge_WHEEL, fpath1, fpath2))
+                    self.removals.append(fpath1)
+                elif i == "RECORD":
+                    self.merges.append((merge_RECORD, fpath1, fpath2))
+                    self.removals.append(fpath1)
+                else:
+                    log.warn("No merge driver for dist-info file %s", i)
             else:
-                log.warn("No merge driver for dist-info file %s", i)
+                # The files differed so we cannot collapse them.
+                log.warn('Paths differ: %s and %s', fpath1, fpath2)
+                if self.options.verbose and not i.endswith('.so'):
+                    with open(origin) as fp1:
+                        fromlines = fp1.readlines()
+                    with open(planned or fpath2) as fp2:
+                        tolines = fp2.readlines()
+                    diff = difflib.unified_diff(fromlines, tolines, fpath1, fpath2)
+                    sys.stderr.writelines(diff)
+
+    def _rename_ext(self, fpath, version):
+        """Plan :meth:`Scan.rename_ext`, return current and new path."""
+        origin = fpath
+        path, fname = fpath.rsplit('/', 1)
+        if islink(fpath):
+            # symlink will be replaced with .so.$FOO file it points to
+            target = fpath
+            links = set()
+            while islink(target):
+                links.add(target)
+                target = join(path, os.readlink(target))
+            if exists(target) and '.so.' in split(target)[-1]:
+                self._seen.update(links)
+                self._seen.add(target)
+                origin = target
+        new_fpath = fpath
+        if not MULTIARCH_DIR_TPL.match(fpath):
+            new_fn = self.interpreter.check_extname(fname, version)
+            if new_fn:
+                new_fpath = join(path, new_fn)
+        if origin != fpath or new_fpath != fpath:
+            self.ext_renames.append((fpath, version))
+        if new_fpath != fpath and lexists(new_fpath):
+            # rename_ext will not overwrite it
+            self._seen.add(new_fpath)
+            origin = new_fpath
+        return origin, new_fpath
+
+    def _move(self, origin, fpath1, fpath2):
+        self.moves.append((fpath1, fpath2))
+        self._planned[fpath2] = origin
+
+    def _realpath(self, fpath):
+        """Return realpath of a file that can be moved here by this plan"""
+        origin = self._planned.get(fpath)
+        if origin is not None and islink(origin):
+            return realpath(join(split(fpath)[0], os.readlink(origin)))
+        return realpath(fpath)
+
+    def report(self):
+        """Return planned operations (in execution order) as text lines"""
+        for fpath, _ in self.ext_renames:
+            yield 'rename extension {}'.format(fpath)
+        for fpath1, fpath2 in sorted(self.moves, key=lambda i: i[1]):
+            yield 'move {} to {}'.format(fpath1, fpath2)
+        for _, fpath1, fpath2 in self.merges:
+            yield 'merge {} into {}'.format(fpath1, fpath2)
+        for fpath in sorted(self.removals):
+            yield 'remove {}'.format(fpath)
+
+    def execute(self, jobs=1):
+        """Rename extensions, move files, merge metadata and remove the rest"""
+        for fpath, version in self.ext_renames:
+            Scan.rename_ext(fpath, self.interpreter, version)
+
+        # operations in each directory are independent of other directories
+        moves = {}
+        for fpath1, fpath2 in self.moves:
+            moves.setdefault(split(fpath2)[0], []).append((fpath1, fpath2))
+        for dpath in sorted(moves):
+            os.makedirs(dpath, exist_ok=True)
+        self._map(self._move_files, sorted(moves.items()), jobs)
+
+        fix_record = set()
+        for merge, fpath1, fpath2 in self.merges:
+            if merge(fpath1, fpath2) and merge is merge_WHEEL:
+                fix_record.add(split(fpath2)[0])
+
+        removals = {}
+        for fpath in self.removals:
+            removals.setdefault(split(fpath)[0], []).append(fpath)
+        self._map(self._remove_files, sorted(removals.items()), jobs)
+
+        for distdir, fname in self.record_removals:
+            remove_from_RECORD(distdir, (fname,))
+        for distdir in sorted(fix_record):
+            fix_merged_RECORD(distdir)
+
+        # the deepest directories first
+        for dpath in sorted(set(self.srcdirs), key=lambda i: i.count('/'), reverse=True):
+            try:
+                os.removedirs(dpath)
+            except OSError:
+                pass
+
+    @staticmethod
+    def _map(func, items, jobs):
+        if jobs > 1 and len(items) > 1:
+            with ThreadPoolExecutor(max_workers=jobs) as executor:
+                list(executor.map(func, items))
         else:
-            # The files differed so we cannot collapse them.
-            log.warn('Paths differ: %s and %s', fpath1, fpath2)
-            if options.verbose and not i.endswith('.so'):
-                with open(fpath1) as fp1:
-                    fromlines = fp1.readlines()
-                with open(fpath2) as fp2:
-                    tolines = fp2.readlines()
-                diff = difflib.unified_diff(fromlines, tolines, fpath1, fpath2)
-                sys.stderr.writelines(diff)
-
-    for action, args in cleanup_actions:
-        action(dstdir, *args)
-    try:
-        os.removedirs(srcdir)
-    except OSError:
-        pass
+            for item in items:
+                func(item)
+
+    @staticmethod
+    def _move_files(item):
+        for fpath1, fpath2 in sorted(item[1]):
+            if lexists(fpath1):  # can be removed while renaming extensions
+                os.rename(fpath1, fpath2)
+
+    @staticmethod
+    def _remove_files(item):
+        for fpath in sorted(item[1]):
+            if lexists(fpath):
+                os.remove(fpath)
 
 
 ## Functions to merge parts of the .dist-info metadata directory together
@@ -294,7 +430,7 @@ class Scan:
                     for name in dirs:
                         if name in ('test', 'tests') or name.startswith('.'):
                             log.debug('removing dist-packages/%s', name)
-                            rmtree(join(root, name))
+                            trash(join(root, name), 'debian')
                             dirs.remove(name)
             else:
                 self.current_private_dir = self.check_private_dir(root)
@@ -309,7 +445,7 @@ class Scan:
             for name in dirs:
                 dpath = join(root, name)
                 if self.is_unwanted_dir(dpath):
-                    rmtree(dpath)
+                    trash(dpath, 'debian')
                     dirs.remove(name)
                     continue
 
@@ -549,14 +549,15 @@ class Interpreter:
     def _execute(self, command, version=None, cache=True):
         version = Version(version or self.version)
         exe = "{}{}".format(self.path, self._vstr(version))
-        command = "{} -c '{}'".format(exe, command.replace("'", "\'"))
-        if cache and command in self.__class__._cache:
-            return self.__class__._cache[command]
+        command = [exe, '-c', command]
+        cache_key = tuple(command)
+        if cache and cache_key in self.__class__._cache:
+            return self.__class__._cache[cache_key]
         if not exists(exe):
             raise Exception("cannot execute command due to missing "
                             "interpreter: %s" % exe)
 
-        output = execute(command)
+        output = execute(command, shell=False)
         if output['returncode'] != 0:
             log.debug(output['stderr'])
             raise Exception('{} failed with status code {}'.format(command, output['returncode']))
@@ -567,7 +568,7 @@ class Interpreter:
             result = result[0]
 
         if cache:
-            self.__class__._cache[command] = result
+            self.__class__._cache[cache_key] = result
 
         return result
 
@@ -0,0 +1,179 @@
+# Copyright © 2022 Piotr Ożarowski <piotr@debian.org>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""GNU make jobserver client.
+
+If pybuild is invoked by make with a jobserver (i.e. `make -jN` and
+MAKEFLAGS contains --jobserver-auth), concurrent jobs started by
+:func:`dhpython.build.engine.gather` take a token from it first (pybuild's
+own, implicit slot aside) and jobserver's file descriptors are passed
+to all commands, so that make, cmake, etc. share the same CPU budget.
+"""
+
+import asyncio
+import logging
+import os
+import re
+from stat import S_ISFIFO
+
+log = logging.getLogger('dhpython')
+AUTH_RE = re.compile(r'--jobserver-(?:auth|fds)=(\S+)')
+_client = False  # not initialized yet
+
+
+def parse(makeflags):
+    """Return jobserver's pipe file descriptors or FIFO path.
+
+    >>> parse('-j --jobserver-auth=3,4')
+    (3, 4)
+    >>> parse(' -j8 --jobserver-auth=fifo:/tmp/GMfifo1234')
+    '/tmp/GMfifo1234'
+    >>> parse('-k') is None
+    True
+    """
+    match = AUTH_RE.findall(makeflags or '')
+    if not match:
+        return None
+    auth = match[-1]  # last one wins, just like in make
+    if auth.startswith('fifo:'):
+        return auth[5:]
+    try:
+        read_fd, write_fd = (int(i) for i in auth.split(','))
+    except ValueError:
+        return None
+    if read_fd < 0 or write_fd < 0:
+        return None  # jobserver disabled for this process
+    return read_fd, write_fd
+
+
+def replace_fds(makeflags, read_fd, write_fd):
+    """Update file descriptors in MAKEFLAGS.
+
+    >>> replace_fds('-j --jobserver-auth=3,4', 7, 8)
+    '-j --jobserver-auth=7,8'
+    """
+    return AUTH_RE.sub('--jobserver-auth={},{}'.format(read_fd, write_fd), makeflags)
+
+
+def pipe_fds(env=os.environ):
+    """Return jobserver file descriptors if they are usable in this process."""
+    auth = parse(env.get('MAKEFLAGS'))
+    if not isinstance(auth, tuple):
+        return None
+    try:
+        # make closes them if the command wasn't marked as recursive (+)
+        if not all(S_ISFIFO(os.fstat(fd).st_mode) for fd in auth):
+            return None
+    except OSError:
+        return None
+    return auth
+
+
+class Client:
+
+    def __init__(self, read_fd, write_fd, pass_fds=()):
+        self.read_fd = read_fd
+        self.write_fd = write_fd
+        self.pass_fds = tuple(pass_fds)
+        self.implicit = True  # one job can always run without a token
+        self.lock = None
+        self.loop = None  # event loop self.lock is used in
+        self.waiter = None
+
+    async def acquire(self):
+        """Return a token (None means: the implicit slot)."""
+        if self.implicit:
+            self.implicit = False
+            return None
+        loop = asyncio.get_running_loop()
+        if self.loop is not loop:
+            # asyncio.Lock cannot be shared between event loops
+            # (each engine.run_jobs call starts a new one)
+            self.lock = asyncio.Lock()
+            self.loop = loop
+        async with self.lock:  # only one job waits for a token
+            if self.implicit:
+                self.implicit = False
+                return None
+            if os.get_blocking(self.read_fd):
+                return await self._read_in_thread(loop)
+            while True:
+                if self.implicit:
+                    self.implicit = False
+                    return None
+                try:
+                    return os.read(self.read_fd, 1)
+                except BlockingIOError:
+                    pass  # another process took it first
+                # wait for a token in the pipe or for the implicit slot
+                self.waiter = loop.create_future()
+                loop.add_reader(self.read_fd, self._wake)
+                try:
+                    await self.waiter
+                finally:
+                    loop.remove_reader(self.read_fd)
+                    self.waiter = None
+
+    async def _read_in_thread(self, loop):
+        future = loop.run_in_executor(None, os.read, self.read_fd, 1)
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            # token will be read anyway, give it back
+            future.add_done_callback(
+                lambda f: f.cancelled() or f.exception() or self.release(f.result()))
+            raise
+
+    def _wake(self):
+        if self.waiter is not None and not self.waiter.done():
+            self.waiter.set_result(None)
+
+    def release(self, token):
+        if token is None:
+            self.implicit = True
+            self._wake()
+        else:
+            os.write(self.write_fd, token)
+
+
+def client(env=os.environ):
+    """Return jobserver client (or None if there's no jobserver)."""
+    global _client
+    if _client is False:
+        _client = None
+        auth = parse(env.get('MAKEFLAGS'))
+        if isinstance(auth, str):
+            try:
+                fd = os.open(auth, os.O_RDWR)
+            except OSError as err:
+                log.debug('cannot open jobserver FIFO: %s', err)
+            else:
+                os.set_blocking(fd, False)  # it's our own open file description
+                _client = Client(fd, fd)
+        elif auth:
+            fds = pipe_fds(env)
+            if fds:
+                _client = Client(*fds, pass_fds=fds)
+            else:
+                log.debug('jobserver file descriptors not available'
+                          ' (missing "+" in make rule?)')
+        if _client:
+            log.debug('using make jobserver')
+    return _client
@@ -19,20 +19,33 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 # THE SOFTWARE.
 
+import atexit
+import hashlib
 import logging
 import os
 import re
 import locale
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime
+from fcntl import flock, LOCK_EX, LOCK_NB
 from glob import glob
 from pickle import dumps
-from shutil import rmtree
+from stat import S_ISREG
+from shutil import copy2, rmtree
 from os.path import exists, getsize, isdir, islink, join, split
 from subprocess import Popen, PIPE
+from tempfile import mkdtemp, mkstemp
 
 log = logging.getLogger('dhpython')
 EGGnPTH_RE = re.compile(r'(.*?)(-py\d\.\d(?:-[^.]*)?)?(\.egg-info|\.pth)$')
 SHAREDLIB_RE = re.compile(r'NEEDED.*libpython(\d\.\d)')
+PARALLEL_RE = re.compile(r'(?:^|\s)parallel=(\d+)')
+# directories that are never entered while scanning source trees
+SCAN_SKIP_DIRS = {'.git', '.hg', '.svn', '.bzr', '_darcs', 'CVS', '.pybuild'}
+# background removal of directory trees, see trash()
+_trash_executor = None
+_trash_jobs = []
 
 
 def relpath(target, link):
@@ -91,6 +104,293 @@ def move_matching_files(src, dst, pattern, sub=None, repl=''):
                 os.renames(spath, dpath)
 
 
+def scantree(path, skip=SCAN_SKIP_DIRS, prune=()):
+    """Yield os.DirEntry objects for files and directories under path.
+
+    Symlinks are not followed. Directories with names listed in `skip` are
+    neither yielded nor entered, the ones listed in `prune` are yielded but
+    not entered.
+    """
+    stack = [path]
+    while stack:
+        try:
+            with os.scandir(stack.pop()) as it:
+                entries = list(it)
+        except OSError:
+            continue
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                if entry.name in skip:
+                    continue
+                if entry.name not in prune:
+                    stack.append(entry.path)
+            yield entry
+
+
+def _remove_entry(path, is_dir):
+    """Remove file or directory, return number of freed bytes."""
+    size = 0
+    try:
+        if is_dir:
+            for entry in scantree(path, skip=()):
+                if entry.is_file(follow_symlinks=False):
+                    size += entry.stat(follow_symlinks=False).st_size
+            rmtree(path)
+        else:
+            size = os.lstat(path).st_size
+            os.remove(path)
+    except Exception:
+        log.debug('cannot remove %s', path)
+        return 0
+    return size
+
+
+def trash(path, trash_dir=None):
+    """Remove directory tree in the background.
+
+    The tree is renamed (atomically) to a new directory in `trash_dir`
+    (the parent directory by default, it has to be on the same file system)
+    and removed by a background thread. It's removed right away if renaming
+    is not possible. Use :func:`empty_trash` to wait for removals (done at
+    exit as well).
+    """
+    global _trash_executor
+    if islink(path) or not isdir(path):
+        os.remove(path)
+        return
+    try:
+        tmp_dpath = mkdtemp(prefix='.pybuild-trash-',
+                            dir=trash_dir or os.path.dirname(os.path.abspath(path)))
+    except OSError:
+        rmtree(path)
+        return
+    try:
+        os.rename(path, join(tmp_dpath, 'tree'))
+    except OSError:  # different file system
+        os.rmdir(tmp_dpath)
+        rmtree(path)
+        return
+    log.debug('removing %s in the background', path)
+    if _trash_executor is None:
+        _trash_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='trash')
+        atexit.register(empty_trash)
+    _trash_jobs.append(_trash_executor.submit(rmtree, tmp_dpath, True))
+
+
+def empty_trash():
+    """Wait until all trees passed to :func:`trash` are removed."""
+    while _trash_jobs:
+        _trash_jobs.pop(0).result()
+
+
+def clean_bytecode(path, jobs=None):
+    """Remove __pycache__ directories and .pyc/.pyo files from path.
+
+    VCS and .pybuild directories are not entered, files are removed in
+    parallel.
+
+    :param jobs: number of threads used to remove files
+    :returns: number of freed bytes
+    """
+    to_remove = []
+    for entry in scantree(path, prune={'__pycache__'}):
+        if entry.name == '__pycache__':
+            if entry.is_dir(follow_symlinks=False):
+                to_remove.append((entry.path, True))
+        elif entry.name.endswith(('.pyc', '.pyo')):
+            to_remove.append((entry.path, False))
+    if not to_remove:
+        return 0
+    for fpath, _ in to_remove:
+        log.debug('removing: %s', fpath)
+    jobs = jobs or min(8, os.cpu_count() or 1)
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        return sum(executor.map(lambda i: _remove_entry(*i), to_remove))
+
+
+def tree_fingerprint(path, skip=SCAN_SKIP_DIRS, ignore=None, content=False):
+    """Return a hex digest describing all files under given path.
+
+    Relative file names, sizes and modification times are used by default,
+    files' content is hashed instead of their mtime if `content` is True.
+
+    :param skip: names of directories that should not be entered
+    :param ignore: compiled regular expression, matching paths (relative to
+        `path`) are not included in the result
+    """
+    entries = []
+    for entry in scantree(path, skip):
+        if entry.is_dir(follow_symlinks=False):
+            continue
+        rpath = os.path.relpath(entry.path, path)
+        if ignore and ignore.search(rpath):
+            continue
+        entries.append((rpath, entry))
+
+    result = hashlib.sha256()
+    for rpath, entry in sorted(entries, key=lambda i: i[0]):
+        if entry.is_symlink():
+            data = 'link:' + os.readlink(entry.path)
+        elif content:
+            data = file_digest(entry.path)
+        else:
+            stat = entry.stat(follow_symlinks=False)
+            data = '{} {}'.format(stat.st_size, stat.st_mtime_ns)
+        result.update('{}\0{}\n'.format(rpath, data).encode('utf-8', 'surrogateescape'))
+    return result.hexdigest()
+
+
+@contextmanager
+def locked(fpath, blocking=True):
+    """Hold an exclusive advisory lock on given file.
+
+    Yields False if `blocking` is False and the lock is held by another
+    process (True otherwise).
+    """
+    dpath = os.path.dirname(fpath)
+    if dpath:
+        os.makedirs(dpath, exist_ok=True)
+    fd = os.open(fpath, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        try:
+            flock(fd, LOCK_EX if blocking else LOCK_EX | LOCK_NB)
+        except BlockingIOError:
+            yield False
+        else:
+            yield True
+    finally:
+        os.close(fd)  # releases the lock
+
+
+def write_atomic(fpath, content):
+    """Replace file's content without exposing partially written file.
+
+    Temporary file has a unique name, so concurrent writers don't clash
+    (the last one wins).
+    """
+    dpath, fname = split(fpath)
+    fd, tmp_fpath = mkstemp(prefix=fname + '.', suffix='.new', dir=dpath or '.')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as fp:
+            fp.write(content)
+        os.chmod(tmp_fpath, 0o644)
+        os.replace(tmp_fpath, fpath)
+    except BaseException:
+        os.remove(tmp_fpath)
+        raise
+
+
+def file_digest(fpath):
+    """Return sha256 hex digest of file's content."""
+    result = hashlib.sha256()
+    with open(fpath, 'rb') as fp:
+        for chunk in iter(lambda: fp.read(65536), b''):
+            result.update(chunk)
+    return result.hexdigest()
+
+
+def _same_file(src_stat, src, dst, checksum):
+    try:
+        dst_stat = os.lstat(dst)
+    except FileNotFoundError:
+        return False
+    if not S_ISREG(dst_stat.st_mode) or dst_stat.st_size != src_stat.st_size:
+        return False
+    if checksum:
+        return file_digest(src) == file_digest(dst)
+    return dst_stat.st_mtime_ns == src_stat.st_mtime_ns
+
+
+def _clear(path):
+    if isdir(path) and not islink(path):
+        rmtree(path)
+    elif os.path.lexists(path):
+        os.remove(path)  # do not write to hard linked files
+
+
+def sync_file(src, dst, checksum=False):
+    """Copy file (with its mtime) unless dst is the same already.
+
+    :returns: True if file was copied
+    """
+    if _same_file(os.lstat(src), src, dst, checksum):
+        return False
+    _clear(dst)
+    copy2(src, dst)
+    return True
+
+
+def sync_tree(src, dst, ignore=None, checksum=False, delete=False, manifest=None):
+    """Copy files from src to dst directory, skipping unchanged ones.
+
+    Files are compared by size and modification time (or content, if
+    `checksum` is True). Copies keep source's mtime, so unchanged files
+    are skipped in the next sync (and keep their mtime and cached pages).
+
+    :param ignore: compiled regular expression, matching paths (relative to
+        `src`) are not copied
+    :param delete: remove everything else from dst
+    :param manifest: file with list of files synced previously, the ones
+        that are no longer in src are removed from dst (other files are left
+        alone, i.e. dst can be shared with other sources)
+    :returns: numbers of copied, unchanged and removed files
+    """
+    copied = unchanged = 0
+    synced = set()
+    os.makedirs(dst, exist_ok=True)
+    stack = ['']
+    while stack:
+        rdir = stack.pop()
+        with os.scandir(join(src, rdir)) as it:
+            entries = list(it)
+        for entry in entries:
+            rpath = join(rdir, entry.name)
+            if ignore and ignore.search(rpath):
+                continue
+            dpath = join(dst, rpath)
+            synced.add(rpath)
+            if entry.is_dir(follow_symlinks=False):
+                if not isdir(dpath) or islink(dpath):
+                    _clear(dpath)
+                    os.mkdir(dpath)
+                stack.append(rpath)
+            elif entry.is_symlink():
+                target = os.readlink(entry.path)
+                if islink(dpath) and os.readlink(dpath) == target:
+                    unchanged += 1
+                    continue
+                _clear(dpath)
+                os.symlink(target, dpath)
+                copied += 1
+            elif sync_file(entry.path, dpath, checksum):
+                copied += 1
+            else:
+                unchanged += 1
+
+    stale = set()
+    if manifest and exists(manifest):
+        with open(manifest, encoding='utf-8', errors='surrogateescape') as fp:
+            stale.update(line.rstrip('\n') for line in fp)
+    if delete:
+        stale.update(os.path.relpath(entry.path, dst)
+                     for entry in scantree(dst, skip=()))
+    removed = 0
+    # the deepest paths first, directories are removed once empty
+    for rpath in sorted(stale - synced, key=lambda i: i.count('/'), reverse=True):
+        dpath = join(dst, rpath)
+        if isdir(dpath) and not islink(dpath):
+            try:
+                os.rmdir(dpath)
+            except OSError:
+                pass  # not empty (other sources' files)
+        elif os.path.lexists(dpath):
+            os.remove(dpath)
+            removed += 1
+    if manifest:
+        write_atomic(manifest, ''.join(i + '\n' for i in sorted(synced)))
+    return copied, unchanged, removed
+
+
 def fix_shebang(fpath, replacement=None):
     """Normalize file's shebang.
 
@@ -133,10 +433,10 @@ def so2pyver(fpath):
     :returns: Python version
     """
 
-    cmd = "readelf -Wd '%s'" % fpath
-    process = Popen(cmd, stdout=PIPE, shell=True)
+    with Popen(['readelf', '-Wd', fpath], stdout=PIPE) as process:
+        output = process.stdout.read()
     encoding = locale.getdefaultlocale()[1] or 'utf-8'
-    match = SHAREDLIB_RE.search(str(process.stdout.read(), encoding=encoding))
+    match = SHAREDLIB_RE.search(str(output, encoding=encoding))
     if match:
         return Version(match.groups()[0])
 
@@ -204,6 +504,24 @@ def remove_ns(interpreter, package, namespaces, versions):
     return result
 
 
+def parallel_jobs(env=None):
+    """Return number of jobs requested via DEB_BUILD_OPTIONS' parallel=N.
+
+    The result is limited by the number of CPUs available to this process,
+    1 is returned if parallel builds were not requested.
+    """
+    if env is None:
+        env = os.environ
+    match = PARALLEL_RE.search(env.get('DEB_BUILD_OPTIONS', ''))
+    if not match:
+        return 1
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    return max(1, min(int(match.group(1)), cpus))
+
+
 def execute(command, cwd=None, env=None, log_output=None, shell=True):
     """Execute external shell commad.
 
@@ -213,6 +531,8 @@ def execute(command, cwd=None, env=None, log_output=None, shell=True):
         * opened log file or path to this file, or
         * None if output should be included in the returned dict, or
         * False if output should be redirectored to stdout/stderr
+
+    Use :func:`dhpython.build.engine.execute` to stream long output.
     """
     args = {'shell': shell, 'cwd': cwd, 'env': env}
     close = False
@@ -234,8 +554,8 @@ def execute(command, cwd=None, env=None, log_output=None, shell=True):
         stdout, stderr = process.communicate()
         close and log_output.close()
         return dict(returncode=process.returncode,
-                    stdout=stdout and str(stdout, 'utf-8'),
-                    stderr=stderr and str(stderr, 'utf-8'))
+                    stdout=stdout and str(stdout, 'utf-8', 'replace'),
+                    stderr=stderr and str(stderr, 'utf-8', 'replace'))
 
 
 class memoize:
@@ -0,0 +1,176 @@
+from os import chdir, environ, getcwd, makedirs
+from os.path import exists, join
+from tempfile import TemporaryDirectory
+from types import SimpleNamespace
+from unittest.mock import patch
+import sys
+import unittest
+
+from dhpython.build import timings
+from dhpython.build.base import (Base, Formatted, argv_command, shell_command,
+                                 unittest_shards)
+from dhpython.interpreter import Interpreter
+from dhpython.version import Version
+
+
+class Plugin(Base):
+    NAME = 'test'
+
+    @shell_command
+    def build(self, context, args):
+        return ['{interpreter}', 'setup.py', 'build', '--root', '{destdir}', '{args}']
+
+
+class TestArgvCommand(unittest.TestCase):
+    argv = ['{interpreter}', '-m', 'pytest', '{args}']
+
+    def args(self, user_args, **kwargs):
+        return dict({'interpreter': 'python3.11', 'dir': '/src/foo bar',
+                     'destdir': '/tmp/{x}', 'args': user_args}, **kwargs)
+
+    def test_split(self):
+        self.assertEqual(argv_command(self.argv, self.args("-k 'foo or bar' -x")),
+                         ['{interpreter}', '-m', 'pytest', '-k', 'foo or bar', '-x'])
+        self.assertEqual(argv_command(self.argv, self.args('')),
+                         ['{interpreter}', '-m', 'pytest'])
+
+    def test_without_args(self):
+        argv = ['{interpreter}', 'setup.py', 'clean']
+        self.assertIs(argv_command(argv, self.args('-x')), argv)
+
+    def test_shell_fallback(self):
+        command = argv_command(self.argv + ['{destdir}'], self.args('-k "$FOO" {dir}/tests'))
+        self.assertIsInstance(command, Formatted)
+        self.assertEqual(command, "python3.11 -m pytest -k \"$FOO\" /src/foo bar/tests '/tmp/{x}'")
+
+    def test_dir_in_args(self):
+        # expanded once, when command is invoked
+        self.assertEqual(argv_command(self.argv, self.args('{dir}/tests')),
+                         ['{interpreter}', '-m', 'pytest', '{dir}/tests'])
+
+
+class TestShellCommand(unittest.TestCase):
+    def plan(self, user_args):
+        plugin = Plugin(SimpleNamespace(quiet=False, really_quiet=False))
+        context = {'ENV': {}, 'plan': []}
+        args = {'interpreter': 'python3.11', 'dir': '/src', 'destdir': '/tmp/{x} y',
+                'home_dir': '/src/.pybuild', 'args': user_args}
+        plugin.build(context, args)
+        return context['plan']
+
+    def test_argv(self):
+        self.assertEqual(self.plan('--foo {dir}'), [
+            "python3.11 setup.py build --root '/tmp/{x} y' --foo /src"])
+
+    def test_formatted_once(self):
+        self.assertEqual(self.plan('--foo {dir} > /dev/null'), [
+            "python3.11 setup.py build --root '/tmp/{x} y' --foo /src > /dev/null"])
+
+
+class TestClean(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.addCleanup(chdir, getcwd())
+        chdir(self.tmpdir.name)  # .pybuild/clean_*.lock
+        self.plugin = Plugin(SimpleNamespace(test_tox=True))
+        self.context = {'ENV': {}, 'dir': self.tmpdir.name}
+        self.args = {'dir': self.tmpdir.name}
+
+    def test_tox_removed_for_each_version(self):
+        tox_dir = join(self.tmpdir.name, '.tox')
+        coverage = join(self.tmpdir.name, '.coverage')
+        for version in ('3.11', '3.12'):
+            makedirs(join(tox_dir, 'py' + version))
+            open(coverage, 'w').close()
+            self.plugin.clean(self.context, self.args)
+            self.assertFalse(exists(tox_dir))
+        # version independent files are removed only once
+        self.assertTrue(exists(coverage))
+
+
+TEST_MODULE = '''import unittest
+
+
+class Test(unittest.TestCase):
+{}
+'''
+
+
+class TestTestShards(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.build_dir = join(self.tmpdir.name, 'build')
+        makedirs(self.build_dir)
+        cfg = SimpleNamespace(quiet=True, really_quiet=False, test_jobs=2,
+                              timings_dir=self.tmpdir.name)
+        self.plugin = Plugin(cfg)
+        self.context = {'ENV': dict(environ), 'dir': self.tmpdir.name}
+        self.args = {'interpreter': sys.executable, 'dir': self.tmpdir.name,
+                     'build_dir': self.build_dir,
+                     'home_dir': join(self.tmpdir.name, 'home'), 'ENV': {}}
+
+    def write(self, name, *tests):
+        with open(join(self.build_dir, name + '.py'), 'w') as fp:
+            fp.write(TEST_MODULE.format('\n'.join(
+                '    def test_{}(self):\n        {}\n'.format(i, body)
+                for i, body in enumerate(tests)) or '    pass'))
+
+    def run_shards(self):
+        shards = unittest_shards(self.build_dir, 2)
+        self.assertEqual(len(shards), 2)
+        return self.plugin.test_shards(self.context, self.args, shards)
+
+    def test_merged_results(self):
+        self.write('test_a', 'pass', 'pass')
+        self.write('test_b', 'pass')
+        with self.assertLogs('dhpython', 'INFO') as logs:
+            self.assertTrue(self.run_shards())
+        self.assertIn('ran 3 tests in 2 shards (OK)', '\n'.join(logs.output))
+        # durations recorded for the next run
+        db = timings.Timings(self.tmpdir.name, timings.package_name(self.tmpdir.name))
+        self.assertEqual(sorted(db.data['unittest/' + sys.executable]),
+                         ['test_a', 'test_b'])
+
+    def test_failed_shard(self):
+        self.write('test_a', 'pass', 'pass')
+        self.write('test_b', 'self.fail("foo")')
+        with self.assertRaisesRegex(Exception, r'tests failed: shard\d \(exit code=1\)'
+                                    r'[\s\S]*AssertionError: foo[\s\S]*test_shard\*_cmd.log'):
+            self.run_shards()
+
+    def test_no_tests(self):
+        self.write('test_a')
+        self.write('test_b')
+        with self.assertRaisesRegex(Exception, 'no tests ran'):
+            self.run_shards()
+
+
+@patch('dhpython.build.base.has_module', return_value=True)
+class TestPytestJobs(unittest.TestCase):
+    def command(self, jobs, user_args=''):
+        cfg = SimpleNamespace(test_jobs=jobs, test_pytest=True, test_nose=False,
+                              test_nose2=False, test_tox=False)
+        context = {'ENV': {}, 'plan': []}  # do not copy test files
+        args = {'interpreter': Interpreter('python3.11'), 'version': Version('3.11'),
+                'dir': '/src', 'build_dir': '/src/build', 'home_dir': '/src/.pybuild',
+                'args': user_args}
+        return Plugin(cfg).test(context, args)
+
+    def test_xdist(self, has_module):
+        self.assertEqual(self.command(3),
+                         'cd {build_dir}; {interpreter} -m pytest -n 3 {args}')
+        has_module.assert_called_once_with('python3.11', 'xdist', {})
+
+    def test_single_job(self, has_module):
+        self.assertEqual(self.command(1), 'cd {build_dir}; {interpreter} -m pytest {args}')
+
+    def test_user_args(self, has_module):
+        for user_args in ('-n 2', '-x --numprocesses=4', '-p no:xdist'):
+            self.assertEqual(self.command(3, user_args),
+                             'cd {build_dir}; {interpreter} -m pytest {args}')
+
+    def test_xdist_missing(self, has_module):
+        has_module.return_value = False
+        self.assertEqual(self.command(3), 'cd {build_dir}; {interpreter} -m pytest {args}')
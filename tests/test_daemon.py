@@ -0,0 +1,30 @@
+from tempfile import TemporaryDirectory
+import os
+import stat
+import time
+import unittest
+
+from dhpython import daemon
+
+
+class TestDaemon(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.path = os.path.join(self.tmpdir.name, 'pybuild.sock')
+
+    def test_private_socket(self):
+        umask = os.umask(0o002)
+        try:
+            daemon.serve(lambda: None, timeout=2, path=self.path)
+        finally:
+            os.umask(umask)
+        self.assertEqual(stat.S_IMODE(os.stat(self.path).st_mode), 0o600)
+        self.assertEqual(daemon.forward(['pybuild'], self.path), 0)
+        # daemon exits (and removes the socket) after idle timeout
+        for _ in range(100):
+            if not os.path.exists(self.path):
+                break
+            time.sleep(0.1)
+        else:
+            self.fail('daemon did not exit after idle timeout')
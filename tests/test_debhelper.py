@@ -1,8 +1,9 @@
 from tempfile import TemporaryDirectory
+from unittest.mock import patch
 import unittest
 import os
 
-from dhpython.debhelper import DebHelper, build_options
+from dhpython.debhelper import DebHelper, build_options, dpkg_architecture
 
 
 class DebHelperTestCase(unittest.TestCase):
@@ -164,3 +165,33 @@ class TestControlMissingPackage(DebHelperTestCase):
                'field')
         with self.assertRaisesRegex(Exception, msg):
             DebHelper(self.build_options())
+
+
+class TestDpkgArchitecture(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = TemporaryDirectory()
+        self.addCleanup(self.tempdir.cleanup)
+
+    @patch.dict(os.environ, {'DEB_HOST_ARCH': 'armhf',
+                             'DEB_HOST_ARCH_OS': 'linux',
+                             'DEB_HOST_MULTIARCH': 'arm-linux-gnueabihf',
+                             'DEB_BUILD_ARCH': 'amd64',
+                             'DEB_BUILD_OPTIONS': 'nocheck'})
+    @patch('dhpython.debhelper.execute')
+    def test_exported_variables(self, execute):
+        result = dpkg_architecture(self.tempdir.name)
+        self.assertFalse(execute.called)
+        self.assertEqual(result['DEB_HOST_ARCH'], 'armhf')
+        self.assertNotIn('DEB_BUILD_OPTIONS', result)
+
+    @unittest.skipUnless(os.path.exists('/usr/bin/dpkg-architecture'),
+                         'dpkg-architecture not available')
+    def test_cached_result(self):
+        with patch.dict(os.environ):
+            for key in list(os.environ):
+                if key.startswith(('DEB_HOST_', 'DEB_BUILD_', 'DEB_TARGET_')):
+                    del os.environ[key]
+            result = dpkg_architecture(self.tempdir.name)
+            with patch('dhpython.debhelper.execute') as execute:
+                self.assertEqual(dpkg_architecture(self.tempdir.name), result)
+                self.assertFalse(execute.called)
@@ -0,0 +1,67 @@
+from tempfile import TemporaryDirectory
+from types import SimpleNamespace
+from unittest.mock import patch
+import os
+import unittest
+
+from dhpython import build
+
+
+class TestDetectionCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.addCleanup(os.chdir, os.getcwd())
+        os.chdir(self.tmpdir.name)
+        self.dpath = os.path.join(self.tmpdir.name, 'src')
+        os.mkdir(self.dpath)
+        self.write('setup.py', 'from setuptools import setup\nsetup()\n')
+        self.cfg = SimpleNamespace(dir=self.dpath)
+        self.save(self.dpath)
+
+    def write(self, fname, content=''):
+        with open(os.path.join(self.dpath, fname), 'w') as fp:
+            fp.write(content)
+
+    def save(self, dpath):
+        plugin = build.plugins['distutils'](self.cfg)
+        context = {'ENV': {}, 'args': {}, 'dir': dpath}
+        certainty = plugin.detect(context)
+        build.save_detection(plugin, certainty, context)
+
+    def load(self, dpath=None):
+        return build.load_detection(SimpleNamespace(dir=dpath or self.dpath), {})
+
+    def test_reused(self):
+        plugin, certainty, context = self.load()
+        self.assertEqual(plugin.NAME, 'distutils')
+        self.assertEqual(context['args'], {'setup_py': 'setup.py'})
+        self.assertEqual(plugin.DETECTED_REQUIRED_FILES,
+                         {'setup.py|setup-3.py': ['setup.py']})
+
+    def test_file_added(self):
+        self.write('pyproject.toml')
+        self.assertIsNone(self.load())
+
+    def test_file_removed(self):
+        os.rename(os.path.join(self.dpath, 'setup.py'),
+                  os.path.join(self.dpath, 'other.py'))
+        self.assertIsNone(self.load())
+
+    def test_mtime_changed(self):
+        os.utime(os.path.join(self.dpath, 'setup.py'), ns=(0, 0))
+        self.assertIsNone(self.load())
+
+    def test_other_dir(self):
+        other = os.path.join(self.tmpdir.name, 'other')
+        os.mkdir(other)
+        self.assertIsNone(self.load(other))
+        # each directory has its own cache (see pybuild --subproject)
+        self.save(other)
+        self.assertIsNotNone(self.load(other))
+        self.assertIsNotNone(self.load())
+
+    def test_plugins_changed(self):
+        with patch.dict(build.plugins):
+            del build.plugins[min(set(build.plugins) - {'distutils'})]
+            self.assertIsNone(self.load())
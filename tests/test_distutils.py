@@ -0,0 +1,75 @@
+from configparser import ConfigParser
+from os import remove
+from os.path import join
+from shutil import which
+from tempfile import TemporaryDirectory
+from unittest.mock import patch
+import sys
+import unittest
+
+from dhpython.build.plugin_distutils import build_ext_parallel, create_pydistutils_cfg
+
+
+@create_pydistutils_cfg
+def step(self, context, args):
+    return args['ENV']['HOME']
+
+
+@patch('dhpython.tools.os.sched_getaffinity', return_value=set(range(8)))
+class TestPydistutilsCfg(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.home_dir = join(self.tmpdir.name, 'home')
+        self.args = {'interpreter': 'python3.11', 'home_dir': self.home_dir,
+                     'build_dir': join(self.tmpdir.name, 'build'),
+                     'install_dir': '/usr/lib/python3.11/dist-packages'}
+
+    def config(self, options, parallel=True):
+        context = {'ENV': {'DEB_BUILD_OPTIONS': options}}
+        with patch('dhpython.build.plugin_distutils.build_ext_parallel',
+                   return_value=parallel) as check:
+            self.assertEqual(step(None, context, self.args), self.home_dir)
+        config = ConfigParser()
+        config.read(join(self.home_dir, '.pydistutils.cfg'))
+        return config, check
+
+    def test_parallel(self, _sched_getaffinity):
+        config, check = self.config('nocheck parallel=4')
+        self.assertEqual(config['build_ext']['parallel'], '4')
+        self.assertEqual(config['build']['build_lib'], self.args['build_dir'])
+        check.assert_called_once_with('python3.11', {'DEB_BUILD_OPTIONS': 'nocheck parallel=4'})
+
+    def test_limited_by_cpus(self, _sched_getaffinity):
+        config, _ = self.config('parallel=32')
+        self.assertEqual(config['build_ext']['parallel'], '8')
+
+    def test_single_job(self, _sched_getaffinity):
+        for options in ('', 'parallel=1'):
+            config, check = self.config(options)
+            self.assertFalse(config.has_section('build_ext'))
+            check.assert_not_called()
+            # the file is created only if it doesn't exist yet
+            remove(join(self.home_dir, '.pydistutils.cfg'))
+
+    def test_not_supported(self, _sched_getaffinity):
+        config, _ = self.config('parallel=4', parallel=False)
+        self.assertFalse(config.has_section('build_ext'))
+        self.assertTrue(config.has_section('install'))
+
+
+try:
+    import setuptools  # noqa: F401
+except ImportError:
+    setuptools = None
+
+
+class TestBuildExtParallel(unittest.TestCase):
+    @unittest.skipIf(setuptools is None and sys.version_info >= (3, 12),
+                     'setuptools not installed')
+    def test_check(self):
+        # supported since Python 3.5
+        self.assertTrue(build_ext_parallel(sys.executable))
+
+    def test_failure(self):
+        self.assertFalse(build_ext_parallel(which('false')))
@@ -0,0 +1,139 @@
+from io import StringIO
+from tempfile import TemporaryDirectory
+from time import monotonic
+from unittest.mock import patch
+import asyncio
+import os
+import sys
+import time
+import unittest
+
+from dhpython import jobserver
+from dhpython.build.engine import execute, run, run_jobs
+
+
+class TestRun(unittest.TestCase):
+    def test_prefixed_output(self):
+        output = StringIO()
+        result = execute('echo foo; sleep 0.2; echo bar >&2; sleep 0.2; printf baz',
+                         log_output=output, prefix='job1')
+        self.assertEqual(result['returncode'], 0)
+        self.assertEqual(result['tail'], 'foo\nbar\nbaz')
+        self.assertIn('job1| foo\njob1| bar\njob1| baz', output.getvalue())
+
+    def test_stderr(self):
+        with patch('sys.stdout', new=StringIO()) as stdout, \
+                patch('sys.stderr', new=StringIO()) as stderr:
+            execute('echo foo; echo bar >&2', log_output=False)
+        self.assertEqual(stdout.getvalue(), 'foo\n')
+        self.assertEqual(stderr.getvalue(), 'bar\n')
+
+    def test_session(self):
+        # signals sent to pybuild's process group reach commands
+        command = '{} -c "import os; print(os.getsid(0))"'.format(sys.executable)
+        self.assertEqual(execute(command)['tail'], '{}\n'.format(os.getsid(0)))
+        self.assertNotEqual(execute(command, timeout=10)['tail'],
+                            '{}\n'.format(os.getsid(0)))
+
+    def test_argv(self):
+        result = execute(['echo', '$HOME'], shell=False)
+        self.assertEqual(result['tail'], '$HOME\n')
+
+    def test_timeout(self):
+        start = monotonic()
+        result = execute('sleep 30 & sleep 30', timeout=0.2)
+        self.assertTrue(result['timeout'])
+        self.assertNotEqual(result['returncode'], 0)
+        self.assertLess(monotonic() - start, 10)
+
+
+class TestTail(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+
+    def test_bounded_tail(self):
+        log_path = os.path.join(self.tmpdir.name, 'cmd.log')
+        command = "seq 1 10000; printf '\\377\\n'; exit 3"
+        result = execute(command, log_output=log_path, tail=100)
+        self.assertEqual(result['returncode'], 3)
+        self.assertLessEqual(len(result['tail']), 100)
+        self.assertTrue(result['tail'].endswith('10000\n\ufffd\n'))
+        with open(log_path, encoding='utf-8', errors='replace') as fp:
+            log = fp.read()
+        self.assertIn('\n1\n2\n', log)
+        self.assertTrue(log.endswith('10000\n\ufffd\n'))
+
+    def test_discarded_output(self):
+        result = execute('echo foo', tail=100)
+        self.assertEqual(result['returncode'], 0)
+        self.assertEqual(result['tail'], 'foo\n')
+
+
+class TestGather(unittest.TestCase):
+    def test_concurrent(self):
+        start = monotonic()
+        results = run_jobs([run('sleep 0.5; echo {}'.format(i)) for i in range(20)])
+        self.assertLess(monotonic() - start, 5)
+        self.assertEqual([i['tail'] for i in results],
+                         ['{}\n'.format(i) for i in range(20)])
+
+    def test_cancel_on_error(self):
+        async def fail():
+            await asyncio.sleep(0.1)
+            raise Exception('failed')
+
+        start = monotonic()
+        with self.assertRaisesRegex(Exception, 'failed'):
+            run_jobs([run('sleep 30'), fail()], limit=2)
+        self.assertLess(monotonic() - start, 10)
+
+    def test_cancel_kills_children(self):
+        async def fail():
+            await asyncio.sleep(0.2)
+            raise Exception('failed')
+
+        with TemporaryDirectory() as tmpdir:
+            fpath = os.path.join(tmpdir, 'foo')
+            with self.assertRaisesRegex(Exception, 'failed'):
+                run_jobs([run('sh -c "sleep 1; touch {}"; true'.format(fpath)), fail()])
+            time.sleep(1.5)
+            self.assertFalse(os.path.exists(fpath))
+
+    def test_longest_first(self):
+        started = []
+
+        async def job(i):
+            started.append(i)
+            return i
+
+        results = run_jobs([job(i) for i in range(4)], limit=1,
+                           estimates=[1, 5, 2, 4])
+        self.assertEqual(started, [1, 3, 2, 0])
+        self.assertEqual(results, [0, 1, 2, 3])
+
+
+class TestJobserver(unittest.TestCase):
+    def setUp(self):
+        self.read_fd, self.write_fd = os.pipe()
+        self.addCleanup(os.close, self.read_fd)
+        self.addCleanup(os.close, self.write_fd)
+        os.set_blocking(self.read_fd, False)
+        os.write(self.write_fd, b'+')  # make -j2: one token + implicit slot
+        client = jobserver.Client(self.read_fd, self.write_fd)
+        patcher = patch('dhpython.jobserver._client', client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_tokens(self):
+        start = monotonic()
+        run_jobs([run('sleep 0.5') for i in range(4)])
+        self.assertGreater(monotonic() - start, 0.9)
+        self.assertEqual(os.read(self.read_fd, 10), b'+')  # token returned
+
+    def test_many_event_loops(self):
+        # each run_jobs call uses a new event loop
+        for i in range(2):
+            results = run_jobs([run('sleep 0.2') for i in range(4)])
+            self.assertEqual([r['returncode'] for r in results], [0] * 4)
+        self.assertEqual(os.read(self.read_fd, 10), b'+')
@@ -1,9 +1,12 @@
 from tempfile import TemporaryDirectory
 from pathlib import Path
+from types import SimpleNamespace
 from unittest import TestCase
+import os
 
 from dhpython.fs import (
-    fix_merged_RECORD, merge_RECORD, merge_WHEEL, missing_lines)
+    fix_locations, fix_merged_RECORD, merge_RECORD, merge_WHEEL, missing_lines)
+from dhpython.interpreter import Interpreter
 
 
 class MergeWheelTestCase(TestCase):
@@ -72,3 +75,53 @@ class UpdateRecordTestCase(MergeWheelTestCase):
             'dist-info/WHEEL,sha256=447fb61fa39a067229e1cce8fc0953bfced53eac85d'
             '1844f5940f51c1fcba725,6',
         ))
+
+
+class FixLocationsTestCase(TestCase):
+    files = {
+        'usr/lib/python3.11/dist-packages/foo/__init__.py': 'foo',
+        'usr/lib/python3.11/dist-packages/foo/_foo.so': '3.11',
+        'usr/lib/python3.11/dist-packages/foo/__pycache__/x.pyc': '',
+        'usr/lib/python3.11/dist-packages/foo-1.dist-info/WHEEL': 'Tag: A\n',
+        'usr/lib/python3.11/dist-packages/foo-1.dist-info/RECORD': 'foo/__init__.py\n',
+        'usr/lib/python3.12/dist-packages/foo/__init__.py': 'foo',
+        'usr/lib/python3.12/dist-packages/foo/_foo.so': '3.12',
+        'usr/lib/python3.12/dist-packages/foo-1.dist-info/WHEEL': 'Tag: B\n',
+        'usr/lib/python3.12/dist-packages/foo-1.dist-info/RECORD': 'foo/__init__.py\n',
+        'usr/lib/python3.12/dist-packages/foo-1.dist-info/LICENSE': '',
+    }
+
+    def setUp(self):
+        self.tempdir = TemporaryDirectory()
+        self.addCleanup(self.tempdir.cleanup)
+        self.addCleanup(os.chdir, os.getcwd())
+        os.chdir(self.tempdir.name)
+        for fn, contents in self.files.items():
+            path = Path('debian/python3-foo', fn)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(contents)
+        self.options = SimpleNamespace(no_ext_rename=False, verbose=False)
+        self.sitedir = Path('debian/python3-foo/usr/lib/python3/dist-packages')
+
+    def fix_locations(self, dry_run=False):
+        return fix_locations('python3-foo', Interpreter('python3'),
+                             ['3.11', '3.12'], self.options, dry_run)
+
+    def test_dry_run(self):
+        report = list(self.fix_locations(dry_run=True).report())
+        self.assertIn('move debian/python3-foo/usr/lib/python3.11/dist-packages/foo/__init__.py'
+                      ' to debian/python3-foo/usr/lib/python3/dist-packages/foo/__init__.py', report)
+        self.assertIn('remove debian/python3-foo/usr/lib/python3.12/dist-packages/foo/__init__.py',
+                      report)
+        self.assertFalse(self.sitedir.exists())
+
+    def test_relocated(self):
+        self.fix_locations()
+        self.assertEqual(os.listdir('debian/python3-foo/usr/lib'), ['python3'])
+        interpreter = Interpreter('python3')
+        self.assertEqual(sorted(os.listdir(self.sitedir / 'foo')), sorted([
+            '__init__.py', interpreter.check_extname('_foo.so', '3.11'),
+            interpreter.check_extname('_foo.so', '3.12') or '_foo.so']))
+        self.assertEqual((self.sitedir / 'foo-1.dist-info/WHEEL').read_text(),
+                         'Tag: A\nTag: B\n')
+        self.assertNotIn('LICENSE', os.listdir(self.sitedir / 'foo-1.dist-info'))
@@ -0,0 +1,60 @@
+from os.path import join
+from tempfile import TemporaryDirectory
+from unittest.mock import patch
+import os
+import unittest
+
+from dhpython.build import impact
+
+
+def write(fpath, content=''):
+    os.makedirs(os.path.dirname(fpath), exist_ok=True)
+    with open(fpath, 'w') as fp:
+        fp.write(content)
+
+
+class TestImpact(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = TemporaryDirectory()
+        self.addCleanup(self.tempdir.cleanup)
+        self.path = join(self.tempdir.name, 'build')
+        self.cache = join(self.tempdir.name, 'imports.json')
+        write(join(self.path, 'foo/__init__.py'))
+        write(join(self.path, 'foo/bar.py'), 'from . import _speedups\n')
+        write(join(self.path, 'foo/_speedups.cpython-311-x86_64-linux-gnu.so'))
+        write(join(self.path, 'foo/baz.py'), 'import os\n')
+        write(join(self.path, 'tests/test_bar.py'), 'from foo import bar\n')
+        write(join(self.path, 'tests/test_baz.py'), 'import foo.baz\n')
+        write(join(self.path, 'tests/helpers.py'), 'x = 1\n')
+        write(join(self.path, 'tests/sub/__init__.py'))
+        write(join(self.path, 'tests/sub/test_rel.py'), 'from ..helpers import x\n')
+
+    def graph(self, files=None):
+        files = files or impact.digests(self.path)
+        return impact.import_graph(self.path, files, jobs=1, cache=self.cache)
+
+    def test_transitive(self):
+        graph = self.graph()
+        self.assertEqual(impact.affected_tests(graph, {'foo._speedups'}),
+                         ['tests.test_bar'])
+        self.assertEqual(impact.affected_tests(graph, {'foo.baz'}),
+                         ['tests.test_baz'])
+        # foo/__init__.py is imported by everything in foo package
+        self.assertEqual(impact.affected_tests(graph, {'foo'}),
+                         ['tests.test_bar', 'tests.test_baz'])
+        self.assertEqual(impact.affected_tests(graph, {'tests.helpers'}),
+                         ['tests.sub.test_rel'])
+
+    def test_cache(self):
+        graph = self.graph()
+        with patch('dhpython.build.impact._parse', side_effect=Exception):
+            self.assertEqual(self.graph(), graph)
+
+    def test_changed_modules(self):
+        previous = impact.digests(self.path)
+        write(join(self.path, 'foo/baz.py'), 'import sys\n')
+        current = impact.digests(self.path)
+        self.assertEqual(impact.changed_modules(previous, current), {'foo.baz'})
+        self.assertIsNone(impact.changed_modules(None, current))
+        write(join(self.path, 'foo/data.json'), '{}')
+        self.assertIsNone(impact.changed_modules(previous, impact.digests(self.path)))
@@ -0,0 +1,55 @@
+from os.path import dirname, join
+from shutil import copytree, which
+from tempfile import TemporaryDirectory
+import os
+import subprocess
+import sys
+import unittest
+
+ROOT = dirname(dirname(os.path.abspath(__file__)))
+VERSION = '{}.{}'.format(*sys.version_info[:2])
+
+
+@unittest.skipUnless(which('python' + VERSION), 'python{} not available'.format(VERSION))
+class TestPlan(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = TemporaryDirectory()
+        self.addCleanup(self.tempdir.cleanup)
+
+    def source_tree(self, name):
+        dpath = join(self.tempdir.name, name)
+        copytree(join(ROOT, 'tests/tpb01'), dpath)
+        os.mkdir(join(dpath, 'tests'))
+        open(join(dpath, 'tests/__init__.py'), 'w').close()
+        with open(join(dpath, 'tests/test_foo.py'), 'w') as fp:
+            fp.write('import unittest\nimport foo\n\n'
+                     'class TestFoo(unittest.TestCase):\n'
+                     '    def test_foo(self):\n'
+                     '        self.assertTrue(foo)\n')
+        return dpath
+
+    def pybuild(self, dpath, *args):
+        output = subprocess.run(
+            [join(ROOT, 'pybuild'), '-p', VERSION, '--no-test-cache'] + list(args),
+            cwd=dpath, env=dict(os.environ, PYTHONPATH=ROOT), check=True,
+            stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        return output.stdout.decode()
+
+    def installed(self, dpath):
+        result = set()
+        for root, dirs, files in os.walk(join(dpath, 'debian/tmp')):
+            result.update(os.path.relpath(join(root, fn), dpath) for fn in files)
+        return result
+
+    def test_same_as_normal_run(self):
+        normal = self.source_tree('normal')
+        output = self.pybuild(normal)
+        self.assertIn('Ran 1 test', output)
+
+        planned = self.source_tree('planned')
+        self.pybuild(planned, '--plan', 'plan.json')
+        self.assertEqual(os.listdir(join(planned, '.pybuild/cpython3_{}/build'.format(VERSION))), [])
+        output = self.pybuild(planned, '--execute-plan', 'plan.json')
+        self.assertIn('Ran 1 test', output)
+        self.assertEqual(self.installed(normal), self.installed(planned))
+        self.assertNotIn('tests/test_foo.py', '\n'.join(self.installed(planned)))
@@ -0,0 +1,69 @@
+from tempfile import TemporaryDirectory
+from unittest.mock import patch
+import os
+import unittest
+
+from dhpython.build import requires
+
+
+class TestStaticRequirements(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+
+    def write(self, fname, content):
+        fpath = os.path.join(self.tmpdir.name, fname)
+        os.makedirs(os.path.dirname(fpath), exist_ok=True)
+        with open(fpath, 'w') as fp:
+            fp.write(content)
+
+    def requirements(self):
+        return requires.requirements(self.tmpdir.name)
+
+    @unittest.skipIf(requires.tomllib is None, 'tomllib not available')
+    def test_pyproject(self):
+        self.write('pyproject.toml', '[project]\nname = "foo"\n'
+                   'dependencies = ["bar>=1.0", "baz; python_version < \'3.8\'"]\n')
+        self.assertEqual(self.requirements(), (
+            'pyproject.toml', ['bar>=1.0', "baz; python_version < '3.8'"]))
+
+    @unittest.skipIf(requires.tomllib is None, 'tomllib not available')
+    @patch('dhpython.build.requires.from_hook', return_value=['bar'])
+    def test_dynamic_dependencies(self, from_hook):
+        self.write('pyproject.toml', '[project]\nname = "foo"\n'
+                   'dynamic = ["dependencies"]\n')
+        self.assertEqual(self.requirements(),
+                         ('prepare_metadata_for_build_wheel', ['bar']))
+
+    def test_pkg_info(self):
+        self.write('PKG-INFO', 'Metadata-Version: 2.2\nName: foo\n'
+                   'Requires-Dist: bar\nRequires-Dist: baz[x]>=2\n')
+        self.assertEqual(self.requirements(), ('PKG-INFO', ['bar', 'baz[x]>=2']))
+
+    def test_old_pkg_info_ignored(self):
+        self.write('PKG-INFO', 'Metadata-Version: 2.1\nName: foo\n')
+        self.write('foo.egg-info/requires.txt',
+                   'bar\n\n[:python_version < "3.8"]\nbaz\n\n[test]\npytest\n')
+        self.assertEqual(self.requirements(), (
+            'requires.txt', ['bar', 'baz; python_version < "3.8"']))
+
+    def test_setup_cfg(self):
+        self.write('setup.cfg', '[options]\ninstall_requires =\n'
+                   '    bar\n    # comment\n    baz>=1\n')
+        self.write('setup.py', 'from setuptools import setup\nsetup()\n')
+        self.assertEqual(self.requirements(), ('setup.cfg', ['bar', 'baz>=1']))
+
+    @patch('dhpython.build.requires.from_hook', return_value=[])
+    def test_setup_py_overrides_setup_cfg(self, from_hook):
+        self.write('setup.cfg', '[options]\ninstall_requires = bar\n')
+        self.write('setup.py', 'from setuptools import setup\n'
+                   'setup(install_requires=["baz"])\n')
+        self.assertEqual(self.requirements()[0], 'prepare_metadata_for_build_wheel')
+
+
+class TestDebianRequires(unittest.TestCase):
+    @patch('dhpython.build.requires.guess_dependency',
+           side_effect=lambda impl, req: 'python3-' + req.split('>')[0])
+    def test_extras_skipped(self, guess_dependency):
+        self.assertEqual(requires.debian_requires(
+            'cpython3', ['foo>=1', 'bar; extra == "test"', 'foo']), ['python3-foo'])
@@ -0,0 +1,60 @@
+from tempfile import TemporaryDirectory
+from unittest.mock import patch
+import os
+import unittest
+
+from dhpython.build import scratch
+
+
+@patch('dhpython.build.scratch.available_space', return_value=1024 ** 4)
+class TestScratch(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.root = os.path.join(self.tmpdir.name, 'runtime')
+        os.mkdir(self.root)
+        self.env = {'XDG_RUNTIME_DIR': self.root}
+        self.home_dir = os.path.join(self.tmpdir.name, '.pybuild', 'cpython3_3.11')
+
+    def prepare(self, home_dir=None):
+        return scratch.prepare(home_dir or self.home_dir, self.tmpdir.name, self.env)
+
+    def test_unique_names(self, _available_space):
+        self.assertTrue(self.prepare())
+        other_home_dir = self.home_dir + '_foo'
+        self.assertTrue(self.prepare(other_home_dir))
+        target = os.readlink(self.home_dir)
+        self.assertEqual(os.path.dirname(target), self.root)
+        self.assertTrue(os.path.basename(target).startswith('pybuild-'))
+        self.assertEqual(os.stat(target).st_mode & 0o777, 0o700)
+        self.assertNotEqual(target, os.readlink(other_home_dir))
+        # next invocation uses the same directory
+        self.assertTrue(self.prepare())
+        self.assertEqual(target, os.readlink(self.home_dir))
+
+    def test_gone(self, _available_space):
+        self.prepare()
+        os.rmdir(os.readlink(self.home_dir))
+        self.assertTrue(self.prepare())
+        self.assertTrue(os.path.isdir(os.readlink(self.home_dir)))
+
+    def test_disk(self, _available_space):
+        os.makedirs(self.home_dir)
+        open(os.path.join(self.home_dir, 'foo'), 'w').close()
+        self.assertFalse(self.prepare())
+        self.assertFalse(os.path.islink(self.home_dir))
+
+    def test_release_keeps_stamps(self, _available_space):
+        self.prepare()
+        target = os.readlink(self.home_dir)
+        os.mkdir(os.path.join(self.home_dir, 'build'))
+        with open(os.path.join(self.home_dir, 'clean.stamp'), 'w') as fp:
+            fp.write('{}')
+        scratch.release(self.home_dir)
+        self.assertFalse(os.path.exists(target))
+        self.assertFalse(os.path.islink(self.home_dir))
+        self.assertEqual(os.listdir(self.home_dir), ['clean.stamp'])
+
+        self.assertTrue(self.prepare())
+        self.assertTrue(os.path.islink(self.home_dir))
+        self.assertEqual(os.listdir(self.home_dir), ['clean.stamp'])
@@ -0,0 +1,92 @@
+from tempfile import TemporaryDirectory
+from types import SimpleNamespace
+from unittest.mock import Mock, patch
+import os
+import unittest
+
+from dhpython.build import smoke
+
+
+class TestPureDigest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+
+    def write(self, version, fname, content):
+        fpath = os.path.join(self.tmpdir.name, version, fname)
+        os.makedirs(os.path.dirname(fpath), exist_ok=True)
+        with open(fpath, 'w') as fp:
+            fp.write(content)
+        return os.path.dirname(fpath)
+
+    def digest(self, version, extra=()):
+        return smoke.pure_digest([os.path.join(self.tmpdir.name, version, 'foo'),
+                                  os.path.join(self.tmpdir.name, 'missing')], extra)
+
+    def test_shebang_ignored(self):
+        self.write('3.11', 'foo/bar.py', '#! /usr/bin/python3.11\nprint(1)\n')
+        self.write('3.11', 'foo/__pycache__/bar.cpython-311.pyc', '')
+        self.write('3.12', 'foo/bar.py', '#! /usr/bin/python3.12\nprint(1)\n')
+        self.assertIsNotNone(self.digest('3.11'))
+        self.assertEqual(self.digest('3.11'), self.digest('3.12'))
+        self.assertNotEqual(self.digest('3.11'), self.digest('3.12', extra=('pytest',)))
+
+    def test_content_changed(self):
+        self.write('3.11', 'foo/bar.py', 'print(1)\n')
+        self.write('3.12', 'foo/bar.py', 'print(2)\n')
+        self.assertNotEqual(self.digest('3.11'), self.digest('3.12'))
+
+    def test_extension(self):
+        self.write('3.11', 'foo/bar.py', 'print(1)\n')
+        self.write('3.11', 'foo/_bar.cpython-311-x86_64-linux-gnu.so', '')
+        self.assertIsNone(self.digest('3.11'))
+
+
+@patch('dhpython.build.smoke._save_state')
+@patch('dhpython.build.smoke._digest', return_value='digest')
+class TestSmokeTest(unittest.TestCase):
+    def setUp(self):
+        cfg = SimpleNamespace(test_changed=False, test_tox=False)
+        self.plugin = SimpleNamespace(cfg=cfg)
+        self.func = Mock(return_value=True)
+        self.args = {'interpreter': 'python3.12'}
+
+    def run_test(self, state):
+        with patch('dhpython.build.smoke._load_state', return_value=state):
+            return smoke.test(self.plugin, self.func, {}, self.args)
+
+    @patch('dhpython.build.smoke.smoke_test', return_value=True)
+    def test_smoke_tests_only(self, smoke_test, _digest, save_state):
+        self.assertTrue(self.run_test({'digest': 'python3.11'}))
+        smoke_test.assert_called_once()
+        self.func.assert_not_called()
+        save_state.assert_not_called()
+
+    @patch('dhpython.build.smoke.smoke_test', side_effect=Exception('failed'))
+    def test_smoke_tests_failed(self, smoke_test, _digest, save_state):
+        self.assertTrue(self.run_test({'digest': 'python3.11'}))
+        self.func.assert_called_once_with({}, self.args)
+        save_state.assert_called_once_with('digest', 'python3.12')
+
+    @patch('dhpython.build.smoke.smoke_test')
+    def test_not_tested_yet(self, smoke_test, _digest, save_state):
+        self.assertTrue(self.run_test({'other': 'python3.11'}))
+        smoke_test.assert_not_called()
+        self.func.assert_called_once_with({}, self.args)
+        save_state.assert_called_once_with('digest', 'python3.12')
+
+
+class TestState(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.addCleanup(os.chdir, os.getcwd())
+        os.chdir(self.tmpdir.name)
+        os.mkdir('.pybuild')
+
+    def test_remove(self):
+        smoke._save_state('digest', 'python3.11')
+        self.assertEqual(smoke._load_state(), {'digest': 'python3.11'})
+        smoke.remove_state()
+        smoke.remove_state()
+        self.assertEqual(smoke._load_state(), {})
@@ -0,0 +1,76 @@
+from os import makedirs
+from os.path import dirname, join
+from shutil import rmtree
+from tempfile import TemporaryDirectory
+import unittest
+
+from dhpython.build.stamps import (is_done, output_fingerprint, remove_stamps,
+                                   write_stamp)
+
+
+class TestStamps(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.home_dir = self.tmpdir.name
+        for step in ('clean', 'configure', 'build'):
+            write_stamp(self.home_dir, step, 'args', 'source', 0)
+
+    def test_done(self):
+        self.assertTrue(is_done(self.home_dir, 'build', 'args', 'source'))
+        self.assertFalse(is_done(self.home_dir, 'build', 'args', 'changed'))
+        self.assertFalse(is_done(self.home_dir, 'install', 'args', 'source'))
+
+    def test_previous_step_invoked_again(self):
+        write_stamp(self.home_dir, 'configure', 'args', 'source', 0)
+        self.assertFalse(is_done(self.home_dir, 'build', 'args', 'source'))
+
+    def test_removed(self):
+        remove_stamps(self.home_dir)
+        remove_stamps(self.home_dir)
+        for step in ('clean', 'configure', 'build'):
+            self.assertFalse(is_done(self.home_dir, step, 'args', 'source'))
+
+
+class TestOutputFingerprint(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        root = self.tmpdir.name
+        self.args = {'build_dir': join(root, 'build'), 'destdir': join(root, 'debian/foo'),
+                     'install_dir': '/usr/lib/python3.11/dist-packages',
+                     'home_dir': root}
+        self.fpath = join(root, 'debian/foo/usr/lib/python3.11/dist-packages/foo.py')
+        makedirs(dirname(self.fpath))
+        makedirs(self.args['build_dir'])
+        with open(self.fpath, 'w') as fp:
+            fp.write('foo')
+
+    def test_other_steps(self):
+        self.assertIsNone(output_fingerprint('test', self.args))
+
+    def test_removed(self):
+        output = output_fingerprint('install', self.args)
+        write_stamp(self.tmpdir.name, 'install', 'args', 'source', 0, output)
+        self.assertTrue(is_done(self.tmpdir.name, 'install', 'args', 'source',
+                                output_fingerprint('install', self.args)))
+        rmtree(self.args['destdir'])  # f.e. dh_prep
+        self.assertEqual(output_fingerprint('install', self.args), 'missing')
+        self.assertFalse(is_done(self.tmpdir.name, 'install', 'args', 'source',
+                                 output_fingerprint('install', self.args)))
+
+    def test_changed(self):
+        output = output_fingerprint('install', self.args)
+        with open(self.fpath, 'w') as fp:
+            fp.write('changed')
+        self.assertNotEqual(output, output_fingerprint('install', self.args))
+
+    def test_test_files_ignored(self):
+        output = output_fingerprint('build', self.args)
+        makedirs(join(self.args['build_dir'], 'tests', '__pycache__'))
+        with open(join(self.tmpdir.name, 'testfiles_to_rm_before_install'), 'w') as fp:
+            fp.write(join(self.args['build_dir'], 'tests') + '\n')
+        self.assertEqual(output, output_fingerprint('build', self.args))
+        makedirs(join(self.args['build_dir'], 'foo'))
+        open(join(self.args['build_dir'], 'foo', 'bar.py'), 'w').close()
+        self.assertNotEqual(output, output_fingerprint('build', self.args))
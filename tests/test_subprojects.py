@@ -0,0 +1,46 @@
+from tempfile import TemporaryDirectory
+import os
+import unittest
+
+from dhpython.build import subprojects
+
+
+class TestSubprojects(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.log = os.path.join(self.tmpdir.name, 'log')
+
+    def build(self, *specs, limit=None):
+        # sh's positional args: --dir DIR --name NAME
+        script = 'sleep 0.$((${{#3}} % 3)); echo $3 >> {}; [ $3 != fail ]'.format(self.log)
+        subprojects.build([subprojects.parse(i) for i in specs],
+                          ['sh', '-c', script], limit, log_output=None)
+        with open(self.log) as fp:
+            return fp.read().split()
+
+    def test_parse(self):
+        self.assertEqual(subprojects.parse('src/foo/,dest-dir=debian/tmp,after=bar'), {
+            'dir': 'src/foo/', 'name': 'foo', 'destdir': 'debian/tmp', 'after': ['bar']})
+        self.assertRaises(ValueError, subprojects.parse, 'foo,nmae=bar')
+
+    def test_order(self):
+        items = [subprojects.parse(i) for i in ('a,after=b', 'b', 'c,after=a')]
+        self.assertEqual(subprojects.order(items), ['b', 'a', 'c'])
+        items.append(subprojects.parse('b,name=c'))
+        self.assertRaisesRegex(Exception, 'duplicated', subprojects.order, items)
+
+    def test_strip_argv(self):
+        self.assertEqual(subprojects.strip_argv(
+            ['pybuild', '--subproject', 'a', '-p', '3.11', '--subproject=b']),
+            ['pybuild', '-p', '3.11'])
+
+    def test_dependencies_built_first(self):
+        # "aa" sleeps longer than "b" and "ccc" but is built before "ccc"
+        self.assertEqual(self.build('aa', 'b', 'ccc,after=aa', limit=2),
+                         ['b', 'aa', 'ccc'])
+
+    def test_failure(self):
+        with self.assertRaisesRegex(Exception, 'fail subproject failed'):
+            self.build('fail', 'b,after=fail')
+        self.assertEqual(self.build('c'), ['fail', 'c'])
@@ -0,0 +1,88 @@
+from tempfile import TemporaryDirectory
+from types import SimpleNamespace
+import os
+import sys
+import unittest
+
+from dhpython.build import testcache
+
+
+class TestKey(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        build_dir = os.path.join(self.tmpdir.name, 'build')
+        os.makedirs(build_dir)
+        self.fpath = os.path.join(build_dir, 'foo.py')
+        with open(self.fpath, 'w') as fp:
+            fp.write('print(1)\n')
+        source_dir = os.path.join(self.tmpdir.name, 'src')
+        os.makedirs(source_dir)
+        self.tox_ini = os.path.join(source_dir, 'tox.ini')
+        with open(self.tox_ini, 'w') as fp:
+            fp.write('[tox]\n')
+        cfg = SimpleNamespace(test_nose=False, test_nose2=False, test_pytest=True,
+                              test_tox=False, custom_tests=False)
+        self.plugin = SimpleNamespace(NAME='custom', cfg=cfg)
+        self.context = {'ENV': {'HOME': '/home/foo', 'TMPDIR': '/tmp/foo', 'FOO': '1'}}
+        self.args = {'interpreter': SimpleNamespace(binary=lambda: sys.executable),
+                     'args': '', 'ENV': {'PYTHONPATH': build_dir},
+                     'build_dir': build_dir, 'dir': source_dir,
+                     'test_dir': os.path.join(self.tmpdir.name, 'missing')}
+        self.key = self.compute()
+
+    def compute(self, context=None, **args):
+        key = testcache._key.__wrapped__  # skip copying test files
+        return key(self.plugin, context or self.context, dict(self.args, **args))
+
+    def test_same_inputs(self):
+        self.assertEqual(self.key, self.compute())
+
+    def test_env(self):
+        self.assertNotEqual(self.key, self.compute({'ENV': {'FOO': '2'}}))
+        self.assertNotEqual(self.key, self.compute(ENV={'FOO': '2'}))
+
+    def test_volatile_env(self):
+        context = {'ENV': {'HOME': '/home/bar', 'TMPDIR': '/tmp/bar', 'FOO': '1'}}
+        self.assertEqual(self.key, self.compute(context))
+
+    def test_args(self):
+        self.assertNotEqual(self.key, self.compute(args='-k foo'))
+
+    def test_file_content(self):
+        with open(self.fpath, 'w') as fp:
+            fp.write('print(2)\n')
+        self.assertNotEqual(self.key, self.compute())
+
+    def test_source_file(self):
+        os.utime(self.tox_ini, (1, 1))  # content matters, not mtime
+        self.assertEqual(self.key, self.compute())
+        with open(self.tox_ini, 'w') as fp:
+            fp.write('[tox]\nenvlist = py3\n')
+        self.assertNotEqual(self.key, self.compute())
+
+
+class TestEvict(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+
+    def entry(self, name, mtime):
+        fpath = os.path.join(self.tmpdir.name, name + '.json')
+        with open(fpath, 'w') as fp:
+            fp.write('x' * 100)
+        os.utime(fpath, (mtime, mtime))
+
+    def test_least_recently_used(self):
+        self.entry('b', 1000)
+        self.entry('c', 3000)
+        self.entry('a', 2000)
+        self.entry('d', 4000)
+        testcache.evict(self.tmpdir.name, 250)
+        self.assertEqual(sorted(os.listdir(self.tmpdir.name)), ['c.json', 'd.json'])
+
+    def test_size_not_exceeded(self):
+        self.entry('a', 1000)
+        self.entry('b', 2000)
+        testcache.evict(self.tmpdir.name, 200)
+        self.assertEqual(sorted(os.listdir(self.tmpdir.name)), ['a.json', 'b.json'])
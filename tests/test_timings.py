@@ -0,0 +1,62 @@
+from argparse import Namespace
+from tempfile import TemporaryDirectory
+import json
+import os
+import unittest
+
+from dhpython.build import timings
+from dhpython.build.base import unittest_shards
+
+
+class TestTimings(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = TemporaryDirectory()
+        self.addCleanup(self.tempdir.cleanup)
+        self.cfg = Namespace(timings_dir=self.tempdir.name)
+
+    def test_moving_average(self):
+        db = timings.Timings(self.tempdir.name, 'foo')
+        db.record('test', {'3.11': 10})
+        db.record('test', {'3.11': 20})
+        self.assertEqual(db.get('test', '3.11'), 15)
+        with open(os.path.join(self.tempdir.name, 'timings.json')) as fp:
+            self.assertEqual(json.load(fp), {'foo': {'test': {'3.11': 15}}})
+
+    def test_shared_file(self):
+        timings.Timings(self.tempdir.name, 'foo').record('build', {'3.11': 1})
+        timings.Timings(self.tempdir.name, 'bar').record('build', {'3.11': 2})
+        self.assertEqual(timings.Timings(self.tempdir.name, 'foo').get('build', '3.11'), 1)
+        self.assertEqual(timings.Timings(self.tempdir.name, 'bar').get('build', '3.11'), 2)
+
+    def test_concurrent_instances(self):
+        first = timings.Timings(self.tempdir.name, 'foo')
+        second = timings.Timings(self.tempdir.name, 'foo')
+        first.record('test', {'3.11': 10})
+        second.record('test', {'3.12': 20})
+        first.record('test', {'3.11': 20})
+        self.assertEqual(first.get('test', '3.12'), 20)
+        with open(os.path.join(self.tempdir.name, 'timings.json')) as fp:
+            self.assertEqual(json.load(fp), {'foo': {'test': {'3.11': 15, '3.12': 20}}})
+
+    def test_estimator(self):
+        estimate = timings.estimator({'a': 2}, {'a': 100, 'b': 300})
+        self.assertEqual(estimate('a'), 2)
+        self.assertEqual(estimate('b'), 6)
+        self.assertEqual(timings.estimator({}, {'b': 300})('b'), 300)
+
+
+class TestUnittestShards(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = TemporaryDirectory()
+        self.addCleanup(self.tempdir.cleanup)
+        for name, size in (('test_a', 10), ('test_b', 20), ('test_c', 30)):
+            with open(os.path.join(self.tempdir.name, name + '.py'), 'w') as fp:
+                fp.write('#' * size)
+
+    def test_sizes(self):
+        shards = unittest_shards(self.tempdir.name, 2)
+        self.assertEqual(sorted(shards), [['test_a', 'test_b'], ['test_c']])
+
+    def test_estimates(self):
+        shards = unittest_shards(self.tempdir.name, 2, {'test_a': 60, 'test_c': 1})
+        self.assertEqual(sorted(shards), [['test_a'], ['test_b', 'test_c']])
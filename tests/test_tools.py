@@ -1,8 +1,13 @@
 from tempfile import TemporaryDirectory
+from unittest.mock import patch
 import os
+import re
 import unittest
 
-from dhpython.tools import relpath, move_matching_files
+from dhpython.tools import (
+    clean_bytecode, locked, parallel_jobs, relpath,
+    move_matching_files, sync_tree, trash, empty_trash, tree_fingerprint,
+    write_atomic)
 
 
 class TestRelpath(unittest.TestCase):
@@ -42,3 +47,172 @@ class TestMoveMatchingFiles(unittest.TestCase):
     def test_left_non_matching_file(self):
         self.assertTrue(os.path.exists(
             self.tmppath('foo/bar/a/b/c/spam/file.py')))
+
+
+class TestCleanBytecode(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        for path in ('foo/__pycache__/bar.cpython-39.pyc',
+                     'foo/bar.py',
+                     'foo/baz.pyc',
+                     '.git/objects/x.pyc',
+                     '.pybuild/cpython3_3.9/build/__pycache__/x.pyc'):
+            os.makedirs(os.path.dirname(self.tmppath(path)), exist_ok=True)
+            with open(self.tmppath(path), 'w') as fp:
+                fp.write('1234')
+        self.freed = clean_bytecode(self.tmpdir.name)
+
+    def tmppath(self, *path):
+        return os.path.join(self.tmpdir.name, *path)
+
+    def test_removed_bytecode(self):
+        self.assertFalse(os.path.exists(self.tmppath('foo/__pycache__')))
+        self.assertFalse(os.path.exists(self.tmppath('foo/baz.pyc')))
+
+    def test_left_source_files(self):
+        self.assertTrue(os.path.exists(self.tmppath('foo/bar.py')))
+
+    def test_skipped_vcs_and_pybuild_dirs(self):
+        self.assertTrue(os.path.exists(self.tmppath('.git/objects/x.pyc')))
+        self.assertTrue(os.path.exists(
+            self.tmppath('.pybuild/cpython3_3.9/build/__pycache__/x.pyc')))
+
+    def test_freed_bytes(self):
+        self.assertEqual(self.freed, 8)
+
+
+class TestTreeFingerprint(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        os.makedirs(self.tmppath('foo/.git'))
+        for path in ('foo/bar.py', 'foo/.git/HEAD'):
+            with open(self.tmppath(path), 'w') as fp:
+                fp.write('1234')
+        self.digest = tree_fingerprint(self.tmppath('foo'))
+
+    def tmppath(self, *path):
+        return os.path.join(self.tmpdir.name, *path)
+
+    def test_unchanged(self):
+        self.assertEqual(self.digest, tree_fingerprint(self.tmppath('foo')))
+
+    def test_vcs_changes_ignored(self):
+        with open(self.tmppath('foo/.git/HEAD'), 'w') as fp:
+            fp.write('5678')
+        self.assertEqual(self.digest, tree_fingerprint(self.tmppath('foo')))
+
+    def test_new_file(self):
+        open(self.tmppath('foo/baz.py'), 'w').close()
+        self.assertNotEqual(self.digest, tree_fingerprint(self.tmppath('foo')))
+
+    def test_content(self):
+        digest = tree_fingerprint(self.tmppath('foo'), content=True)
+        os.utime(self.tmppath('foo/bar.py'), (0, 0))
+        self.assertEqual(digest, tree_fingerprint(self.tmppath('foo'), content=True))
+        self.assertNotEqual(self.digest, tree_fingerprint(self.tmppath('foo')))
+
+
+class TestSyncTree(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        for path in ('src/foo/a.py', 'src/foo/b.py', 'src/scripts-3.11/bar'):
+            os.makedirs(os.path.dirname(self.tmppath(path)), exist_ok=True)
+            with open(self.tmppath(path), 'w') as fp:
+                fp.write(path)
+        self.manifest = self.tmppath('manifest')
+
+    def tmppath(self, *path):
+        return os.path.join(self.tmpdir.name, *path)
+
+    def sync(self, **kwargs):
+        return sync_tree(self.tmppath('src'), self.tmppath('dst'),
+                         re.compile('scripts-'), manifest=self.manifest, **kwargs)
+
+    def test_unchanged_files_skipped(self):
+        self.assertEqual(self.sync(), (2, 0, 0))
+        self.assertFalse(os.path.exists(self.tmppath('dst/scripts-3.11')))
+        mtime = os.stat(self.tmppath('dst/foo/a.py')).st_mtime_ns
+        with open(self.tmppath('src/foo/b.py'), 'a') as fp:
+            fp.write('changed')
+        self.assertEqual(self.sync(), (1, 1, 0))
+        self.assertEqual(os.stat(self.tmppath('dst/foo/a.py')).st_mtime_ns, mtime)
+        with open(self.tmppath('dst/foo/b.py')) as fp:
+            self.assertEqual(fp.read(), 'src/foo/b.pychanged')
+
+    def test_checksum(self):
+        self.sync()
+        with open(self.tmppath('src/foo/a.py'), 'w') as fp:
+            fp.write('src/foo/A.py')
+        os.utime(self.tmppath('src/foo/a.py'), ns=(0, 0))
+        os.utime(self.tmppath('dst/foo/a.py'), ns=(0, 0))
+        self.assertEqual(self.sync(), (0, 2, 0))
+        self.assertEqual(self.sync(checksum=True), (1, 1, 0))
+
+    def test_stale_files_removed(self):
+        self.sync()
+        open(self.tmppath('dst/foo/other.py'), 'w').close()
+        os.remove(self.tmppath('src/foo/b.py'))
+        self.assertEqual(self.sync(), (0, 1, 1))
+        self.assertEqual(sorted(os.listdir(self.tmppath('dst/foo'))),
+                         ['a.py', 'other.py'])
+        self.assertEqual(self.sync(delete=True), (0, 1, 1))
+        self.assertEqual(os.listdir(self.tmppath('dst/foo')), ['a.py'])
+
+
+class TestTrash(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        os.makedirs(self.tmppath('foo/bar/baz'))
+        os.mkdir(self.tmppath('trash'))
+
+    def tmppath(self, *path):
+        return os.path.join(self.tmpdir.name, *path)
+
+    def test_removed_in_background(self):
+        trash(self.tmppath('foo'), self.tmppath('trash'))
+        self.assertFalse(os.path.exists(self.tmppath('foo')))
+        empty_trash()
+        self.assertEqual(os.listdir(self.tmppath('trash')), [])
+
+    def test_missing_trash_dir(self):
+        trash(self.tmppath('foo'), self.tmppath('missing'))
+        self.assertFalse(os.path.exists(self.tmppath('foo')))
+        self.assertFalse(os.path.exists(self.tmppath('missing')))
+
+
+class TestLocked(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+
+    def test_non_blocking(self):
+        fpath = os.path.join(self.tmpdir.name, 'foo', 'lock')
+        with locked(fpath) as acquired:
+            self.assertTrue(acquired)
+            with locked(fpath, blocking=False) as acquired2:
+                self.assertFalse(acquired2)
+        with locked(fpath, blocking=False) as acquired:
+            self.assertTrue(acquired)
+
+    def test_write_atomic(self):
+        fpath = os.path.join(self.tmpdir.name, 'foo.json')
+        write_atomic(fpath, 'foo')
+        write_atomic(fpath, 'bar')
+        with open(fpath) as fp:
+            self.assertEqual(fp.read(), 'bar')
+        self.assertEqual(os.listdir(self.tmpdir.name), ['foo.json'])
+
+
+class TestParallelJobs(unittest.TestCase):
+    @patch('os.sched_getaffinity', return_value={0, 1, 2, 3})
+    def test_limited_by_cpus(self, _):
+        self.assertEqual(parallel_jobs({'DEB_BUILD_OPTIONS': 'nocheck parallel=2'}), 2)
+        self.assertEqual(parallel_jobs({'DEB_BUILD_OPTIONS': 'parallel=16'}), 4)
+
+    def test_not_requested(self):
+        self.assertEqual(parallel_jobs({'DEB_BUILD_OPTIONS': 'nocheck'}), 1)
+        self.assertEqual(parallel_jobs({}), 1)
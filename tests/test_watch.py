@@ -0,0 +1,52 @@
+from os.path import join
+from tempfile import TemporaryDirectory
+import os
+import subprocess
+import sys
+import unittest
+
+from dhpython.build import watch
+
+
+def write(fpath, content=''):
+    os.makedirs(os.path.dirname(fpath), exist_ok=True)
+    with open(fpath, 'w') as fp:
+        fp.write(content)
+
+
+class TestWatch(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = TemporaryDirectory()
+        self.addCleanup(self.tempdir.cleanup)
+        self.src = join(self.tempdir.name, 'src')
+        self.build = join(self.tempdir.name, 'build')
+        for root, prefix in ((self.src, 'src/'), (self.build, '')):
+            write(join(root, prefix + 'foo/__init__.py'))
+            write(join(root, prefix + 'foo/bar.py'), 'X = 1\n')
+
+    def test_snapshot_skips_build_dirs(self):
+        write(join(self.src, 'debian/tmp/foo.py'))
+        write(join(self.src, 'foo.egg-info/PKG-INFO'))
+        self.assertEqual(sorted(watch.snapshot(self.src)),
+                         ['src/foo/__init__.py', 'src/foo/bar.py'])
+
+    def test_sync_modules(self):
+        write(join(self.src, 'src/foo/bar.py'), 'X = 2\n')
+        modules, missing = watch.sync_modules(['src/foo/bar.py', 'src/foo/new.py'],
+                                              self.src, [self.build])
+        self.assertEqual(modules, {'foo.bar'})
+        self.assertEqual(missing, ['src/foo/new.py'])
+        with open(join(self.build, 'foo/bar.py')) as fp:
+            self.assertEqual(fp.read(), 'X = 2\n')
+
+
+class TestWatchOption(unittest.TestCase):
+    def test_single_step_action(self):
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        for action in ('--build', '--test', '--plan'):
+            process = subprocess.run(
+                [sys.executable, join(root, 'pybuild'), action, '--watch'],
+                stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True,
+                env=dict(os.environ, PYTHONPATH=root))
+            self.assertEqual(process.returncode, 2)
+            self.assertIn('--watch cannot be used with {}'.format(action), process.stderr)
@@ -0,0 +1,148 @@
+from io import BytesIO, StringIO
+from os.path import dirname, exists, join
+from tempfile import TemporaryDirectory
+import os
+import subprocess
+import sys
+import tarfile
+import time
+import unittest
+from unittest.mock import patch
+
+from dhpython.build.worker import _checked_members, execute_plan, rebase, serve
+
+ROOT = dirname(dirname(os.path.abspath(__file__)))
+
+
+def entry(root, step, command):
+    return {
+        'step': step, 'interpreter': 'python{version}', 'version': '3.11',
+        'cwd': root, 'env': {}, 'before': None, 'after': None,
+        'commands': [command], 'pybuild': None,
+        'dirs': {'dir': root, 'destdir': join(root, 'debian/tmp'),
+                 'build_dir': join(root, '.pybuild/cpython3_3.11/build'),
+                 'install_dir': '/usr/lib/python3/dist-packages',
+                 'home_dir': join(root, '.pybuild/cpython3_3.11')},
+        'inputs': [], 'outputs': []}
+
+
+class TestRebase(unittest.TestCase):
+    def test_nested(self):
+        self.assertEqual(rebase({'a': ['cd /src/x; make', 1]}, '/src', '/w'),
+                         {'a': ['cd /w/x; make', 1]})
+
+    def test_whole_path_only(self):
+        self.assertEqual(rebase('/build/foo /build/foo-2 /build/foo/bar /build/foobar',
+                                '/build/foo', '/w'),
+                         '/w /build/foo-2 /w/bar /build/foobar')
+        self.assertEqual(rebase('PYTHONPATH=/build/foo:/x/build/foo', '/build/foo', '/w'),
+                         'PYTHONPATH=/w:/x/build/foo')
+
+
+class TestServe(unittest.TestCase):
+    def test_tcp_without_token(self):
+        with patch.dict(os.environ):
+            os.environ.pop('PYBUILD_WORKER_TOKEN', None)
+            with self.assertRaisesRegex(Exception, 'PYBUILD_WORKER_TOKEN is required'):
+                serve('127.0.0.1:0')
+
+
+class TestWorker(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = TemporaryDirectory()
+        self.addCleanup(self.tempdir.cleanup)
+        self.root = join(self.tempdir.name, 'src')
+        checkout = join(self.tempdir.name, 'worker')
+        os.makedirs(join(self.root, '.pybuild/cpython3_3.11'))
+        os.makedirs(checkout)
+        with open(join(self.root, '.pybuild/cpython3_3.11/.pydistutils.cfg'), 'w') as fp:
+            fp.write('build-lib={}/.pybuild/cpython3_3.11/build\n'.format(self.root))
+        self.address = 'unix:' + join(self.tempdir.name, 'worker.sock')
+        worker = subprocess.Popen(
+            [sys.executable, '-c', 'from dhpython.build.worker import serve; '
+             'serve({!r})'.format(self.address)],
+            cwd=checkout, env=dict(os.environ, PYTHONPATH=ROOT,
+                                   PYBUILD_WORKER_TOKEN='secret'))
+        self.addCleanup(worker.wait)
+        self.addCleanup(worker.terminate)
+        for _ in range(100):
+            if exists(self.address[5:]):
+                break
+            time.sleep(0.05)
+        patcher = patch.dict(os.environ, PYBUILD_WORKER_TOKEN='secret')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_install(self):
+        home = '.pybuild/cpython3_3.11/'
+        plan = [
+            entry(self.root, 'build', 'cat {}.pydistutils.cfg; pwd'.format(home)),
+            entry(self.root, 'install', 'mkdir -p debian/tmp/usr && echo foo > debian/tmp/usr/foo'),
+        ]
+        output = StringIO()
+        execute_plan(plan, [self.address], output, self.root)
+        self.assertIn('python3.11| build-lib={}/worker/{}build'.format(
+            self.tempdir.name, home), output.getvalue())
+        self.assertIn('python3.11| {}/worker\n'.format(self.tempdir.name),
+                      output.getvalue())
+        with open(join(self.root, 'debian/tmp/usr/foo')) as fp:
+            self.assertEqual(fp.read(), 'foo\n')
+
+    def test_failure(self):
+        plan = [entry(self.root, 'build', 'exit 3')]
+        with self.assertRaisesRegex(Exception, 'exit code=3'):
+            execute_plan(plan, [self.address], StringIO(), self.root)
+        self.assertFalse(exists(join(self.root, 'debian')))
+
+    def test_socket_mode(self):
+        self.assertEqual(os.stat(self.address[5:]).st_mode & 0o777, 0o600)
+
+    def test_invalid_token(self):
+        plan = [entry(self.root, 'build', 'touch {}/x'.format(self.tempdir.name))]
+        with patch.dict(os.environ, PYBUILD_WORKER_TOKEN='wrong'):
+            with self.assertRaisesRegex(Exception, 'invalid token'):
+                execute_plan(plan, [self.address], StringIO(), self.root)
+        self.assertFalse(exists(join(self.tempdir.name, 'x')))
+
+    def test_file_outside_source_tree(self):
+        with patch('dhpython.build.worker._home_files',
+                   return_value={'.pybuild/../../x': 'foo'}):
+            with self.assertRaisesRegex(Exception, 'invalid file path'):
+                execute_plan([entry(self.root, 'build', 'true')], [self.address],
+                             StringIO(), self.root)
+        self.assertFalse(exists(join(self.tempdir.name, 'x')))
+
+
+class TestCheckedMembers(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = TemporaryDirectory()
+        self.addCleanup(self.tempdir.cleanup)
+
+    def check(self, *members):
+        data = BytesIO()
+        with tarfile.open(fileobj=data, mode='w:gz') as tar:
+            for name, kind, linkname in members:
+                info = tarfile.TarInfo(name)
+                info.type = kind
+                info.linkname = linkname
+                tar.addfile(info, BytesIO())
+        data.seek(0)
+        with tarfile.open(fileobj=data, mode='r:gz') as tar:
+            return [i.name for i in _checked_members(tar, self.tempdir.name)]
+
+    def test_valid(self):
+        self.assertEqual(self.check(('debian/tmp/usr/foo', tarfile.REGTYPE, ''),
+                                    ('debian/tmp/usr/bar', tarfile.SYMTYPE, 'foo'),
+                                    ('debian/tmp/usr/baz', tarfile.LNKTYPE,
+                                     'debian/tmp/usr/foo')),
+                         ['debian/tmp/usr/foo', 'debian/tmp/usr/bar', 'debian/tmp/usr/baz'])
+
+    def test_outside(self):
+        for member in (('/etc/foo', tarfile.REGTYPE, ''),
+                       ('debian/../../foo', tarfile.REGTYPE, ''),
+                       ('debian/foo', tarfile.SYMTYPE, '/etc'),
+                       ('debian/foo', tarfile.SYMTYPE, '../../etc'),
+                       ('debian/foo', tarfile.LNKTYPE, '/etc/passwd'),
+                       ('debian/foo', tarfile.CHRTYPE, '')):
+            with self.assertRaisesRegex(Exception, 'in archive'):
+                self.check(member)